@@ -0,0 +1,324 @@
+"""
+Incremental alert rules evaluated as diagnostic results are written.
+
+Rules are declared as plain dicts (DEFAULT_ALERT_RULES, or a JSON list in
+ALERT_RULES_FILE) and compiled once into predicates indexed by component,
+so a new result is only checked against the rules that can match it.
+
+Rule kinds:
+    match       fires on any result matching the rule's conditions
+    count       fires when `count` matching results for one vehicle fall
+                within `window_hours` (windowed counter per vehicle)
+    escalation  fires when a vehicle's severity for a component rises
+                above the previous result's
+
+Fired alerts are upserted into the `alerts` collection, one active alert
+per (rule, vehicle), so reading alerts is an indexed query and never
+re-evaluates anything.
+
+Rule state is shared through the `alert_counters` collection, so every API
+worker sees the results the others stored and restarts lose nothing. Count
+rules $inc one document per (rule, vehicle, component, hour) and sum the
+hours inside the window; a result therefore counts until its hour has left
+the window, a little earlier than exact timestamps would allow. Escalation
+rules swap the last severity atomically. Without a database (tests, tools)
+the same state is kept in memory.
+
+Configuration:
+    ALERT_RULES_FILE          optional JSON file replacing the default rules
+    ALERT_TRACKED_VEHICLES    vehicles whose counters are kept in memory (LRU) without a database
+"""
+
+import json
+import logging
+import os
+import uuid
+from collections import OrderedDict, deque
+from datetime import timedelta
+
+from analytics import bucket_start
+
+ALERT_RULES_FILE = os.environ.get('ALERT_RULES_FILE')
+ALERT_TRACKED_VEHICLES = int(os.environ.get('ALERT_TRACKED_VEHICLES', 100000))
+
+ALERT_COLLECTION = 'alerts'
+ALERT_COUNTER_COLLECTION = 'alert_counters'
+SEVERITY_RANK = {'low': 0, 'medium': 1, 'high': 2, 'critical': 3}
+RULE_KINDS = ('match', 'count', 'escalation')
+
+# Results not linked to a vehicle share one set of counters
+UNASSIGNED_VEHICLE = 'unassigned'
+
+DEFAULT_ALERT_RULES = [
+    {
+        'id': 'brake-attention',
+        'kind': 'match',
+        'component': 'Brakes',
+        'min_severity': 'medium',
+        'alert': {'type': 'warning', 'severity': 'medium', 'message': 'Brake system requires attention'},
+    },
+    {
+        'id': 'engine-concern',
+        'kind': 'match',
+        'component': 'Engine',
+        'min_severity': 'high',
+        'alert': {'type': 'error', 'severity': 'high', 'message': 'Engine diagnostics show concerns'},
+    },
+    {
+        'id': 'critical-finding',
+        'kind': 'match',
+        'min_severity': 'critical',
+        'alert': {'type': 'error', 'severity': 'critical', 'message': 'Critical {component} finding: {diagnosis}'},
+    },
+    {
+        'id': 'repeated-findings',
+        'kind': 'count',
+        'min_severity': 'medium',
+        'count': 3,
+        'window_hours': 168,
+        'alert': {'type': 'warning', 'severity': 'high',
+                  'message': '{count} {component} findings in the last {window_hours} hours'},
+    },
+    {
+        'id': 'severity-escalation',
+        'kind': 'escalation',
+        'alert': {'type': 'warning', 'severity': 'high',
+                  'message': '{component} severity escalated from {previous_severity} to {severity}'},
+    },
+]
+
+logger = logging.getLogger(__name__)
+
+
+class AlertRule:
+    """A compiled rule: conditions resolved to comparisons, per-vehicle state attached"""
+
+    def __init__(self, spec):
+        self.id = spec['id']
+        self.kind = spec.get('kind', 'match')
+        if self.kind not in RULE_KINDS:
+            raise ValueError(f"Alert rule {self.id}: unknown kind {self.kind!r}")
+        self.component = spec.get('component')
+        self.min_rank = SEVERITY_RANK[spec.get('min_severity', 'low')]
+        self.min_confidence = float(spec.get('min_confidence', 0.0))
+        self.count = int(spec.get('count', 1))
+        self.window_hours = spec.get('window_hours', 24)
+        self.window = timedelta(hours=float(self.window_hours))
+        self.alert = spec['alert']
+        # Per (vehicle, component) state: timestamps for count rules, last rank for escalation rules
+        self.state = OrderedDict()
+
+    def matches(self, result):
+        return (
+            SEVERITY_RANK.get(result['severity'], 0) >= self.min_rank and
+            result.get('confidence_score', 1.0) >= self.min_confidence
+        )
+
+    def _remember(self, key, value):
+        """Store per-vehicle state, evicting the least recently seen vehicles past the cap"""
+        self.state[key] = value
+        self.state.move_to_end(key)
+        while len(self.state) > ALERT_TRACKED_VEHICLES:
+            self.state.popitem(last=False)
+        return value
+
+    def evaluate(self, result, vehicle_key):
+        """Update this rule's in-memory state with a result; returns the message context if it fires"""
+        key = (vehicle_key, result['component'])
+
+        if self.kind == 'escalation':
+            rank = SEVERITY_RANK.get(result['severity'], 0)
+            previous = self.state.get(key)
+            self._remember(key, rank)
+            return self._escalated(result, rank, previous)
+
+        if not self.matches(result):
+            return None
+        if self.kind == 'match':
+            return self._context(result)
+
+        # count: timestamps of matching results inside the window
+        timestamps = self.state.get(key)
+        if timestamps is None:
+            timestamps = deque()
+        self._remember(key, timestamps)
+        now = result['created_at']
+        timestamps.append(now)
+        while timestamps and now - timestamps[0] > self.window:
+            timestamps.popleft()
+        return self._counted(result, len(timestamps))
+
+    def _context(self, result):
+        return {**result, 'window_hours': self.window_hours}
+
+    def _escalated(self, result, rank, previous):
+        if previous is None or rank <= previous or not self.matches(result):
+            return None
+        return {**self._context(result), 'previous_severity': _severity_name(previous)}
+
+    def _counted(self, result, count):
+        if count < self.count:
+            return None
+        return {**self._context(result), 'count': count}
+
+
+def _severity_name(rank):
+    return next(name for name, value in SEVERITY_RANK.items() if value == rank)
+
+
+def load_rule_specs():
+    if ALERT_RULES_FILE:
+        with open(ALERT_RULES_FILE) as f:
+            return json.load(f)
+    return DEFAULT_ALERT_RULES
+
+
+class AlertEngine:
+    """Evaluates compiled rules on each new result and stores the alerts they raise"""
+
+    def __init__(self, db, rule_specs=None):
+        self.collection = db[ALERT_COLLECTION] if db is not None else None
+        # Rule state shared by every API worker; in memory when there is no database
+        self.counters = db[ALERT_COUNTER_COLLECTION] if db is not None else None
+        self.rules = [AlertRule(spec) for spec in (rule_specs if rule_specs is not None else load_rule_specs())]
+        # Rules indexed by the component they apply to; None holds rules for every component
+        self._by_component = {}
+        for rule in self.rules:
+            self._by_component.setdefault(rule.component, []).append(rule)
+        self.evaluated = 0
+        self.fired = 0
+
+    async def ensure_indexes(self):
+        await self.collection.create_index([('status', 1), ('last_seen', -1)])
+        await self.collection.create_index([('vehicle_id', 1), ('status', 1), ('last_seen', -1)])
+        await self.collection.create_index('id', unique=True)
+        # At most one active alert per rule and vehicle
+        await self.collection.create_index(
+            [('rule_id', 1), ('vehicle_id', 1)], unique=True,
+            partialFilterExpression={'status': 'active'}, name='one_active_alert_per_rule'
+        )
+        await self.counters.create_index([('rule_id', 1), ('vehicle_id', 1), ('component', 1), ('bucket', 1)])
+        await self.counters.create_index('expires_at', expireAfterSeconds=0)
+
+    def _candidates(self, result):
+        return self._by_component.get(result['component'], []) + self._by_component.get(None, [])
+
+    def evaluate(self, result):
+        """Alerts fired by one result, as (rule, vehicle_key, context) triples, with in-memory state"""
+        self.evaluated += 1
+        vehicle_key = result.get('vehicle_id') or UNASSIGNED_VEHICLE
+        fired = []
+        for rule in self._candidates(result):
+            context = rule.evaluate(result, vehicle_key)
+            if context is not None:
+                fired.append((rule, vehicle_key, context))
+        return fired
+
+    async def evaluate_shared(self, result):
+        """Like evaluate, with count and escalation state kept in the counters collection"""
+        self.evaluated += 1
+        vehicle_key = result.get('vehicle_id') or UNASSIGNED_VEHICLE
+        fired = []
+        for rule in self._candidates(result):
+            if rule.kind == 'escalation':
+                rank = SEVERITY_RANK.get(result['severity'], 0)
+                previous = await self._swap_rank(rule, vehicle_key, result['component'], rank)
+                context = rule._escalated(result, rank, previous)
+            elif not rule.matches(result):
+                context = None
+            elif rule.kind == 'match':
+                context = rule._context(result)
+            else:
+                context = rule._counted(result, await self._count_in_window(rule, vehicle_key, result))
+            if context is not None:
+                fired.append((rule, vehicle_key, context))
+        return fired
+
+    async def _count_in_window(self, rule, vehicle_key, result):
+        """Add a matching result to its hour and return the matching results inside the window"""
+        now = result['created_at']
+        bucket = bucket_start(now, 'hour')
+        key = {'rule_id': rule.id, 'vehicle_id': vehicle_key, 'component': result['component']}
+        await self.counters.update_one(
+            {'_id': '|'.join([rule.id, vehicle_key, result['component'], bucket.isoformat()])},
+            {
+                '$inc': {'count': 1},
+                '$setOnInsert': {**key, 'bucket': bucket, 'expires_at': bucket + rule.window + timedelta(hours=1)},
+            },
+            upsert=True,
+        )
+        hours = int(rule.window / timedelta(hours=1)) + 2
+        buckets = await self.counters.find({**key, 'bucket': {'$gt': now - rule.window}}, {'count': 1}).to_list(hours)
+        return sum(doc['count'] for doc in buckets)
+
+    async def _swap_rank(self, rule, vehicle_key, component, rank):
+        """Store the latest severity rank for a vehicle's component; returns the one it replaced"""
+        from pymongo import ReturnDocument
+        from pymongo.errors import DuplicateKeyError
+
+        query = {'_id': '|'.join(['last', rule.id, vehicle_key, component])}
+        try:
+            previous = await self.counters.find_one_and_update(
+                query, {'$set': {'rank': rank}}, upsert=True, return_document=ReturnDocument.BEFORE
+            )
+        except DuplicateKeyError:
+            # Another worker inserted it first
+            previous = await self.counters.find_one_and_update(
+                query, {'$set': {'rank': rank}}, return_document=ReturnDocument.BEFORE
+            )
+        return previous['rank'] if previous else None
+
+    async def record(self, result):
+        """Evaluate a stored result and upsert the alerts it raises; returns the stored alerts"""
+        alerts = []
+        for rule, vehicle_key, context in await self.evaluate_shared(result):
+            self.fired += 1
+            alerts.append(await self._upsert_alert(rule, vehicle_key, context, result))
+        return alerts
+
+    async def _upsert_alert(self, rule, vehicle_key, context, result):
+        from pymongo import ReturnDocument
+        from pymongo.errors import DuplicateKeyError
+
+        update = {
+            '$set': {
+                'message': rule.alert['message'].format(**context),
+                'last_seen': result['created_at'],
+                'last_result_id': result['id'],
+                'component': result['component'],
+            },
+            '$inc': {'occurrences': 1},
+            '$setOnInsert': {
+                'id': str(uuid.uuid4()),
+                'type': rule.alert['type'],
+                'severity': rule.alert['severity'],
+                'first_seen': result['created_at'],
+            },
+        }
+        query = {'rule_id': rule.id, 'vehicle_id': vehicle_key, 'status': 'active'}
+        try:
+            return await self.collection.find_one_and_update(
+                query, update, projection={'_id': 0}, upsert=True, return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # A concurrent write inserted the active alert first; update that one
+            return await self.collection.find_one_and_update(
+                query, update, projection={'_id': 0}, return_document=ReturnDocument.AFTER
+            )
+
+    async def active(self, vehicle_id=None, limit=20):
+        query = {'status': 'active'}
+        if vehicle_id is not None:
+            query['vehicle_id'] = vehicle_id
+        return await self.collection.find(query, {'_id': 0}).sort('last_seen', -1).limit(limit).to_list(limit)
+
+    async def resolve(self, alert_id, resolved_at):
+        """Mark an active alert resolved; returns False if there was none"""
+        outcome = await self.collection.update_one(
+            {'id': alert_id, 'status': 'active'},
+            {'$set': {'status': 'resolved', 'resolved_at': resolved_at}},
+        )
+        return outcome.modified_count == 1
+
+    def stats(self):
+        return {'rules': len(self.rules), 'evaluated': self.evaluated, 'fired': self.fired}
@@ -0,0 +1,276 @@
+import logging
+import os
+import random
+import time
+
+import numpy as np
+
+from dsp_cache import get_basis
+from feature_pipeline import BLOCK_FRAMES, FeatureAccumulator, frame_count
+
+# Bumped whenever feature extraction or diagnosis logic changes, so stored
+# results produced by an older pipeline can be found and reprocessed.
+ANALYSIS_VERSION = 1
+
+# librosa's numba kernels are compiled with cache=True; pointing every worker
+# at one cache directory means each kernel is compiled once per deployment
+# rather than once per process. Must be set before numba is first imported.
+os.environ.setdefault('NUMBA_CACHE_DIR', '/tmp/eniguity-numba-cache')
+
+# Analysis parameters (librosa's defaults, which the original pipeline used)
+N_FFT = 2048
+HOP_LENGTH = 512
+N_MELS = 128
+N_MFCC = 13
+ROLL_PERCENT = 0.85
+
+# Fidelity profiles (see extract_audio_features). "quick" trades resolution
+# for speed when the service is overloaded: the first QUICK_MAX_SECONDS at
+# no more than QUICK_SAMPLE_RATE, with twice the hop.
+QUICK_SAMPLE_RATE = int(os.environ.get('QUICK_SAMPLE_RATE', 16000))
+QUICK_MAX_SECONDS = float(os.environ.get('QUICK_MAX_SECONDS', 10))
+
+FIDELITY_PROFILES = {
+    'quick': {'max_sample_rate': QUICK_SAMPLE_RATE, 'max_seconds': QUICK_MAX_SECONDS,
+              'hop_length': 2 * HOP_LENGTH, 'per_frame': False},
+    'full': {'max_sample_rate': None, 'max_seconds': None, 'hop_length': HOP_LENGTH, 'per_frame': False},
+    'detailed': {'max_sample_rate': None, 'max_seconds': None, 'hop_length': HOP_LENGTH, 'per_frame': True},
+}
+DEFAULT_PROFILE = 'full'
+
+# Clips at least this long are split into frame ranges analysed in parallel
+# (see analysis_pool.py); each range is at least PARALLEL_MIN_SECONDS / 2 long
+PARALLEL_MIN_SECONDS = float(os.environ.get('PARALLEL_MIN_SECONDS', 60))
+
+# Sample rates warmed up at startup (the common device recording rates)
+WARMUP_SAMPLE_RATES = [
+    int(rate) for rate in os.environ.get('WARMUP_SAMPLE_RATES', '8000,16000,22050,44100,48000').split(',') if rate
+]
+
+def _reduce_fidelity(audio_data, sr, spec):
+    """Truncate and downsample a clip for a cheaper profile; returns (audio, sr)"""
+    if spec['max_seconds'] is not None:
+        audio_data = audio_data[:int(spec['max_seconds'] * sr)]
+    target = spec['max_sample_rate']
+    if target is not None and sr > target:
+        from math import gcd
+        from scipy.signal import resample_poly
+
+        divisor = gcd(sr, target)
+        audio_data = resample_poly(audio_data, target // divisor, sr // divisor).astype(np.float32, copy=False)
+        sr = target
+    return audio_data, sr
+
+# Mock AI Analysis Functions
+def extract_audio_features(audio_data, sr, profile=DEFAULT_PROFILE):
+    """
+    Extract MFCC and other audio features.
+
+    profile: "full" (default) analyses the whole clip; "quick" the first
+    QUICK_MAX_SECONDS, downsampled to QUICK_SAMPLE_RATE, with a doubled
+    hop; "detailed" is "full" plus per-frame values under features['frames'].
+    """
+    try:
+        # Validate input
+        if len(audio_data) == 0:
+            logging.error("Audio data is empty")
+            return None
+            
+        if sr <= 0:
+            logging.error(f"Invalid sample rate: {sr}")
+            return None
+        
+        spec = FIDELITY_PROFILES.get(profile)
+        if spec is None:
+            logging.error(f"Unknown analysis profile: {profile}")
+            return None
+        source_duration = len(audio_data) / sr
+        audio_data, sr = _reduce_fidelity(audio_data, sr, spec)
+            
+        # Ensure audio is not too short (minimum 0.1 seconds)
+        min_samples = int(0.1 * sr)
+        if len(audio_data) < min_samples:
+            logging.warning(f"Audio too short ({len(audio_data)} samples), padding")
+            audio_data = np.pad(audio_data, (0, min_samples - len(audio_data)), mode='constant')
+        
+        # One float32 pass over the clip computes every feature; the window,
+        # mel filterbank, DCT basis and bin frequencies come from the basis cache
+        accumulator = _accumulator(len(audio_data), sr, profile)
+        accumulator.process(audio_data)
+        features = _finish(accumulator, profile, source_duration)
+        
+        logging.info(f"Successfully extracted features - Duration: {features['duration']:.2f}s, SR: {sr}")
+        return features
+        
+    except Exception as e:
+        logging.error(f"Feature extraction error: {e}")
+        return None
+
+def _accumulator(n_samples, sr, profile, **kwargs):
+    spec = FIDELITY_PROFILES[profile]
+    basis = get_basis(sr, n_fft=N_FFT, n_mels=N_MELS, n_mfcc=N_MFCC)
+    return FeatureAccumulator(basis, sr, n_samples, N_FFT, spec['hop_length'], N_MELS, ROLL_PERCENT,
+                              per_frame=spec['per_frame'], **kwargs)
+
+def _finish(accumulator, profile, source_duration):
+    features = accumulator.features(N_MFCC)
+    features['profile'] = profile
+    features['source_duration'] = source_duration
+    return features
+
+def segment_plan(n_samples, sr, profile, segments):
+    """
+    Frame ranges for analysing a clip in `segments` parallel parts, or []
+    when it should be analysed in one pass (short clips, the quick profile).
+    Ranges are whole blocks, so each part does the same work as in one pass.
+    """
+    spec = FIDELITY_PROFILES.get(profile)
+    duration = n_samples / sr if sr > 0 else 0
+    if spec is None or spec['max_seconds'] is not None or segments < 2 or duration < PARALLEL_MIN_SECONDS:
+        return []
+    # No part shorter than PARALLEL_MIN_SECONDS / 2
+    segments = min(segments, int(duration // (PARALLEL_MIN_SECONDS / 2)))
+    n_frames = frame_count(n_samples, spec['hop_length'])
+    blocks = -(-n_frames // BLOCK_FRAMES)
+    per_segment = -(-blocks // segments) * BLOCK_FRAMES
+    return [(first, min(first + per_segment, n_frames)) for first in range(0, n_frames, per_segment)]
+
+def mel_shape(n_samples, profile):
+    """Shape of the shared mel matrix that parallel segments of a clip write into"""
+    return frame_count(n_samples, FIDELITY_PROFILES[profile]['hop_length']), N_MELS
+
+def extract_segment(audio_data, sr, profile, first, stop, mel_frames):
+    """
+    Analyse frames [first, stop) of a whole clip (runs in a worker). Mel rows
+    go into the clip's shared mel matrix; the returned partial sums are
+    combined by merge_segments.
+    """
+    accumulator = _accumulator(len(audio_data), sr, profile, mel_frames=mel_frames)
+    accumulator.process(audio_data, first, stop)
+    return accumulator.partial(first, stop)
+
+def merge_segments(n_samples, sr, profile, partials, mel_frames):
+    """Clip features from every segment's partial sums; equal to a single pass over the clip"""
+    accumulator = _accumulator(n_samples, sr, profile, mel_frames=mel_frames)
+    for partial in sorted(partials, key=lambda partial: partial['first']):
+        accumulator.merge(partial)
+    features = _finish(accumulator, profile, n_samples / sr)
+    features['segments'] = len(partials)
+    return features
+
+def _mock_diagnoses():
+    """Candidate diagnoses, each with a freshly drawn confidence and cost"""
+    return [
+        {
+            'component': 'Engine',
+            'diagnosis': 'Timing Belt Wear Detected',
+            'confidence': random.uniform(0.75, 0.95),
+            'severity': 'high',
+            'recommendations': [
+                'Schedule timing belt replacement within 2 weeks',
+                'Check water pump condition during replacement',
+                'Inspect tensioner and idler pulleys'
+            ],
+            'estimated_cost': random.uniform(800, 1200),
+            'urgency': 'week'
+        },
+        {
+            'component': 'Engine',
+            'diagnosis': 'Healthy Engine Operation',
+            'confidence': random.uniform(0.85, 0.98),
+            'severity': 'low',
+            'recommendations': [
+                'Continue regular maintenance schedule',
+                'Monitor oil levels monthly',
+                'Next service in 3 months'
+            ],
+            'estimated_cost': 0,
+            'urgency': 'monitoring'
+        },
+        {
+            'component': 'Brakes',
+            'diagnosis': 'Brake Pad Wear - Front Axle',
+            'confidence': random.uniform(0.80, 0.94),
+            'severity': 'medium',
+            'recommendations': [
+                'Replace brake pads within 1 month',
+                'Inspect brake rotors for scoring',
+                'Check brake fluid level'
+            ],
+            'estimated_cost': random.uniform(300, 500),
+            'urgency': 'month'
+        },
+        {
+            'component': 'Engine',
+            'diagnosis': 'Bearing Wear - Connecting Rod',
+            'confidence': random.uniform(0.70, 0.88),
+            'severity': 'critical',
+            'recommendations': [
+                'IMMEDIATE ENGINE SHUTDOWN RECOMMENDED',
+                'Tow to certified mechanic',
+                'Complete engine inspection required'
+            ],
+            'estimated_cost': random.uniform(2000, 4000),
+            'urgency': 'immediate'
+        },
+        {
+            'component': 'Exhaust',
+            'diagnosis': 'Exhaust Leak - Mid-Pipe Section',
+            'confidence': random.uniform(0.65, 0.82),
+            'severity': 'medium',
+            'recommendations': [
+                'Repair exhaust leak within 2 weeks',
+                'Check emissions compliance',
+                'Inspect catalytic converter'
+            ],
+            'estimated_cost': random.uniform(200, 400),
+            'urgency': 'week'
+        }
+    ]
+
+def diagnose_batch(features_list):
+    """
+    Diagnose several clips in one pass: the rules are evaluated once over the
+    stacked (clips x features) matrix, then each clip draws its own diagnosis.
+    """
+    matrix = np.array([
+        [(features or {}).get('spectral_centroid', 0), (features or {}).get('zero_crossing_rate', 0)]
+        for features in features_list
+    ], dtype=np.float64).reshape(-1, 2)
+    # Simulate intelligent selection based on features:
+    # high frequency suggests brake squeal, high ZCR might suggest engine issues
+    brakes = matrix[:, 0] > 2000
+    engine = ~brakes & (matrix[:, 1] > 0.1)
+    
+    results = []
+    for is_brakes, is_engine in zip(brakes, engine):
+        diagnoses_db = _mock_diagnoses()
+        if is_brakes:
+            results.append([d for d in diagnoses_db if d['component'] == 'Brakes'][0])
+        elif is_engine:
+            results.append(random.choice([d for d in diagnoses_db if d['component'] == 'Engine']))
+        else:
+            results.append(random.choice(diagnoses_db))
+    return results
+
+def generate_mock_diagnosis(features):
+    """Generate realistic mock automotive diagnosis based on audio features"""
+    return diagnose_batch([features])[0]
+
+def warm_up_analysis(sample_rates=None):
+    """
+    Run the full feature extraction path on a synthetic clip per sample rate,
+    so filterbank construction, FFT plans and scratch buffers are ready
+    before the first real request instead of built during it.
+    """
+    started = time.monotonic()
+    for sr in sample_rates or WARMUP_SAMPLE_RATES:
+        t = np.arange(sr) / sr
+        clip = (0.5 * np.sin(2 * np.pi * 120 * t) + 0.05 * np.random.randn(sr)).astype(np.float32)
+        extract_audio_features(clip, sr)
+        # The quick profile has its own sample rate and hop
+        if sr >= QUICK_SAMPLE_RATE:
+            extract_audio_features(clip, sr, profile='quick')
+    elapsed = time.monotonic() - started
+    logging.info(f"Analysis warm-up finished in {elapsed:.2f}s (pid {os.getpid()})")
+    return elapsed
@@ -0,0 +1,161 @@
+"""
+Process pool for feature extraction on shared-memory PCM.
+
+Decoded audio is handed to the workers as a PCMDescriptor; each worker
+attaches to the segment and runs extract_audio_features on the view, so
+the samples are never pickled. The API process keeps ownership of the
+segment and releases it whatever happens to the worker.
+
+Clips of PARALLEL_MIN_SECONDS or more are split into frame ranges (see
+analysis.segment_plan) analysed by several workers at once. The workers
+share one mel matrix segment, also owned by the API process, and a final
+job merges their partial sums into exactly the single-pass features, so a
+long clip's latency scales down with the number of workers.
+
+Large PCM WAV uploads skip decoding altogether: they are passed as a
+wav_mmap.WavFile, and each worker maps the same file and reads only its
+own frames.
+
+Configuration:
+    ANALYSIS_WORKERS  worker processes (0 runs extraction inline)
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from analysis import (
+    DEFAULT_PROFILE, extract_audio_features, extract_segment, mel_shape, merge_segments, segment_plan,
+    warm_up_analysis,
+)
+from pcm_shm import PCMSegment, attach
+from wav_mmap import WavFile
+
+ANALYSIS_WORKERS = int(os.environ.get('ANALYSIS_WORKERS', min(4, os.cpu_count() or 1)))
+
+logger = logging.getLogger(__name__)
+
+
+def open_audio(source):
+    """Mono float32 samples of a PCMDescriptor (shared memory) or WavFile (memory-mapped)"""
+    if isinstance(source, WavFile):
+        return source.open()
+    return attach(source)
+
+
+def extract_features_from_segment(source, sample_rate, profile=DEFAULT_PROFILE):
+    """Run feature extraction on shared-memory or memory-mapped audio (runs in a worker process)"""
+    with open_audio(source) as audio_data:
+        return extract_audio_features(audio_data, sample_rate, profile)
+
+
+def extract_segment_from_shm(source, mel_descriptor, sample_rate, profile, first, stop):
+    """Analyse one frame range of a clip (runs in a worker process)"""
+    with open_audio(source) as audio_data, attach(mel_descriptor) as mel_frames:
+        return extract_segment(audio_data, sample_rate, profile, first, stop, mel_frames)
+
+
+def merge_segments_from_shm(mel_descriptor, n_samples, sample_rate, profile, partials):
+    """Combine segment partials into clip features (runs in a worker process)"""
+    with attach(mel_descriptor) as mel_frames:
+        return merge_segments(n_samples, sample_rate, profile, partials, mel_frames)
+
+
+def _report_ready():
+    time.sleep(0.05)
+    return os.getpid()
+
+
+class AnalysisPool:
+    """Async front end over a process pool that reads PCM from shared memory"""
+
+    def __init__(self, workers=ANALYSIS_WORKERS):
+        self.workers = workers
+        self._executor = None
+
+    def start(self):
+        if self.workers > 0:
+            # Every worker (including replacements after a crash) warms up
+            # before taking its first job
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=warm_up_analysis
+            )
+            logger.info(f"Analysis pool started with {self.workers} workers")
+
+    def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    async def warm_up(self):
+        """Block until every worker (or this process, when inline) has warmed up"""
+        loop = asyncio.get_running_loop()
+        if self._executor is None:
+            await loop.run_in_executor(None, warm_up_analysis)
+            return
+        # Each worker runs its initializer before its first job, so a pid coming
+        # back means that worker is warm. Jobs linger briefly so that one fast
+        # worker cannot answer for the others.
+        ready = set()
+        while len(ready) < self.workers:
+            pids = await asyncio.gather(*(
+                loop.run_in_executor(self._executor, _report_ready) for _ in range(self.workers)
+            ))
+            ready.update(pids)
+        logger.info(f"Analysis pool warm: {len(ready)} workers")
+
+    async def extract_features(self, segment, sample_rate, profile=DEFAULT_PROFILE):
+        """Extract features from an owned PCMSegment; the caller still releases it"""
+        if self._executor is None:
+            return extract_audio_features(segment.array, sample_rate, profile)
+
+        return await self._extract(segment.descriptor, segment.array.shape[0], sample_rate, profile)
+
+    async def extract_wav_features(self, wav, profile=DEFAULT_PROFILE):
+        """Extract features from a memory-mapped WAV file without decoding it"""
+        if self._executor is None:
+            with wav.open() as audio_data:
+                return extract_audio_features(audio_data, wav.sample_rate, profile)
+        return await self._extract(wav, wav.frames, wav.sample_rate, profile)
+
+    async def _extract(self, source, n_samples, sample_rate, profile):
+        ranges = segment_plan(n_samples, sample_rate, profile, self.workers)
+        if not ranges:
+            return await self._run(extract_features_from_segment, source, sample_rate, profile)
+
+        mel = PCMSegment.allocate(mel_shape(n_samples, profile))
+        try:
+            partials = await asyncio.gather(*(
+                self._run(extract_segment_from_shm, source, mel.descriptor, sample_rate, profile, first, stop)
+                for first, stop in ranges
+            ))
+            return await self._run(merge_segments_from_shm, mel.descriptor, n_samples, sample_rate, profile, partials)
+        finally:
+            mel.release()
+
+    async def run(self, fn, *args):
+        """Run a picklable function in a worker, or inline without workers"""
+        if self._executor is None:
+            return fn(*args)
+        return await self._run(fn, *args)
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        executor = self._executor
+        try:
+            return await loop.run_in_executor(executor, fn, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM-killed); replace the pool for the next request,
+            # once, even when several segments of a clip saw the same crash
+            if self._executor is executor:
+                logger.error("Analysis worker crashed, restarting analysis pool")
+                executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+                self.start()
+            raise
@@ -0,0 +1,137 @@
+"""
+Fleet analytics over pre-aggregated rollups.
+
+Every stored diagnostic result increments one rollup document per time
+bucket (hour and day) keyed by component, severity and vehicle cohort
+(make/model), using $inc upserts. Analytics queries read only the rollup
+documents in the requested range, so their cost is proportional to the
+number of buckets rather than to the number of raw results.
+
+Rollup document:
+    _id            "<granularity>|<bucket iso>|<component>|<severity>|<make>|<model>"
+    granularity    'hour' | 'day'
+    bucket         start of the bucket (UTC)
+    component, severity, make, model
+    count, confidence_sum, estimated_cost_sum
+"""
+
+import logging
+from datetime import datetime, timedelta
+
+ROLLUP_COLLECTION = 'analytics_rollups'
+GRANULARITIES = ('hour', 'day')
+
+# Results not linked to a vehicle are rolled up under this cohort
+UNKNOWN_COHORT = 'unknown'
+
+logger = logging.getLogger(__name__)
+
+
+def bucket_start(timestamp, granularity):
+    """Start of the hour or day containing `timestamp`"""
+    if granularity == 'hour':
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    if granularity == 'day':
+        return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"Unknown granularity {granularity!r}")
+
+
+def vehicle_cohort(vehicle):
+    """(make, model) cohort for a vehicle document, or the unknown cohort"""
+    if not vehicle:
+        return UNKNOWN_COHORT, UNKNOWN_COHORT
+    return str(vehicle.get('make') or UNKNOWN_COHORT), str(vehicle.get('model') or UNKNOWN_COHORT)
+
+
+def rollup_updates(result, vehicle=None):
+    """(filter, update) pairs incrementing every rollup a result belongs to"""
+    make, model = vehicle_cohort(vehicle)
+    updates = []
+    for granularity in GRANULARITIES:
+        bucket = bucket_start(result['created_at'], granularity)
+        key = '|'.join([granularity, bucket.isoformat(), result['component'], result['severity'], make, model])
+        updates.append((
+            {'_id': key},
+            {
+                '$inc': {
+                    'count': 1,
+                    'confidence_sum': float(result.get('confidence_score') or 0.0),
+                    'estimated_cost_sum': float(result.get('estimated_cost') or 0.0),
+                },
+                '$setOnInsert': {
+                    'granularity': granularity,
+                    'bucket': bucket,
+                    'component': result['component'],
+                    'severity': result['severity'],
+                    'make': make,
+                    'model': model,
+                },
+            },
+        ))
+    return updates
+
+
+def rollup_corrections(result, changes, vehicle=None):
+    """(filter, update) pairs moving a result from its rollups to those of its changed diagnosis"""
+    removals = [
+        (query, {'$inc': {field: -value for field, value in update['$inc'].items()}})
+        for query, update in rollup_updates(result, vehicle)
+    ]
+    return removals + rollup_updates({**result, **changes}, vehicle)
+
+
+def summarize_buckets(buckets):
+    """Totals per component and per severity across rollup documents"""
+    by_component, by_severity = {}, {}
+    total = 0
+    for bucket in buckets:
+        by_component[bucket['component']] = by_component.get(bucket['component'], 0) + bucket['count']
+        by_severity[bucket['severity']] = by_severity.get(bucket['severity'], 0) + bucket['count']
+        total += bucket['count']
+    return {'total': total, 'by_component': by_component, 'by_severity': by_severity}
+
+
+class FleetAnalytics:
+    """Maintains and queries the rollup collection"""
+
+    def __init__(self, db):
+        self.collection = db[ROLLUP_COLLECTION]
+
+    async def ensure_indexes(self):
+        await self.collection.create_index([('granularity', 1), ('bucket', 1), ('component', 1), ('severity', 1)])
+        await self.collection.create_index([('granularity', 1), ('make', 1), ('model', 1), ('bucket', 1)])
+
+    async def record(self, result, vehicle=None):
+        """Fold one stored diagnostic result into its hour and day rollups"""
+        from pymongo import UpdateOne
+
+        requests = [UpdateOne(query, update, upsert=True) for query, update in rollup_updates(result, vehicle)]
+        await self.collection.bulk_write(requests, ordered=False)
+
+    async def rollups(self, granularity='day', since=None, until=None, component=None, severity=None,
+                      make=None, model=None):
+        """Rollup documents in [since, until), oldest first"""
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"Unknown granularity {granularity!r}")
+        query = {'granularity': granularity}
+        if since is not None or until is not None:
+            query['bucket'] = {}
+            if since is not None:
+                query['bucket']['$gte'] = bucket_start(since, granularity)
+            if until is not None:
+                query['bucket']['$lt'] = until
+        for field, value in (('component', component), ('severity', severity), ('make', make), ('model', model)):
+            if value is not None:
+                query[field] = value
+
+        buckets = []
+        async for doc in self.collection.find(query, {'_id': 0}).sort('bucket', 1):
+            doc['avg_confidence'] = doc['confidence_sum'] / doc['count'] if doc['count'] else 0.0
+            buckets.append(doc)
+        return buckets
+
+    async def summary(self, days=7, **filters):
+        """Totals over the last `days` days, from day rollups"""
+        since = datetime.utcnow() - timedelta(days=days)
+        buckets = await self.rollups('day', since=since, **filters)
+        return {'since': bucket_start(since, 'day'), 'days': days, **summarize_buckets(buckets)}
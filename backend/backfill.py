@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Bulk reprocessing / backfill engine for stored diagnostic results.
+
+Walks `diagnostic_results` in `_id` order, re-runs feature extraction and
+diagnosis for every result produced by an older ANALYSIS_VERSION and writes
+the updates back with unordered bulk writes. Archived audio is decoded and
+analysed the way the API analyses an upload, with the result's own profile.
+Progress is checkpointed after every batch so an interrupted run resumes
+where it stopped. Results that failed are listed in the checkpoint and
+retried first on the next run.
+
+A result whose diagnosis changes is moved from its old analytics rollups to
+its new ones. Alerts and baselines are not replayed: alerts already fired
+for the old verdict stay in the alert history, and vehicle and cohort
+baselines keep the features they observed. The report counts the changed
+diagnoses ('diagnosis_changed') so that drift can be judged.
+
+Usage:
+    python backfill.py --workers 4 --batch-size 200 --rate 50
+    python backfill.py --reset          # ignore the checkpoint and start over
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from bson import ObjectId
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+from analysis import ANALYSIS_VERSION, DEFAULT_PROFILE, extract_audio_features, generate_mock_diagnosis
+from analytics import ROLLUP_COLLECTION, rollup_corrections
+from decoders import decode_audio
+from uploads import SNIFF_BYTES, sniff_format
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+DEFAULT_CHECKPOINT = ROOT_DIR / '.backfill_checkpoint.json'
+
+# Result fields that analytics rollups are keyed or summed on
+ROLLUP_FIELDS = ('component', 'severity', 'confidence_score', 'estimated_cost')
+
+logger = logging.getLogger(__name__)
+
+
+def reprocess_record(job):
+    """Recompute features and diagnosis for one stored result (runs in a worker process)"""
+    source, payload, profile = job
+    if source == 'audio':
+        # Same decoder and feature pipeline as an upload to the API
+        with open(payload, 'rb') as f:
+            fmt = sniff_format(f.read(SNIFF_BYTES))
+        if fmt is None:
+            raise ValueError("Archived audio is not in a supported format")
+        audio_data, sample_rate = decode_audio(payload, fmt)
+        features = extract_audio_features(audio_data, sample_rate, profile)
+    else:
+        # Only the stored summary features are available
+        features = payload
+
+    if features is None:
+        raise ValueError("Failed to extract audio features")
+
+    diagnosis_data = generate_mock_diagnosis(features)
+    return {
+        'audio_features': features,
+        'analysis_version': ANALYSIS_VERSION,
+        'component': diagnosis_data['component'],
+        'diagnosis': diagnosis_data['diagnosis'],
+        'confidence_score': diagnosis_data['confidence'],
+        'severity': diagnosis_data['severity'],
+        'recommendations': diagnosis_data['recommendations'],
+        'estimated_cost': diagnosis_data['estimated_cost'],
+        'urgency_level': diagnosis_data['urgency'],
+    }
+
+
+def build_job(doc):
+    """Pick the best stored input for a result: original audio first, then stored features"""
+    audio_path = doc.get('audio_path')
+    if audio_path and os.path.exists(audio_path):
+        return ('audio', audio_path, doc.get('analysis_profile') or DEFAULT_PROFILE)
+    if doc.get('audio_features'):
+        return ('features', doc['audio_features'], None)
+    return None
+
+
+def new_checkpoint():
+    """Resume state for a run starting from the beginning of the collection"""
+    return {
+        'analysis_version': ANALYSIS_VERSION,
+        'last_id': None,
+        'processed': 0,
+        'updated': 0,
+        'skipped': 0,
+        'diagnosis_changed': 0,
+        # Results to retry on the next run
+        'failed_ids': [],
+    }
+
+
+def load_checkpoint(path):
+    """Load the resume state written by a previous run for the current ANALYSIS_VERSION"""
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return new_checkpoint()
+    if state.get('analysis_version') != ANALYSIS_VERSION:
+        # Checkpoint belongs to an older backfill; the new version starts over
+        return new_checkpoint()
+    state['last_id'] = ObjectId(state['last_id']) if state.get('last_id') else None
+    state['failed_ids'] = [ObjectId(doc_id) for doc_id in state.get('failed_ids', [])]
+    state.setdefault('diagnosis_changed', 0)
+    return state
+
+
+def save_checkpoint(path, state):
+    """Atomically persist the resume state"""
+    data = dict(state, last_id=str(state['last_id']) if state['last_id'] else None,
+                failed_ids=[str(doc_id) for doc_id in state['failed_ids']])
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+async def _rollup_requests(db, changed):
+    """Rollup moves for results whose diagnosis changed: (stored doc, update) pairs"""
+    vehicle_ids = list({doc['vehicle_id'] for doc, _ in changed if doc.get('vehicle_id')})
+    vehicles = {}
+    if vehicle_ids:
+        found = await db.vehicles.find({'id': {'$in': vehicle_ids}}, {'_id': 0}).to_list(len(vehicle_ids))
+        vehicles = {vehicle['id']: vehicle for vehicle in found}
+    return [
+        UpdateOne(query, update, upsert=True)
+        for doc, update in changed
+        for query, update in rollup_corrections(doc, update, vehicles.get(doc.get('vehicle_id')))
+    ]
+
+
+async def _reprocess(db, pool, docs, state):
+    """Reprocess and write back one batch of stored results; failures are kept for retry"""
+    loop = asyncio.get_running_loop()
+    jobs = [(doc, build_job(doc)) for doc in docs]
+    runnable = [(doc, job) for doc, job in jobs if job is not None]
+    state['skipped'] += len(jobs) - len(runnable)
+
+    results = await asyncio.gather(
+        *(loop.run_in_executor(pool, reprocess_record, job) for _, job in runnable),
+        return_exceptions=True
+    )
+
+    failed_ids = set(state['failed_ids'])
+    operations = []
+    changed = []
+    for (doc, _), update in zip(runnable, results):
+        if isinstance(update, Exception):
+            logger.error(f"Backfill failed for result {doc['_id']}: {update}")
+            failed_ids.add(doc['_id'])
+            continue
+        failed_ids.discard(doc['_id'])
+        operations.append(UpdateOne({'_id': doc['_id']}, {'$set': update}))
+        if doc.get('created_at') and any(doc.get(field) != update[field] for field in ROLLUP_FIELDS):
+            changed.append((doc, update))
+    state['failed_ids'] = sorted(failed_ids)
+
+    if operations:
+        write_result = await db.diagnostic_results.bulk_write(operations, ordered=False)
+        state['updated'] += write_result.modified_count
+    if changed:
+        await db[ROLLUP_COLLECTION].bulk_write(await _rollup_requests(db, changed), ordered=False)
+        state['diagnosis_changed'] += len(changed)
+
+
+async def run_backfill(db, workers=None, batch_size=200, rate=None,
+                       checkpoint_path=DEFAULT_CHECKPOINT, reset=False):
+    """
+    Reprocess stale diagnostic results.
+
+    `rate` caps throughput in clips/sec so a backfill sharing the database
+    and CPU with live traffic does not starve it.
+    """
+    state = new_checkpoint() if reset else load_checkpoint(checkpoint_path)
+    query = {'analysis_version': {'$ne': ANALYSIS_VERSION}}
+    started = time.monotonic()
+    run_processed = 0
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Results that failed on an earlier run; those since updated elsewhere drop out
+        retry_ids = list(state['failed_ids'])
+        for start in range(0, len(retry_ids), batch_size):
+            ids = retry_ids[start:start + batch_size]
+            docs = await db.diagnostic_results.find({**query, '_id': {'$in': ids}}).to_list(len(ids))
+            gone = set(ids) - {doc['_id'] for doc in docs}
+            state['failed_ids'] = [doc_id for doc_id in state['failed_ids'] if doc_id not in gone]
+            await _reprocess(db, pool, docs, state)
+            save_checkpoint(checkpoint_path, state)
+            run_processed += len(docs)
+
+        while True:
+            batch_query = dict(query)
+            if state['last_id'] is not None:
+                batch_query['_id'] = {'$gt': state['last_id']}
+            docs = await db.diagnostic_results.find(batch_query).sort('_id', 1).limit(batch_size).to_list(batch_size)
+            if not docs:
+                break
+
+            batch_started = time.monotonic()
+            await _reprocess(db, pool, docs, state)
+            state['processed'] += len(docs)
+            state['last_id'] = docs[-1]['_id']
+            save_checkpoint(checkpoint_path, state)
+            run_processed += len(docs)
+
+            batch_elapsed = time.monotonic() - batch_started
+            logger.info(
+                f"Backfill batch: {len(docs)} results in {batch_elapsed:.2f}s "
+                f"({len(docs) / max(batch_elapsed, 1e-9):.1f} clips/sec), total processed {state['processed']}"
+            )
+
+            # Rate limit: sleep off whatever time the batch finished early
+            if rate:
+                min_elapsed = run_processed / rate
+                elapsed = time.monotonic() - started
+                if elapsed < min_elapsed:
+                    await asyncio.sleep(min_elapsed - elapsed)
+
+    elapsed = time.monotonic() - started
+    report = {
+        'processed': run_processed,
+        'updated': state['updated'],
+        'skipped': state['skipped'],
+        'failed': len(state['failed_ids']),
+        'diagnosis_changed': state['diagnosis_changed'],
+        'elapsed_seconds': round(elapsed, 3),
+        'clips_per_second': round(run_processed / elapsed, 2) if elapsed > 0 else 0.0,
+    }
+    logger.info(f"Backfill complete: {report}")
+    return report
+
+
+async def main(args):
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    try:
+        db = client[os.environ['DB_NAME']]
+        report = await run_backfill(
+            db,
+            workers=args.workers,
+            batch_size=args.batch_size,
+            rate=args.rate,
+            checkpoint_path=args.checkpoint,
+            reset=args.reset,
+        )
+        print(json.dumps(report, indent=2))
+    finally:
+        client.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Reprocess stored diagnostic results")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument('--batch-size', type=int, default=200, help="Results fetched per batch")
+    parser.add_argument('--rate', type=float, default=None, help="Max clips/sec (default: unlimited)")
+    parser.add_argument('--checkpoint', default=str(DEFAULT_CHECKPOINT), help="Checkpoint file for resume")
+    parser.add_argument('--reset', action='store_true', help="Ignore an existing checkpoint")
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,212 @@
+"""
+Per-vehicle acoustic baselines and anomaly scores.
+
+Each vehicle keeps running statistics of its feature vector (13 mean MFCCs,
+spectral centroid, spectral rolloff and zero-crossing rate). A new clip is
+scored against the baseline *before* being folded into it, with a
+Mahalanobis distance in the baseline's own units, so what counts as unusual
+depends on how that particular vehicle normally sounds.
+
+Updates are online and O(d^2):
+    Welford           mean and co-moment matrix M2 (covariance = M2 / (n - 1))
+    Sherman-Morrison  the inverse of S = M2 + prior, which changes by a
+                      rank-1 term per clip, so no d x d inversion is needed
+                      per clip. S is re-inverted exactly every
+                      BASELINE_REFRESH_EVERY updates to shed rounding drift.
+
+The prior is BASELINE_PRIOR_WEIGHT pseudo-observations of a diagonal
+covariance with typical per-feature spreads (FEATURE_PRIOR_STD). It keeps
+scores finite while a vehicle has fewer clips than dimensions.
+
+Baselines are stored as one small document per vehicle with the mean and
+the upper triangles of M2 and of the precision matrix packed as float64
+binary arrays (about 2.3 KB for d = 16).
+
+Configuration:
+    BASELINE_MIN_SAMPLES      clips needed before scores are reported
+    BASELINE_PRIOR_WEIGHT     pseudo-observations of the prior covariance
+    BASELINE_REFRESH_EVERY    updates between exact re-inversions
+"""
+
+import logging
+import os
+from datetime import datetime
+
+import numpy as np
+
+BASELINE_MIN_SAMPLES = int(os.environ.get('BASELINE_MIN_SAMPLES', 5))
+BASELINE_PRIOR_WEIGHT = float(os.environ.get('BASELINE_PRIOR_WEIGHT', 2.0))
+BASELINE_REFRESH_EVERY = int(os.environ.get('BASELINE_REFRESH_EVERY', 64))
+
+BASELINE_COLLECTION = 'acoustic_baselines'
+
+# Bumped when the feature vector layout changes; older baselines are restarted
+BASELINE_VERSION = 1
+
+N_MFCC_FEATURES = 13
+FEATURE_NAMES = [f"mfcc_{i}" for i in range(N_MFCC_FEATURES)] + [
+    'spectral_centroid', 'spectral_rolloff', 'zero_crossing_rate'
+]
+FEATURE_DIM = len(FEATURE_NAMES)
+
+# Typical clip-to-clip spread of each feature, used only as the prior
+FEATURE_PRIOR_STD = np.array([20.0] + [8.0] * (N_MFCC_FEATURES - 1) + [300.0, 600.0, 0.02])
+
+# Optimistic-concurrency retries when two clips for one vehicle race
+MAX_UPDATE_ATTEMPTS = 3
+
+logger = logging.getLogger(__name__)
+
+_TRIU = np.triu_indices(FEATURE_DIM)
+
+
+def feature_vector(features):
+    """Fixed-order float64 vector from an extract_audio_features dict"""
+    mfcc = list(features.get('mfcc_features') or [])[:N_MFCC_FEATURES]
+    mfcc += [0.0] * (N_MFCC_FEATURES - len(mfcc))
+    return np.array(mfcc + [
+        features.get('spectral_centroid', 0.0),
+        features.get('spectral_rolloff', 0.0),
+        features.get('zero_crossing_rate', 0.0),
+    ], dtype=np.float64)
+
+
+def pack_symmetric(matrix):
+    return np.ascontiguousarray(matrix[_TRIU], dtype='<f8').tobytes()
+
+
+def unpack_symmetric(data, dim=FEATURE_DIM):
+    values = np.frombuffer(data, dtype='<f8')
+    matrix = np.zeros((dim, dim))
+    matrix[_TRIU] = values
+    return matrix + np.triu(matrix, 1).T
+
+
+def prior_matrix(weight=BASELINE_PRIOR_WEIGHT):
+    return np.diag(weight * FEATURE_PRIOR_STD ** 2)
+
+
+class RunningBaseline:
+    """Welford mean/co-moment plus the precision of the regularised scatter matrix"""
+
+    __slots__ = ('n', 'mean', 'm2', 'precision', 'updates_since_refresh')
+
+    def __init__(self, n=0, mean=None, m2=None, precision=None, updates_since_refresh=0):
+        self.n = n
+        self.mean = np.zeros(FEATURE_DIM) if mean is None else mean
+        self.m2 = np.zeros((FEATURE_DIM, FEATURE_DIM)) if m2 is None else m2
+        self.precision = np.linalg.inv(prior_matrix()) if precision is None else precision
+        self.updates_since_refresh = updates_since_refresh
+
+    def score(self, x, min_samples=BASELINE_MIN_SAMPLES):
+        """Mahalanobis distance of x from the baseline, or None with too few samples"""
+        if self.n < max(min_samples, 1):
+            return None
+        diff = x - self.mean
+        # Covariance estimate (M2 + prior) / (effective n - 1), inverted via the stored precision
+        dof = self.n - 1 + BASELINE_PRIOR_WEIGHT
+        return float(np.sqrt(max(dof * (diff @ self.precision @ diff), 0.0)))
+
+    def update(self, x):
+        """Fold one observation in: O(d^2)"""
+        self.n += 1
+        delta = x - self.mean
+        self.mean = self.mean + delta / self.n
+        # Welford: M2 += (n-1)/n * delta delta^T, the same rank-1 term S receives
+        weight = (self.n - 1) / self.n
+        self.m2 += weight * np.outer(delta, delta)
+
+        self.updates_since_refresh += 1
+        if self.updates_since_refresh >= BASELINE_REFRESH_EVERY:
+            self.refresh()
+        elif weight > 0:
+            projected = self.precision @ delta
+            self.precision -= np.outer(projected, projected) * (weight / (1.0 + weight * (delta @ projected)))
+
+    def merge(self, other):
+        """New baseline covering both sets of observations (Chan et al.), with an exact precision"""
+        n = self.n + other.n
+        if n == 0:
+            return RunningBaseline()
+        delta = other.mean - self.mean
+        merged = RunningBaseline(
+            n=n,
+            mean=self.mean + delta * (other.n / n),
+            m2=self.m2 + other.m2 + np.outer(delta, delta) * (self.n * other.n / n),
+        )
+        merged.refresh()
+        return merged
+
+    def refresh(self):
+        """Recompute the precision exactly from M2 (O(d^3), amortised)"""
+        self.precision = np.linalg.inv(self.m2 + prior_matrix())
+        self.updates_since_refresh = 0
+
+    def covariance(self):
+        return self.m2 / max(self.n - 1, 1)
+
+    def to_document(self):
+        return {
+            'version': BASELINE_VERSION,
+            'n': self.n,
+            'mean': np.ascontiguousarray(self.mean, dtype='<f8').tobytes(),
+            'm2': pack_symmetric(self.m2),
+            'precision': pack_symmetric(self.precision),
+            'updates_since_refresh': self.updates_since_refresh,
+        }
+
+    @classmethod
+    def from_document(cls, doc):
+        if not doc or doc.get('version') != BASELINE_VERSION:
+            return cls()
+        return cls(
+            n=doc['n'],
+            mean=np.frombuffer(doc['mean'], dtype='<f8').copy(),
+            m2=unpack_symmetric(doc['m2']),
+            precision=unpack_symmetric(doc['precision']),
+            updates_since_refresh=doc.get('updates_since_refresh', 0),
+        )
+
+
+class BaselineStore:
+    """Per-vehicle baselines persisted in Mongo"""
+
+    def __init__(self, db):
+        self.collection = db[BASELINE_COLLECTION]
+        self.conflicts = 0
+
+    async def ensure_indexes(self):
+        await self.collection.create_index('vehicle_id', unique=True)
+
+    async def get(self, vehicle_id):
+        return RunningBaseline.from_document(await self.collection.find_one({'vehicle_id': vehicle_id}))
+
+    async def observe(self, vehicle_id, features):
+        """
+        Score a clip's features against the vehicle's baseline, then fold them in.
+        Returns {'anomaly_score', 'baseline_samples'} as seen before this clip.
+        """
+        from pymongo.errors import DuplicateKeyError
+
+        x = feature_vector(features)
+        for _ in range(MAX_UPDATE_ATTEMPTS):
+            doc = await self.collection.find_one({'vehicle_id': vehicle_id})
+            baseline = RunningBaseline.from_document(doc)
+            observed = {'anomaly_score': baseline.score(x), 'baseline_samples': baseline.n}
+            baseline.update(x)
+            update = {**baseline.to_document(), 'vehicle_id': vehicle_id, 'updated_at': datetime.utcnow()}
+            try:
+                if doc is None:
+                    await self.collection.insert_one(update)
+                    return observed
+                # Only replace the version we read; a concurrent update makes us retry
+                outcome = await self.collection.replace_one(
+                    {'vehicle_id': vehicle_id, 'n': doc.get('n'), 'version': doc.get('version')}, update
+                )
+                if outcome.modified_count == 1:
+                    return observed
+            except DuplicateKeyError:
+                pass
+            self.conflicts += 1
+        logger.warning(f"Baseline for vehicle {vehicle_id} not updated after {MAX_UPDATE_ATTEMPTS} conflicting writes")
+        return observed
@@ -0,0 +1,245 @@
+"""
+Streaming bulk import of vehicle profiles.
+
+The request body (NDJSON or CSV) is parsed as it arrives. Each row is
+validated on its own, and valid rows are upserted on VIN in unordered
+bulk_write batches. While one batch is being written, the next one is
+parsed. Invalid rows and rejected writes are reported per row, and the rest
+of the import carries on.
+
+Configuration:
+    BULK_IMPORT_BATCH_SIZE   upserts per bulk_write
+    BULK_IMPORT_MAX_ERRORS   row errors listed in the summary (the count is exact)
+    BULK_IMPORT_MAX_LINE_BYTES  longest row accepted; longer rows are reported and skipped
+"""
+
+import asyncio
+import csv
+import json
+import os
+import re
+import time
+
+from pydantic import ValidationError
+
+from vehicle_search import search_keys
+
+BULK_IMPORT_BATCH_SIZE = int(os.environ.get('BULK_IMPORT_BATCH_SIZE', 1000))
+BULK_IMPORT_MAX_ERRORS = int(os.environ.get('BULK_IMPORT_MAX_ERRORS', 1000))
+BULK_IMPORT_MAX_LINE_BYTES = int(os.environ.get('BULK_IMPORT_MAX_LINE_BYTES', 64 * 1024))
+
+IMPORT_FORMATS = ('ndjson', 'csv')
+
+# 17 characters, digits and capitals except I, O and Q
+VIN_PATTERN = re.compile(r'^[A-HJ-NPR-Z0-9]{17}$')
+
+# Fields a re-import may change; id and created_at are kept from the first import
+UPDATABLE_FIELDS = ('make', 'model', 'year', 'mileage')
+
+
+def import_format(content_type):
+    """Import format implied by a Content-Type header, or None"""
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    if content_type in ('application/x-ndjson', 'application/ndjson', 'application/jsonl'):
+        return 'ndjson'
+    if content_type in ('text/csv', 'application/csv'):
+        return 'csv'
+    return None
+
+
+def normalize_vin(value):
+    vin = str(value or '').strip().upper()
+    if not VIN_PATTERN.match(vin):
+        raise ValueError("vin must be 17 characters (letters except I, O, Q and digits)")
+    return vin
+
+
+async def iter_lines(chunks, max_line_bytes=BULK_IMPORT_MAX_LINE_BYTES):
+    """
+    Complete UTF-8 text lines from a byte stream. A line over max_line_bytes
+    comes out as None and its bytes are dropped as they arrive, so memory
+    stays bounded by the cap however long the line is.
+    """
+    # Pieces of the unfinished line; a newline byte never occurs inside a
+    # multi-byte UTF-8 character, so only whole lines need decoding
+    parts = []
+    size = 0
+    overlong = False
+    async for chunk in chunks:
+        start = 0
+        while True:
+            end = chunk.find(b'\n', start)
+            piece = chunk[start:] if end == -1 else chunk[start:end]
+            if not overlong:
+                size += len(piece)
+                overlong = size > max_line_bytes
+                if overlong:
+                    parts = []
+                else:
+                    parts.append(piece)
+            if end == -1:
+                break
+            yield None if overlong else b''.join(parts).decode('utf-8')
+            parts, size, overlong = [], 0, False
+            start = end + 1
+    if overlong:
+        yield None
+    elif size:
+        yield b''.join(parts).decode('utf-8')
+
+
+def _overlong_row(max_line_bytes):
+    return f"row is longer than {max_line_bytes} bytes"
+
+
+async def iter_ndjson_rows(chunks, max_line_bytes=BULK_IMPORT_MAX_LINE_BYTES):
+    """(row number, dict or error message) per non-blank line"""
+    row_number = 0
+    async for line in iter_lines(chunks, max_line_bytes):
+        if line is None:
+            row_number += 1
+            yield row_number, _overlong_row(max_line_bytes)
+            continue
+        if not line.strip():
+            continue
+        row_number += 1
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield row_number, f"invalid JSON: {e}"
+            continue
+        yield row_number, row if isinstance(row, dict) else "row must be a JSON object"
+
+
+async def iter_csv_rows(chunks, max_line_bytes=BULK_IMPORT_MAX_LINE_BYTES):
+    """(row number, dict or error message) per CSV record; quoted fields may span lines"""
+    header = None
+    record = ''
+    row_number = 0
+    async for line in iter_lines(chunks, max_line_bytes):
+        if line is None or len(record) + len(line) > max_line_bytes:
+            # Also bounds a quoted field that never closes
+            record = ''
+            row_number += 1
+            yield row_number, _overlong_row(max_line_bytes)
+            continue
+        record = f"{record}\n{line}" if record else line
+        # An odd number of quotes means a quoted field continues on the next line
+        if record.count('"') % 2:
+            continue
+        values = next(csv.reader([record]), [])
+        record = ''
+        if not any(value.strip() for value in values):
+            continue
+        if header is None:
+            header = [value.strip().lower() for value in values]
+            continue
+        row_number += 1
+        yield row_number, {key: value for key, value in zip(header, values) if value != ''}
+    if record:
+        row_number += 1
+        yield row_number, "unterminated quoted field"
+
+
+def _error_message(error):
+    if isinstance(error, ValidationError):
+        return '; '.join(f"{'.'.join(str(part) for part in item['loc'])}: {item['msg']}" for item in error.errors())
+    return str(error)
+
+
+class VehicleImport:
+    """Accumulates per-row outcomes and upserts validated vehicles in batches"""
+
+    def __init__(self, collection, model, batch_size=BULK_IMPORT_BATCH_SIZE, max_errors=BULK_IMPORT_MAX_ERRORS):
+        self.collection = collection
+        self.model = model
+        self.batch_size = batch_size
+        self.max_errors = max_errors
+        self.rows = 0
+        self.inserted = 0
+        self.updated = 0
+        self.failed = 0
+        self.errors = []
+
+    def error(self, row_number, message):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'row': row_number, 'error': message})
+
+    def validate(self, row_number, row):
+        """Upsert request for a valid row, or None after recording the error"""
+        from pymongo import UpdateOne
+
+        if isinstance(row, str):
+            self.error(row_number, row)
+            return None
+        try:
+            vin = normalize_vin(row.get('vin'))
+            vehicle = self.model(**{**row, 'vin': vin}).model_dump()
+        except (ValueError, TypeError) as e:
+            self.error(row_number, _error_message(e))
+            return None
+        return UpdateOne(
+            {'vin': vin},
+            {
+                '$set': {**{field: vehicle[field] for field in UPDATABLE_FIELDS}, **search_keys(vehicle)},
+                '$setOnInsert': {field: value for field, value in vehicle.items()
+                                 if field not in UPDATABLE_FIELDS and field != 'vin'},
+            },
+            upsert=True,
+        )
+
+    async def write(self, batch):
+        """Run one unordered bulk_write; batch is a list of (row number, UpdateOne)"""
+        from pymongo.errors import BulkWriteError
+
+        try:
+            result = await self.collection.bulk_write([request for _, request in batch], ordered=False)
+            details = result.bulk_api_result
+        except BulkWriteError as e:
+            details = e.details
+            for write_error in details.get('writeErrors', []):
+                self.error(batch[write_error['index']][0], write_error.get('errmsg', 'write failed'))
+        self.inserted += details.get('nUpserted', 0)
+        self.updated += details.get('nMatched', 0)
+
+    async def run(self, rows):
+        """Consume (row number, row) pairs; returns the import summary"""
+        started = time.monotonic()
+        batch = []
+        in_flight = None
+        async for row_number, row in rows:
+            self.rows += 1
+            request = self.validate(row_number, row)
+            if request is None:
+                continue
+            batch.append((row_number, request))
+            if len(batch) >= self.batch_size:
+                # Keep one write in flight while the next batch is parsed
+                if in_flight is not None:
+                    await in_flight
+                in_flight = asyncio.create_task(self.write(batch))
+                batch = []
+        if in_flight is not None:
+            await in_flight
+        if batch:
+            await self.write(batch)
+        return self.summary(time.monotonic() - started)
+
+    def summary(self, elapsed):
+        return {
+            'rows': self.rows,
+            'inserted': self.inserted,
+            'updated': self.updated,
+            'failed': self.failed,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors),
+            'elapsed_seconds': round(elapsed, 3),
+            'rows_per_second': round(self.rows / elapsed, 1) if elapsed > 0 else None,
+        }
+
+
+async def import_vehicles(chunks, fmt, collection, model):
+    """Import vehicles from a stream of NDJSON or CSV bytes"""
+    rows = iter_csv_rows(chunks) if fmt == 'csv' else iter_ndjson_rows(chunks)
+    return await VehicleImport(collection, model).run(rows)
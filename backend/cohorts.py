@@ -0,0 +1,225 @@
+"""
+Cohort acoustic baselines.
+
+A vehicle with no history of its own is scored against vehicles like it:
+the same make and model, year band and mileage band. Each cohort keeps the
+same running statistics as a per-vehicle baseline (see baselines.py), held
+in memory so a clip is scored and folded in without a database round trip
+(one 16 x 16 matrix-vector product).
+
+Every COHORT_SNAPSHOT_SECONDS, the clips a worker has seen since its last
+snapshot are merged into the stored cohort document (parallel Welford
+merge, optimistic replace on n), and the worker adopts the merged result.
+Several workers can therefore feed the same cohorts without overwriting
+each other. A worker that dies loses at most one interval of clips.
+
+Configuration:
+    COHORT_YEAR_BAND          model years per band
+    COHORT_MILEAGE_BAND       miles per band
+    COHORT_MIN_SAMPLES        clips a cohort needs before it scores
+    COHORT_SNAPSHOT_SECONDS   seconds between snapshots to MongoDB
+"""
+
+import asyncio
+import logging
+import os
+from datetime import datetime
+
+import numpy as np
+
+from baselines import FEATURE_NAMES, RunningBaseline, feature_vector
+
+COHORT_YEAR_BAND = int(os.environ.get('COHORT_YEAR_BAND', 5))
+COHORT_MILEAGE_BAND = int(os.environ.get('COHORT_MILEAGE_BAND', 50000))
+COHORT_MIN_SAMPLES = int(os.environ.get('COHORT_MIN_SAMPLES', 20))
+COHORT_SNAPSHOT_SECONDS = float(os.environ.get('COHORT_SNAPSHOT_SECONDS', 60))
+
+COHORT_COLLECTION = 'cohort_baselines'
+
+# Optimistic-concurrency retries when workers snapshot the same cohort at once
+MAX_SNAPSHOT_ATTEMPTS = 3
+
+logger = logging.getLogger(__name__)
+
+
+def band(value, width):
+    """Inclusive [low, high] band containing value, as 'low-high'"""
+    low = int(value) // width * width
+    return f"{low}-{low + width - 1}"
+
+
+def cohort_of(vehicle):
+    """Cohort fields for a vehicle document"""
+    return {
+        'make': str(vehicle.get('make', '')).strip().lower(),
+        'model': str(vehicle.get('model', '')).strip().lower(),
+        'year_band': band(vehicle.get('year') or 0, COHORT_YEAR_BAND),
+        'mileage_band': band(vehicle.get('mileage') or 0, COHORT_MILEAGE_BAND),
+    }
+
+
+def cohort_key(cohort):
+    return '|'.join((cohort['make'], cohort['model'], cohort['year_band'], cohort['mileage_band']))
+
+
+class _Cohort:
+    """In-memory cohort: everything known (`combined`) and what this worker added since the last snapshot"""
+
+    __slots__ = ('fields', 'combined', 'pending')
+
+    def __init__(self, fields, combined=None):
+        self.fields = fields
+        self.combined = combined or RunningBaseline()
+        self.pending = RunningBaseline()
+
+
+class CohortBaselines:
+    """Cohort baselines cached in memory and snapshotted to Mongo"""
+
+    def __init__(self, db, snapshot_seconds=COHORT_SNAPSHOT_SECONDS, min_samples=COHORT_MIN_SAMPLES):
+        self.collection = db[COHORT_COLLECTION]
+        self.snapshot_seconds = snapshot_seconds
+        self.min_samples = min_samples
+        self._cohorts = {}
+        self._task = None
+        self.loaded = False
+        self.snapshots = 0
+        self.conflicts = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Write out what this worker has seen since the last snapshot"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.snapshot()
+
+    async def ensure_indexes(self):
+        await self.collection.create_index('cohort', unique=True)
+
+    async def load(self):
+        """Adopt stored cohorts, keeping any clips already observed by this worker"""
+        async for doc in self.collection.find({}):
+            stored = RunningBaseline.from_document(doc)
+            cohort = self._cohorts.get(doc['cohort'])
+            if cohort is None:
+                self._cohorts[doc['cohort']] = _Cohort({field: doc.get(field) for field in
+                                                        ('make', 'model', 'year_band', 'mileage_band')}, stored)
+            else:
+                cohort.combined = stored.merge(cohort.pending)
+        self.loaded = True
+
+    async def _run(self):
+        try:
+            await self.load()
+        except Exception as e:
+            logger.error(f"Loading cohort baselines failed: {e}")
+        while True:
+            await asyncio.sleep(self.snapshot_seconds)
+            try:
+                await self.snapshot()
+            except Exception as e:
+                logger.error(f"Cohort snapshot failed: {e}")
+
+    def get(self, vehicle):
+        """(cohort fields, RunningBaseline or None) for a vehicle"""
+        fields = cohort_of(vehicle)
+        cohort = self._cohorts.get(cohort_key(fields))
+        return fields, cohort.combined if cohort is not None else None
+
+    def observe(self, vehicle, features):
+        """
+        Score a clip's features against the vehicle's cohort, then fold them in.
+        Returns {'cohort_score', 'cohort_samples'} as seen before this clip.
+        """
+        x = feature_vector(features)
+        fields = cohort_of(vehicle)
+        key = cohort_key(fields)
+        cohort = self._cohorts.get(key)
+        if cohort is None:
+            cohort = self._cohorts[key] = _Cohort(fields)
+        observed = {
+            'cohort_score': cohort.combined.score(x, self.min_samples),
+            'cohort_samples': cohort.combined.n,
+        }
+        cohort.combined.update(x)
+        cohort.pending.update(x)
+        return observed
+
+    async def snapshot(self):
+        """Merge every cohort's pending clips into its stored document"""
+        for key, cohort in list(self._cohorts.items()):
+            if cohort.pending.n == 0:
+                continue
+            # Clips arriving while this cohort is written start a fresh pending set
+            pending, cohort.pending = cohort.pending, RunningBaseline()
+            try:
+                stored = await self._merge_into_store(key, cohort.fields, pending)
+            except BaseException:
+                # Includes cancellation at shutdown: keep the clips for the final snapshot
+                cohort.pending = pending.merge(cohort.pending)
+                raise
+            if stored is None:
+                cohort.pending = pending.merge(cohort.pending)
+                continue
+            cohort.combined = stored.merge(cohort.pending)
+        self.snapshots += 1
+
+    async def _merge_into_store(self, key, fields, pending):
+        """Stored baseline after merging `pending` into it, or None if writes kept conflicting"""
+        from pymongo.errors import DuplicateKeyError
+
+        for _ in range(MAX_SNAPSHOT_ATTEMPTS):
+            doc = await self.collection.find_one({'cohort': key})
+            merged = RunningBaseline.from_document(doc).merge(pending)
+            update = {**merged.to_document(), **fields, 'cohort': key, 'updated_at': datetime.utcnow()}
+            try:
+                if doc is None:
+                    await self.collection.insert_one(update)
+                    return merged
+                outcome = await self.collection.replace_one(
+                    {'cohort': key, 'n': doc.get('n'), 'version': doc.get('version')}, update
+                )
+                if outcome.modified_count == 1:
+                    return merged
+            except DuplicateKeyError:
+                pass
+            self.conflicts += 1
+        logger.warning(f"Cohort {key} not snapshotted after {MAX_SNAPSHOT_ATTEMPTS} conflicting writes")
+        return None
+
+    def stats(self):
+        return {
+            'cohorts': len(self._cohorts),
+            'loaded': self.loaded,
+            'pending_clips': sum(cohort.pending.n for cohort in self._cohorts.values()),
+            'snapshots': self.snapshots,
+            'conflicts': self.conflicts,
+        }
+
+
+def deviation(vehicle_baseline, cohort_baseline, min_samples=COHORT_MIN_SAMPLES):
+    """How a vehicle's mean features sit within its cohort: overall distance and per-feature z-scores"""
+    cohort_std = np.sqrt(np.maximum(np.diag(cohort_baseline.covariance()), 1e-12))
+    z_scores = (vehicle_baseline.mean - cohort_baseline.mean) / cohort_std
+    features = [
+        {
+            'feature': name,
+            'vehicle_mean': float(vehicle_mean),
+            'cohort_mean': float(cohort_mean),
+            'cohort_std': float(std),
+            'z_score': float(z),
+        }
+        for name, vehicle_mean, cohort_mean, std, z in zip(
+            FEATURE_NAMES, vehicle_baseline.mean, cohort_baseline.mean, cohort_std, z_scores
+        )
+    ]
+    features.sort(key=lambda item: abs(item['z_score']), reverse=True)
+    return {
+        'distance': cohort_baseline.score(vehicle_baseline.mean, min_samples),
+        'features': features,
+    }
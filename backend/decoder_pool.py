@@ -0,0 +1,224 @@
+"""
+Pool of long-lived decoder worker processes for compressed audio.
+
+Each worker keeps libsndfile/libav loaded and decodes whatever it is sent,
+so compressed uploads do not pay a fork/exec (or codec initialisation) per
+request. Encoded bytes go to a worker over a pipe; the decoded float32 PCM
+comes back in a shared-memory segment (see pcm_shm), with only a small
+descriptor crossing the pipe.
+
+Configuration:
+    DECODER_POOL_SIZE        worker processes (0 disables the pool)
+    DECODER_TIMEOUT          seconds before a stuck decode is killed
+    DECODER_HEALTH_INTERVAL  seconds between health-check pings
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+from pcm_shm import PCMSegment, sweep_segments, write_segment
+
+DECODER_POOL_SIZE = int(os.environ.get('DECODER_POOL_SIZE', 2))
+DECODER_TIMEOUT = float(os.environ.get('DECODER_TIMEOUT', 30))
+DECODER_HEALTH_INTERVAL = float(os.environ.get('DECODER_HEALTH_INTERVAL', 15))
+PING_TIMEOUT = 5.0
+
+# Formats worth sending to the pool; PCM WAV is cheap enough to decode inline
+POOL_FORMATS = {'mp3', 'm4a', 'ogg', 'webm', 'flac'}
+
+logger = logging.getLogger(__name__)
+
+
+class DecoderError(Exception):
+    """A worker could not decode the audio it was sent"""
+
+
+def _worker_main(conn):
+    """Decode loop run inside each worker process"""
+    # Imported here so the codec libraries are loaded once per worker, not per job
+    from decoders import decode_audio
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+        command = message[0]
+        if command == 'stop':
+            return
+        if command == 'ping':
+            conn.send(('pong', os.getpid()))
+            continue
+
+        # ('decode', fmt): the encoded bytes follow as a raw message
+        fmt = message[1]
+        data = conn.recv_bytes()
+        try:
+            audio_data, sample_rate = decode_audio(data, fmt)
+            descriptor = write_segment(np.asarray(audio_data, dtype=np.float32), owner_pid=os.getppid())
+            conn.send(('ok', descriptor, int(sample_rate)))
+        except Exception as e:
+            conn.send(('error', f"{type(e).__name__}: {e}"))
+
+
+class _Worker:
+    """Parent-side handle for one decoder process"""
+
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.jobs = 0
+        self.started_at = time.monotonic()
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def ping(self, timeout=PING_TIMEOUT):
+        """Round-trip a ping; False if the worker is dead or unresponsive"""
+        try:
+            self.conn.send(('ping',))
+            if not self.conn.poll(timeout):
+                return False
+            return self.conn.recv()[0] == 'pong'
+        except (EOFError, OSError):
+            return False
+
+    def decode(self, data, fmt, timeout):
+        """Send one job and wait for its result (blocking; run in a thread)"""
+        self.conn.send(('decode', fmt))
+        self.conn.send_bytes(data)
+        if not self.conn.poll(timeout):
+            raise TimeoutError(f"Decoder worker {self.process.pid} timed out after {timeout}s")
+        reply = self.conn.recv()
+        self.jobs += 1
+        if reply[0] == 'error':
+            raise DecoderError(reply[1])
+        _, descriptor, sample_rate = reply
+        return PCMSegment.adopt(descriptor), sample_rate
+
+    def stop(self):
+        try:
+            self.conn.send(('stop',))
+        except (EOFError, OSError):
+            pass
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class DecoderPool:
+    """Async front end over a fixed set of decoder processes"""
+
+    def __init__(self, size=DECODER_POOL_SIZE, timeout=DECODER_TIMEOUT,
+                 health_interval=DECODER_HEALTH_INTERVAL):
+        self.size = size
+        self.timeout = timeout
+        self.health_interval = health_interval
+        self._context = multiprocessing.get_context('spawn')
+        self._idle = None
+        self._workers = []
+        self._health_task = None
+        self._recycling = set()
+        self.restarts = 0
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        # Segments left behind by API processes that were killed
+        sweep_segments()
+        self._idle = asyncio.Queue()
+        for _ in range(self.size):
+            worker = await loop.run_in_executor(None, _Worker, self._context)
+            self._workers.append(worker)
+            self._idle.put_nowait(worker)
+        if self.health_interval:
+            self._health_task = asyncio.create_task(self._health_loop())
+        logger.info(f"Decoder pool started with {self.size} workers")
+
+    async def stop(self):
+        if self._health_task:
+            self._health_task.cancel()
+        if self._recycling:
+            await asyncio.gather(*self._recycling, return_exceptions=True)
+        loop = asyncio.get_running_loop()
+        for worker in self._workers:
+            await loop.run_in_executor(None, worker.stop)
+        self._workers = []
+
+    async def decode(self, data, fmt):
+        """
+        Decode encoded audio bytes to (PCMSegment, sample_rate).
+
+        The float32 mono PCM stays in shared memory; the caller owns the
+        segment and must release() it.
+        """
+        loop = asyncio.get_running_loop()
+        worker = await self._idle.get()
+        # Shielded so that a cancelled request does not lose track of the job still running
+        job = loop.run_in_executor(None, worker.decode, data, fmt, self.timeout)
+        reusable = False
+        try:
+            result = await asyncio.shield(job)
+            reusable = True
+            return result
+        except DecoderError:
+            reusable = True
+            raise
+        finally:
+            if reusable:
+                self._idle.put_nowait(worker)
+            else:
+                # Timed out, crashed mid-job, broken pipe or the request was cancelled (the
+                # worker may still be decoding, or its reply is unread): the worker is not reusable
+                recycle = asyncio.create_task(self._recycle(worker, job))
+                self._recycling.add(recycle)
+                recycle.add_done_callback(self._recycling.discard)
+
+    async def _recycle(self, worker, job):
+        """Replace a worker abandoned mid-job, releasing any segment the job still hands back"""
+        worker.process.kill()
+        try:
+            segment, _ = await job
+            segment.release()
+        except Exception:
+            pass
+        self._idle.put_nowait(await self._replace(worker))
+
+    async def _replace(self, worker):
+        loop = asyncio.get_running_loop()
+        logger.warning(f"Restarting decoder worker {worker.process.pid} (alive={worker.is_alive()})")
+        await loop.run_in_executor(None, worker.stop)
+        # Drop any segment the dead worker wrote but we never adopted
+        sweep_segments(creator_pid=worker.process.pid)
+        replacement = await loop.run_in_executor(None, _Worker, self._context)
+        self._workers[self._workers.index(worker)] = replacement
+        self.restarts += 1
+        return replacement
+
+    async def _health_loop(self):
+        """Periodically ping idle workers and restart any that have died or hung"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.health_interval)
+            for _ in range(self._idle.qsize()):
+                worker = self._idle.get_nowait()
+                healthy = worker.is_alive() and await loop.run_in_executor(None, worker.ping)
+                if not healthy:
+                    worker = await self._replace(worker)
+                self._idle.put_nowait(worker)
+
+    def stats(self):
+        return {
+            'size': self.size,
+            'idle': self._idle.qsize() if self._idle else 0,
+            'restarts': self.restarts,
+            'jobs': sum(worker.jobs for worker in self._workers),
+        }
@@ -0,0 +1,103 @@
+"""
+In-process audio decoding.
+
+librosa.load tries soundfile first and otherwise falls back to audioread,
+which spawns an ffmpeg subprocess per file. Here each container is routed
+to a decoder that runs inside the worker: libsndfile (via soundfile) for
+WAV/FLAC/Ogg/MP3 and libav (via PyAV) for WebM/Opus and MP4/M4A. librosa
+is only used as a last resort.
+"""
+
+import io
+import logging
+import tempfile
+
+import numpy as np
+
+_av = None
+
+
+def load_av():
+    """Import PyAV on first use; returns None when it is not installed"""
+    global _av
+    if _av is None:
+        try:
+            import av
+        except ImportError:  # PyAV is optional; compressed containers fall back to librosa
+            return None
+        _av = av
+    return _av
+
+# Containers libsndfile decodes natively (MP3 needs libsndfile >= 1.1)
+SOUNDFILE_FORMATS = {'wav', 'flac', 'ogg', 'mp3'}
+# Containers that need libav
+PYAV_FORMATS = {'webm', 'm4a'}
+
+
+def decode_soundfile(source):
+    """Decode with libsndfile to mono float32"""
+    import soundfile as sf
+    audio_data, sample_rate = sf.read(source, dtype='float32', always_2d=True)
+    return _to_mono(audio_data), sample_rate
+
+
+def decode_pyav(source):
+    """Decode the first audio stream with libav to mono float32 at its native rate"""
+    av = load_av()
+    with av.open(source) as container:
+        stream = container.streams.audio[0]
+        sample_rate = stream.codec_context.sample_rate
+        resampler = av.AudioResampler(format='flt', layout='mono', rate=sample_rate)
+        chunks = []
+        for frame in container.decode(stream):
+            for resampled in resampler.resample(frame):
+                chunks.append(resampled.to_ndarray().reshape(-1))
+        for resampled in resampler.resample(None):
+            chunks.append(resampled.to_ndarray().reshape(-1))
+    if not chunks:
+        return np.zeros(0, dtype=np.float32), sample_rate
+    return np.concatenate(chunks).astype(np.float32, copy=False), sample_rate
+
+
+def decode_librosa(path):
+    """Generic fallback (audioread/ffmpeg subprocess for anything libsndfile cannot read)"""
+    import librosa
+    return librosa.load(path, sr=None)
+
+
+def decode_audio(source, fmt):
+    """
+    Decode audio to a mono float32 array at its native sample rate.
+
+    `source` is a file path or the raw bytes of an encoded file.
+    """
+    in_memory = isinstance(source, (bytes, bytearray, memoryview))
+
+    def open_source():
+        return io.BytesIO(source) if in_memory else source
+
+    if fmt in SOUNDFILE_FORMATS:
+        try:
+            return decode_soundfile(open_source())
+        except Exception as e:
+            logging.warning(f"soundfile could not decode {fmt} file, trying fallback: {e}")
+    if fmt in PYAV_FORMATS | SOUNDFILE_FORMATS and load_av() is not None:
+        try:
+            return decode_pyav(open_source())
+        except Exception as e:
+            logging.warning(f"PyAV could not decode {fmt} file, trying fallback: {e}")
+
+    if not in_memory:
+        return decode_librosa(source)
+    # audioread needs a real file to hand to ffmpeg
+    with tempfile.NamedTemporaryFile(suffix=f".{fmt}") as f:
+        f.write(source)
+        f.flush()
+        return decode_librosa(f.name)
+
+
+def _to_mono(audio_data):
+    """Average channels of a (frames, channels) array"""
+    if audio_data.shape[1] == 1:
+        return audio_data[:, 0]
+    return audio_data.mean(axis=1, dtype=np.float32)
@@ -0,0 +1,157 @@
+"""
+Micro-batching of the diagnosis step across concurrent requests.
+
+Each /api/analyze-audio request hands its extracted features to the
+batcher and awaits a future. The batcher collects requests until
+DIAGNOSIS_BATCH_SIZE are waiting or DIAGNOSIS_BATCH_WAIT_MS has passed
+since the first one arrived. It then runs the diagnosis model once on the
+whole batch and resolves every future from the result.
+
+The knobs trade latency for throughput. A longer wait or a bigger batch
+means fewer, larger model calls, and each request waits at most the
+configured time. With DIAGNOSIS_BATCH_WAIT_MS=0 or DIAGNOSIS_BATCH_SIZE=1,
+every request is diagnosed on its own as before.
+
+Configuration:
+    DIAGNOSIS_BATCH_SIZE      most clips per model call
+    DIAGNOSIS_BATCH_WAIT_MS   longest the first clip in a batch waits for others
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+
+from analysis import diagnose_batch
+
+DIAGNOSIS_BATCH_SIZE = int(os.environ.get('DIAGNOSIS_BATCH_SIZE', 32))
+DIAGNOSIS_BATCH_WAIT_MS = float(os.environ.get('DIAGNOSIS_BATCH_WAIT_MS', 2))
+
+logger = logging.getLogger(__name__)
+
+
+def size_bucket(size):
+    """Histogram bucket for a batch size: 1, 2, 3-4, 5-8, ... (powers of two)"""
+    upper = 1
+    while upper < size:
+        upper *= 2
+    lower = upper // 2 + 1 if upper > 2 else upper
+    return str(upper) if lower == upper else f"{lower}-{upper}"
+
+
+class DiagnosisBatcher:
+    """Collects features from concurrent requests and diagnoses them together"""
+
+    def __init__(self, model=diagnose_batch, max_batch=DIAGNOSIS_BATCH_SIZE, max_wait_ms=DIAGNOSIS_BATCH_WAIT_MS):
+        self.model = model
+        self.max_batch = max(max_batch, 1)
+        self.max_wait = max_wait_ms / 1000
+        # (features, future, enqueued at)
+        self._queue = deque()
+        self._pending = asyncio.Event()  # queue is non-empty
+        self._full = asyncio.Event()     # a whole batch is waiting
+        self._task = None
+        # Metrics
+        self.batches = 0
+        self.items = 0
+        self.size_histogram = {}
+        self._max_waited_ms = 0.0
+        self._total_wait_ms = 0.0
+        self._total_model_ms = 0.0
+
+    @property
+    def enabled(self):
+        return self.max_batch > 1 and self.max_wait > 0
+
+    def start(self):
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._batch_loop())
+
+    async def stop(self):
+        """Diagnose whatever is still queued, then stop batching"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        while self._queue:
+            self._run_batch()
+
+    async def diagnose(self, features):
+        """Diagnosis for one clip's features, computed in a batch with concurrent requests"""
+        if self._task is None:
+            results, model_ms = self._call_model([features])
+            self._record(1, 0.0, model_ms)
+            return results[0]
+
+        future = asyncio.get_running_loop().create_future()
+        self._queue.append((features, future, time.perf_counter()))
+        self._pending.set()
+        if len(self._queue) >= self.max_batch:
+            self._full.set()
+        return await future
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._pending.wait()
+            # Give a partial batch up to max_wait to fill, counted from its first request
+            deadline = loop.time() + max(self.max_wait - (time.perf_counter() - self._queue[0][2]), 0)
+            while len(self._queue) < self.max_batch:
+                self._full.clear()
+                try:
+                    await asyncio.wait_for(self._full.wait(), max(deadline - loop.time(), 0))
+                except asyncio.TimeoutError:
+                    break
+            self._run_batch()
+            if not self._queue:
+                self._pending.clear()
+            self._full.clear()
+
+    def _call_model(self, features_list):
+        """(results, model time in ms)"""
+        started = time.perf_counter()
+        results = self.model(features_list)
+        return results, (time.perf_counter() - started) * 1000
+
+    def _run_batch(self):
+        batch = [self._queue.popleft() for _ in range(min(self.max_batch, len(self._queue)))]
+        now = time.perf_counter()
+        waited_ms = max((now - enqueued) * 1000 for _, _, enqueued in batch)
+        try:
+            results, model_ms = self._call_model([features for features, _, _ in batch])
+        except Exception as e:
+            logger.error(f"Diagnosis of a batch of {len(batch)} clips failed: {e}")
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self._record(len(batch), waited_ms, model_ms)
+        for (_, future, _), result in zip(batch, results):
+            # A request that was cancelled meanwhile no longer wants its result
+            if not future.done():
+                future.set_result(result)
+
+    def _record(self, size, waited_ms, model_ms):
+        self.batches += 1
+        self.items += size
+        bucket = size_bucket(size)
+        self.size_histogram[bucket] = self.size_histogram.get(bucket, 0) + 1
+        self._max_waited_ms = max(self._max_waited_ms, waited_ms)
+        self._total_wait_ms += waited_ms
+        self._total_model_ms += model_ms
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'max_batch': self.max_batch,
+            'max_wait_ms': self.max_wait * 1000,
+            'queue_depth': len(self._queue),
+            'batches': self.batches,
+            'items': self.items,
+            'avg_batch_size': round(self.items / self.batches, 2) if self.batches else 0.0,
+            'batch_sizes': dict(sorted(self.size_histogram.items(), key=lambda item: int(item[0].split('-')[-1]))),
+            'avg_wait_ms': round(self._total_wait_ms / self.batches, 3) if self.batches else 0.0,
+            'max_observed_wait_ms': round(self._max_waited_ms, 3),
+            'avg_model_ms': round(self._total_model_ms / self.batches, 3) if self.batches else 0.0,
+        }
@@ -0,0 +1,141 @@
+"""
+Process-wide cache of precomputed DSP bases.
+
+librosa.feature.mfcc rebuilds the mel filterbank and DCT basis on every
+call, and uploads arrive at whatever rate the recording device used. The
+bases only depend on (sr, n_fft, n_mels, n_mfcc), so they are built once per
+key and kept in a bounded LRU. Per-clip work is then just the STFT and a
+few matrix products.
+
+Configuration:
+    DSP_CACHE_SIZE  number of (sr, n_fft, n_mels, n_mfcc) entries kept
+    DSP_CACHE_DIR   optional directory of .npy files; workers memory-map
+                    them instead of each building and holding a copy
+"""
+
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import NamedTuple
+
+import numpy as np
+
+DSP_CACHE_SIZE = int(os.environ.get('DSP_CACHE_SIZE', 16))
+DSP_CACHE_DIR = os.environ.get('DSP_CACHE_DIR')
+
+logger = logging.getLogger(__name__)
+
+
+class DSPBasis(NamedTuple):
+    window: np.ndarray       # (n_fft,) periodic Hann window
+    mel_basis: np.ndarray    # (n_mels, 1 + n_fft // 2) mel filterbank
+    dct_basis: np.ndarray    # (n_mfcc, n_mels) orthonormal DCT-II rows
+    fft_freqs: np.ndarray    # (1 + n_fft // 2,) bin centre frequencies in Hz
+
+
+def dct_matrix(n_mfcc, n_mels, dtype=np.float32):
+    """First n_mfcc rows of the orthonormal DCT-II (what scipy.fft.dct(norm='ortho') applies)"""
+    n = np.arange(n_mels)
+    k = np.arange(n_mfcc)[:, np.newaxis]
+    basis = np.cos(np.pi * k * (2 * n + 1) / (2 * n_mels)) * np.sqrt(2.0 / n_mels)
+    basis[0] *= np.sqrt(0.5)
+    return basis.astype(dtype)
+
+
+def build_basis(sr, n_fft, n_mels, n_mfcc):
+    """Compute every basis for one key from scratch"""
+    import librosa
+
+    return DSPBasis(
+        window=librosa.filters.get_window('hann', n_fft, fftbins=True).astype(np.float32),
+        mel_basis=librosa.filters.mel(sr=sr, n_fft=n_fft, n_mels=n_mels, dtype=np.float32),
+        dct_basis=dct_matrix(n_mfcc, n_mels),
+        fft_freqs=librosa.fft_frequencies(sr=sr, n_fft=n_fft).astype(np.float32),
+    )
+
+
+def _basis_paths(key):
+    sr, n_fft, n_mels, n_mfcc = key
+    stem = os.path.join(DSP_CACHE_DIR, f"sr{sr}_fft{n_fft}_mels{n_mels}_mfcc{n_mfcc}")
+    return {field: f"{stem}_{field}.npy" for field in DSPBasis._fields}
+
+
+def _load_persisted(key):
+    """Memory-map a previously persisted basis, or None"""
+    paths = _basis_paths(key)
+    try:
+        return DSPBasis(**{field: np.load(path, mmap_mode='r') for field, path in paths.items()})
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _persist(key, basis):
+    """Write each array atomically so concurrent workers never read a partial file"""
+    os.makedirs(DSP_CACHE_DIR, exist_ok=True)
+    for field, path in _basis_paths(key).items():
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.save(f, getattr(basis, field))
+        os.replace(tmp_path, path)
+
+
+class DSPBasisCache:
+    """Bounded LRU of DSPBasis entries keyed by (sr, n_fft, n_mels, n_mfcc)"""
+
+    def __init__(self, max_entries=DSP_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, sr, n_fft=2048, n_mels=128, n_mfcc=13):
+        key = (int(sr), n_fft, n_mels, n_mfcc)
+        with self._lock:
+            basis = self._entries.get(key)
+            if basis is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return basis
+            self.misses += 1
+
+        # Build outside the lock; a racing duplicate build is harmless
+        basis = _load_persisted(key) if DSP_CACHE_DIR else None
+        if basis is None:
+            basis = build_basis(*key)
+            if DSP_CACHE_DIR:
+                try:
+                    _persist(key, basis)
+                except OSError as e:
+                    logger.warning(f"Could not persist DSP basis {key}: {e}")
+
+        with self._lock:
+            self._entries[key] = basis
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return basis
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+basis_cache = DSPBasisCache()
+
+
+def get_basis(sr, n_fft=2048, n_mels=128, n_mfcc=13):
+    """Cached DSP bases for a sample rate and transform size"""
+    return basis_cache.get(sr, n_fft, n_mels, n_mfcc)
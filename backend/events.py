@@ -0,0 +1,129 @@
+"""
+In-process pub/sub for dashboard updates, served as server-sent events.
+
+Writers publish an event once; it is encoded to an SSE frame a single time
+and appended to every subscriber's bounded buffer, so an idle dashboard costs
+one small deque and one asyncio.Event and a write costs O(subscribers)
+pointer appends. A subscriber that falls more than EVENT_BUFFER_SIZE events
+behind loses the oldest ones and is sent a `resync` event telling it to
+refetch /api/health-overview.
+
+Fan-out is per API worker process: each worker pushes the writes it handles
+itself.
+
+Configuration:
+    EVENT_BUFFER_SIZE         events buffered per subscriber
+    EVENT_MAX_SUBSCRIBERS     open streams per worker before new ones get 503
+    EVENT_KEEPALIVE_SECONDS   idle interval between keep-alive comments
+"""
+
+import asyncio
+import itertools
+import json
+import os
+from collections import deque
+from datetime import datetime
+
+EVENT_BUFFER_SIZE = int(os.environ.get('EVENT_BUFFER_SIZE', 64))
+EVENT_MAX_SUBSCRIBERS = int(os.environ.get('EVENT_MAX_SUBSCRIBERS', 10000))
+EVENT_KEEPALIVE_SECONDS = float(os.environ.get('EVENT_KEEPALIVE_SECONDS', 15))
+
+KEEPALIVE_FRAME = b': keepalive\n\n'
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def encode_event(event_id, event, data):
+    """One SSE frame: id, event name and a single-line JSON payload"""
+    payload = json.dumps(data, default=_json_default, separators=(',', ':'))
+    return f"id: {event_id}\nevent: {event}\ndata: {payload}\n\n".encode()
+
+
+class Subscription:
+    """One client's bounded buffer of encoded frames"""
+
+    __slots__ = ('frames', 'ready', 'lagged')
+
+    def __init__(self, buffer_size):
+        self.frames = deque(maxlen=buffer_size)
+        self.ready = asyncio.Event()
+        self.lagged = False
+
+    def push(self, frame):
+        if len(self.frames) == self.frames.maxlen:
+            self.lagged = True  # the deque drops the oldest frame
+        self.frames.append(frame)
+        self.ready.set()
+
+
+class EventBroker:
+    """Fans published events out to every open subscription"""
+
+    def __init__(self, buffer_size=EVENT_BUFFER_SIZE, max_subscribers=EVENT_MAX_SUBSCRIBERS,
+                 keepalive_seconds=EVENT_KEEPALIVE_SECONDS):
+        self.buffer_size = buffer_size
+        self.max_subscribers = max_subscribers
+        self.keepalive_seconds = keepalive_seconds
+        self._subscribers = set()
+        self._ids = itertools.count(1)
+        self._closed = False
+        self.published = 0
+        self.resyncs = 0
+
+    def full(self):
+        return len(self._subscribers) >= self.max_subscribers
+
+    def publish(self, event, data):
+        """Queue an event for every subscriber; never blocks the writer"""
+        frame = encode_event(next(self._ids), event, data)
+        for subscription in self._subscribers:
+            subscription.push(frame)
+        self.published += 1
+
+    def subscribe(self):
+        subscription = Subscription(self.buffer_size)
+        self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self._subscribers.discard(subscription)
+
+    async def stream(self):
+        """SSE byte stream for one client, ending when the broker closes"""
+        subscription = self.subscribe()
+        try:
+            # Tell the client how long to wait before reconnecting
+            yield b'retry: 3000\n\n'
+            while not self._closed:
+                if not subscription.frames:
+                    subscription.ready.clear()
+                    try:
+                        await asyncio.wait_for(subscription.ready.wait(), self.keepalive_seconds)
+                    except asyncio.TimeoutError:
+                        yield KEEPALIVE_FRAME
+                        continue
+                if subscription.lagged:
+                    subscription.lagged = False
+                    self.resyncs += 1
+                    yield encode_event(next(self._ids), 'resync', {'reason': 'client fell behind'})
+                while subscription.frames:
+                    yield subscription.frames.popleft()
+        finally:
+            self.unsubscribe(subscription)
+
+    def close(self):
+        """End every open stream (graceful shutdown)"""
+        self._closed = True
+        for subscription in self._subscribers:
+            subscription.ready.set()
+
+    def stats(self):
+        return {
+            'subscribers': len(self._subscribers),
+            'published': self.published,
+            'resyncs': self.resyncs,
+        }
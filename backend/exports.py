@@ -0,0 +1,116 @@
+"""
+Streaming NDJSON and CSV exports of diagnostic results and vehicles.
+
+Documents are read with an async cursor in EXPORT_BATCH_SIZE batches and
+encoded row by row into chunks of about EXPORT_CHUNK_BYTES, which are
+handed to a StreamingResponse as they fill. Memory stays at one cursor
+batch plus one chunk however many rows match, and the first bytes go out
+as soon as the first batch arrives.
+
+Configuration:
+    EXPORT_BATCH_SIZE    documents fetched per cursor round trip
+    EXPORT_CHUNK_BYTES   encoded bytes buffered before each write
+"""
+
+import csv
+import io
+import os
+from datetime import datetime
+
+from serialization import dumps
+
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+EXPORT_CHUNK_BYTES = int(os.environ.get('EXPORT_CHUNK_BYTES', 64 * 1024))
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+# CSV columns per collection; NDJSON exports whole documents
+VEHICLE_COLUMNS = ['id', 'vin', 'make', 'model', 'year', 'mileage', 'created_at']
+DIAGNOSTIC_COLUMNS = [
+    'id', 'vehicle_id', 'audio_filename', 'component', 'diagnosis', 'confidence_score', 'severity',
+    'urgency_level', 'estimated_cost', 'recommendations', 'analysis_version', 'analysis_profile', 'created_at',
+]
+
+
+def diagnostics_query(vehicle_id=None, component=None, severity=None, since=None, until=None):
+    query = {}
+    for field, value in (('vehicle_id', vehicle_id), ('component', component), ('severity', severity)):
+        if value is not None:
+            query[field] = value
+    if since is not None or until is not None:
+        query['created_at'] = {}
+        if since is not None:
+            query['created_at']['$gte'] = since
+        if until is not None:
+            query['created_at']['$lt'] = until
+    return query
+
+
+def vehicles_query(make=None, model=None, year_min=None, year_max=None):
+    query = {}
+    for field, value in (('make', make), ('model', model)):
+        if value is not None:
+            query[field] = value
+    if year_min is not None or year_max is not None:
+        query['year'] = {}
+        if year_min is not None:
+            query['year']['$gte'] = year_min
+        if year_max is not None:
+            query['year']['$lte'] = year_max
+    return query
+
+
+def _csv_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, list):
+        return '; '.join(str(item) for item in value)
+    return '' if value is None else value
+
+
+class _CSVEncoder:
+    """Encodes rows through one reusable csv.writer"""
+
+    def __init__(self, columns):
+        self.columns = columns
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
+
+    def header(self):
+        return self._encode(self.columns)
+
+    def row(self, doc):
+        return self._encode([_csv_value(doc.get(column)) for column in self.columns])
+
+    def _encode(self, values):
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        self._writer.writerow(values)
+        return self._buffer.getvalue().encode()
+
+
+async def stream_export(cursor, fmt, columns):
+    """Encoded export bytes, one chunk per EXPORT_CHUNK_BYTES"""
+    chunk = bytearray()
+    if fmt == 'csv':
+        encoder = _CSVEncoder(columns)
+        encode = encoder.row
+        chunk += encoder.header()
+    else:
+        def encode(doc):
+            return dumps(doc) + b'\n'
+
+    try:
+        async for doc in cursor:
+            chunk += encode(doc)
+            if len(chunk) >= EXPORT_CHUNK_BYTES:
+                yield bytes(chunk)
+                chunk.clear()
+        if chunk:
+            yield bytes(chunk)
+    finally:
+        # Also runs when the client disconnects mid-export
+        await cursor.close()
@@ -0,0 +1,293 @@
+"""
+Block-wise float32 feature pipeline.
+
+Frames are read from the clip a block at a time into per-thread scratch
+buffers (signal span, windowed frames, magnitude, cumulative magnitude),
+transformed with a float32 FFT and reduced straight into clip-level
+accumulators. Nothing is promoted to float64 and no per-stage arrays are
+allocated; the only per-clip array is the (frames, n_mels) float32 mel
+matrix needed for the clip-wide top_db clamp of the log-mel spectrogram.
+
+The framing matches librosa's defaults exactly (center=True, zero padding
+for the STFT, edge padding for the zero-crossing rate), and any frame range
+can be processed on its own, so blocks need not arrive in order. A long
+clip can therefore be split into frame ranges processed by different
+workers: each writes its mel rows into a shared mel matrix and returns its
+`partial()` sums, and `merge()` folds them into exactly the accumulator a
+single pass would have produced.
+
+Events are runs of consecutive frames whose level (windowed RMS, in dB
+relative to full scale) is at least EVENT_THRESHOLD_DBFS. They give a coarse
+timeline of loud passages (knocks, squeals, revs), and runs that cross a
+segment boundary are joined on merge.
+
+Memory bound: after a worker's first clip, extracting features from a clip
+of N frames allocates at most about SCRATCH_BOUND_BYTES plus
+N * n_mels * 4 bytes (for the mel matrix, reused when large enough).
+Per-frame output (`per_frame=True`) adds three float32 vectors of N.
+"""
+
+import threading
+
+import numpy as np
+
+# Frames transformed per block; sets the size of the scratch buffers
+BLOCK_FRAMES = 128
+
+# Peak transient allocation per block (FFT output and small per-frame vectors)
+SCRATCH_BOUND_BYTES = 2 * 1024 * 1024
+
+# librosa.feature.zero_crossing_rate treats |x| <= 1e-10 as zero
+ZCR_THRESHOLD = 1e-10
+# librosa.power_to_db defaults
+AMIN = 1e-10
+TOP_DB = 80.0
+
+# Frames at or above this level are part of an event
+EVENT_THRESHOLD_DBFS = -20.0
+# Events listed per clip; later ones are counted but not listed
+MAX_EVENTS = 256
+
+_scratch = threading.local()
+
+
+def frame_count(n_samples, hop_length):
+    """Frames librosa produces for a centred STFT of n_samples"""
+    return 1 + n_samples // hop_length
+
+
+class _Scratch:
+    """Reusable per-thread work buffers for one (n_fft, hop, n_bins) shape"""
+
+    def __init__(self, n_fft, hop_length, block_frames):
+        n_bins = 1 + n_fft // 2
+        self.key = (n_fft, hop_length, block_frames)
+        self.signal = np.zeros((block_frames - 1) * hop_length + n_fft, dtype=np.float32)
+        self.frames = np.empty((block_frames, n_fft), dtype=np.float32)
+        self.magnitude = np.empty((block_frames, n_bins), dtype=np.float32)
+        self.cumulative = np.empty((block_frames, n_bins), dtype=np.float32)
+        self.mask = np.empty((block_frames, n_bins), dtype=bool)
+        self.mel = np.empty((0, 0), dtype=np.float32)
+
+
+def get_scratch(n_fft, hop_length, block_frames=BLOCK_FRAMES):
+    """This thread's scratch buffers for a shape, allocated the first time the shape is used"""
+    by_shape = getattr(_scratch, 'by_shape', None)
+    if by_shape is None:
+        by_shape = _scratch.by_shape = {}
+    key = (n_fft, hop_length, block_frames)
+    scratch = by_shape.get(key)
+    if scratch is None:
+        scratch = by_shape[key] = _Scratch(n_fft, hop_length, block_frames)
+    _scratch.buffers = scratch
+    return scratch
+
+
+def mel_buffer(n_frames, n_mels, reuse=True):
+    """A (n_frames, n_mels) float32 matrix, reusing this thread's buffer when large enough"""
+    if not reuse:
+        return np.empty((n_frames, n_mels), dtype=np.float32)
+    scratch = getattr(_scratch, 'buffers', None)
+    if scratch is None:
+        return np.empty((n_frames, n_mels), dtype=np.float32)
+    if scratch.mel.shape[0] < n_frames or scratch.mel.shape[1] != n_mels:
+        scratch.mel = np.empty((max(n_frames, scratch.mel.shape[0]), n_mels), dtype=np.float32)
+    return scratch.mel[:n_frames]
+
+
+class FeatureAccumulator:
+    """
+    Clip-level feature sums for frames [0, n_frames) of a signal of n_samples.
+
+    `process(audio, first, stop)` transforms frames first..stop-1 from any
+    sliceable 1-D source indexed in clip samples (an ndarray or a memmap
+    view); `features()` produces the summary dict once every frame is in.
+    With `per_frame`, centroid, rolloff and zero-crossing rate are also kept
+    for every frame and `features()` adds them (and per-frame MFCCs).
+    """
+
+    def __init__(self, basis, sr, n_samples, n_fft, hop_length, n_mels, roll_percent, reuse_mel=True,
+                 per_frame=False, mel_frames=None):
+        self.basis = basis
+        self.sr = sr
+        self.n_samples = n_samples
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.roll_percent = roll_percent
+        self.n_frames = frame_count(n_samples, hop_length)
+        # A caller-provided matrix (e.g. in shared memory) lets several workers fill one clip
+        self.mel_frames = mel_buffer(self.n_frames, n_mels, reuse=reuse_mel) if mel_frames is None else mel_frames
+        self.frames_done = 0
+        self.centroid_sum = 0.0
+        self.rolloff_sum = 0.0
+        self.zcr_sum = 0.0
+        self.frame_values = {
+            name: np.zeros(self.n_frames, dtype=np.float32)
+            for name in ('spectral_centroid', 'spectral_rolloff', 'zero_crossing_rate')
+        } if per_frame else None
+        # [first frame, end frame (exclusive), peak dBFS] per event, in frame order
+        self.events = []
+        self._window_energy = float(np.dot(basis.window, basis.window))
+
+    def process(self, audio, first=0, stop=None):
+        """Transform frames [first, stop) block by block"""
+        stop = self.n_frames if stop is None else min(stop, self.n_frames)
+        scratch = get_scratch(self.n_fft, self.hop_length)
+        block_frames = scratch.frames.shape[0]
+        for block_start in range(first, stop, block_frames):
+            self._process_block(audio, block_start, min(block_frames, stop - block_start), scratch)
+
+    def _process_block(self, audio, first, count, scratch):
+        # Imported here so that importing the API does not load scipy (see analysis.py)
+        from scipy.fft import rfft
+
+        n_fft, hop, half = self.n_fft, self.hop_length, self.n_fft // 2
+        basis = self.basis
+
+        # Copy the samples under these frames into the signal buffer, with the
+        # centre padding (zeros) written in place rather than padding the clip
+        span_start = first * hop - half
+        span_len = (count - 1) * hop + n_fft
+        src_start, src_stop = max(span_start, 0), min(span_start + span_len, self.n_samples)
+        signal = scratch.signal[:span_len]
+        signal.fill(0.0)
+        if src_stop > src_start:
+            signal[src_start - span_start:src_stop - span_start] = audio[src_start:src_stop]
+
+        # Window the overlapping frames (a strided view of the signal buffer)
+        frames = scratch.frames[:count]
+        view = np.lib.stride_tricks.as_strided(
+            signal, shape=(count, n_fft), strides=(hop * signal.strides[0], signal.strides[0]), writeable=False
+        )
+        np.multiply(view, basis.window, out=frames)
+        self._track_events(first, np.einsum('ij,ij->i', frames, frames))
+
+        spectrum = rfft(frames, axis=1, overwrite_x=True)  # complex64 for float32 input
+        magnitude = scratch.magnitude[:count]
+        np.abs(spectrum, out=magnitude)
+        del spectrum
+
+        # Spectral centroid and rolloff from the magnitude spectrum
+        energy = magnitude.sum(axis=1)
+        centroid = magnitude @ basis.fft_freqs
+        energy[energy < np.finfo(np.float32).tiny] = 1.0
+        np.divide(centroid, energy, out=centroid)
+        self.centroid_sum += float(np.sum(centroid, dtype=np.float64))
+
+        cumulative = scratch.cumulative[:count]
+        np.cumsum(magnitude, axis=1, out=cumulative)
+        mask = scratch.mask[:count]
+        np.greater_equal(cumulative, (self.roll_percent * cumulative[:, -1])[:, np.newaxis], out=mask)
+        rolloff = basis.fft_freqs[mask.argmax(axis=1)]
+        self.rolloff_sum += float(np.sum(rolloff, dtype=np.float64))
+
+        # Mel power spectrum (log and top_db are applied once the whole clip is in)
+        np.multiply(magnitude, magnitude, out=magnitude)
+        np.matmul(magnitude, basis.mel_basis.T, out=self.mel_frames[first:first + count])
+
+        zcr = self._zero_crossings(signal[src_start - span_start:src_stop - span_start], first, count)
+        self.zcr_sum += float(np.sum(zcr, dtype=np.float64))
+        if self.frame_values is not None:
+            for name, values in (('spectral_centroid', centroid), ('spectral_rolloff', rolloff),
+                                 ('zero_crossing_rate', zcr)):
+                self.frame_values[name][first:first + count] = values
+        self.frames_done += count
+
+    def _track_events(self, first, windowed_energy):
+        """Extend the event list with the runs of loud frames in this block"""
+        level = 10.0 * np.log10(np.maximum(windowed_energy / self._window_energy, AMIN))
+        loud = np.concatenate(([False], level >= EVENT_THRESHOLD_DBFS, [False]))
+        edges = np.flatnonzero(loud[1:] != loud[:-1])
+        for start, end in zip(edges[::2], edges[1::2]):
+            self._add_event(first + int(start), first + int(end), float(level[start:end].max()))
+
+    def _add_event(self, start, end, peak):
+        last = self.events[-1] if self.events else None
+        if last is not None and last[1] == start:
+            last[1] = end
+            last[2] = max(last[2], peak)
+        else:
+            self.events.append([start, end, peak])
+
+    def partial(self, first, stop):
+        """Sums for frames [first, stop), to be merged into another accumulator for the same clip"""
+        return {
+            'first': first,
+            'stop': stop,
+            'frames_done': self.frames_done,
+            'centroid_sum': self.centroid_sum,
+            'rolloff_sum': self.rolloff_sum,
+            'zcr_sum': self.zcr_sum,
+            'events': self.events,
+            'frame_values': {name: values[first:stop] for name, values in self.frame_values.items()}
+            if self.frame_values is not None else None,
+        }
+
+    def merge(self, partial):
+        """
+        Fold in another worker's partial() for the same clip; its mel rows
+        must already be in this accumulator's mel matrix. Merge partials in
+        frame order so events crossing a boundary are joined.
+        """
+        self.frames_done += partial['frames_done']
+        self.centroid_sum += partial['centroid_sum']
+        self.rolloff_sum += partial['rolloff_sum']
+        self.zcr_sum += partial['zcr_sum']
+        for start, end, peak in partial['events']:
+            self._add_event(start, end, peak)
+        if self.frame_values is not None and partial['frame_values'] is not None:
+            for name, values in partial['frame_values'].items():
+                self.frame_values[name][partial['first']:partial['stop']] = values
+
+    def _zero_crossings(self, samples, first, count):
+        """Per-frame zero-crossing rates (edge padding never adds crossings)"""
+        hop, half = self.hop_length, self.n_fft // 2
+        starts = np.arange(first, first + count) * hop - half
+        lo = np.clip(starts, 0, self.n_samples)
+        hi = np.clip(starts + self.n_fft, 0, self.n_samples)
+        if hi[-1] <= lo[0]:
+            return np.zeros(count)
+        # `samples` is the unpadded part of this block's signal buffer, clip samples lo[0]..hi[-1]
+        negative = samples < -ZCR_THRESHOLD
+        crossings = np.zeros(len(samples), dtype=np.int32)
+        np.cumsum(negative[1:] != negative[:-1], out=crossings[1:])
+        # Crossings between consecutive samples inside [lo, hi) of each frame
+        counts = crossings[np.maximum(hi - lo[0] - 1, 0)] - crossings[lo - lo[0]]
+        counts[hi <= lo] = 0
+        return counts / self.n_fft
+
+    def features(self, n_mfcc):
+        """Clip-level summary: mean MFCCs, centroid, rolloff and zero-crossing rate"""
+        mel = self.mel_frames
+        # power_to_db(ref=1.0, amin=1e-10, top_db=80), in place and in float32
+        np.maximum(mel, AMIN, out=mel)
+        np.log10(mel, out=mel)
+        mel *= 10.0
+        np.maximum(mel, mel.max() - TOP_DB, out=mel)
+        # The DCT is linear, so the mean of the MFCCs is the DCT of the mean log-mel frame
+        mfcc_mean = self.basis.dct_basis[:n_mfcc] @ mel.mean(axis=0)
+
+        n_frames = max(self.frames_done, 1)
+        seconds_per_frame = self.hop_length / self.sr
+        features = {
+            'mfcc_features': mfcc_mean.tolist(),
+            'spectral_centroid': self.centroid_sum / n_frames,
+            'spectral_rolloff': self.rolloff_sum / n_frames,
+            'zero_crossing_rate': self.zcr_sum / n_frames,
+            'duration': self.n_samples / self.sr,
+            'sample_rate': self.sr,
+            'samples': self.n_samples,
+            'events': [
+                {'start': start * seconds_per_frame, 'end': end * seconds_per_frame, 'peak_dbfs': peak}
+                for start, end, peak in self.events[:MAX_EVENTS]
+            ],
+            'event_count': len(self.events),
+        }
+        if self.frame_values is not None:
+            # Same layout as librosa: one row per coefficient, one column per frame
+            features['frames'] = {
+                'hop_seconds': self.hop_length / self.sr,
+                'mfcc': (self.basis.dct_basis[:n_mfcc] @ mel.T).tolist(),
+                **{name: values.tolist() for name, values in self.frame_values.items()},
+            }
+        return features
@@ -0,0 +1,125 @@
+"""
+Load-aware choice of analysis fidelity.
+
+Every upload is analysed with one of the profiles in
+analysis.FIDELITY_PROFILES. A client may ask for one explicitly.
+Otherwise the controller picks "full", and switches to "quick" while the
+service is overloaded, so slow requests return a coarser diagnosis
+instead of timing out.
+
+Overloaded means either of:
+    FIDELITY_QUICK_DEPTH or more analyses are queued or running in this process
+    the p95 latency of recent full analyses exceeds FIDELITY_QUICK_P95_MS
+
+Only full analyses count towards the p95, because that is the latency
+being protected. The window is the last FIDELITY_WINDOW_SECONDS. Quick
+mode ends once the depth is below half the threshold and the p95 is back
+under 80% of its limit. This hysteresis stops the controller flapping at
+the boundary. Since no full analyses run while quick mode is on, the p95
+window empties and the depth alone decides when to recover.
+
+Configuration:
+    FIDELITY_MODE            auto | quick | full | detailed (fixed profile)
+    FIDELITY_QUICK_DEPTH     queued + running analyses that trigger quick mode (0 disables)
+    FIDELITY_QUICK_P95_MS    full-analysis p95 latency that triggers quick mode (0 disables)
+    FIDELITY_WINDOW_SECONDS  age of the latencies the p95 is computed over
+"""
+
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+from analysis import DEFAULT_PROFILE, FIDELITY_PROFILES
+
+FIDELITY_MODE = os.environ.get('FIDELITY_MODE', 'auto')
+FIDELITY_QUICK_DEPTH = int(os.environ.get('FIDELITY_QUICK_DEPTH', 16))
+FIDELITY_QUICK_P95_MS = float(os.environ.get('FIDELITY_QUICK_P95_MS', 5000))
+FIDELITY_WINDOW_SECONDS = float(os.environ.get('FIDELITY_WINDOW_SECONDS', 60))
+
+# Latencies kept for the p95, however busy the window
+MAX_LATENCY_SAMPLES = 1000
+
+
+class FidelityController:
+    """Tracks in-flight analyses and full-analysis latency, and picks a profile per upload"""
+
+    def __init__(self, mode=FIDELITY_MODE, quick_depth=FIDELITY_QUICK_DEPTH, quick_p95_ms=FIDELITY_QUICK_P95_MS,
+                 window_seconds=FIDELITY_WINDOW_SECONDS):
+        if mode != 'auto' and mode not in FIDELITY_PROFILES:
+            raise ValueError(f"Unknown fidelity mode {mode!r}; expected auto or one of {', '.join(FIDELITY_PROFILES)}")
+        self.mode = mode
+        self.quick_depth = quick_depth
+        self.quick_p95_ms = quick_p95_ms
+        self.window_seconds = window_seconds
+        self.in_flight = 0
+        self.degraded = False
+        # (finished at, latency ms) of recent full analyses
+        self._latencies = deque(maxlen=MAX_LATENCY_SAMPLES)
+        # Metrics
+        self.chosen = {profile: 0 for profile in FIDELITY_PROFILES}
+        self.degradations = 0
+
+    def p95_ms(self):
+        """p95 latency of full analyses in the window, or None without any"""
+        horizon = time.monotonic() - self.window_seconds
+        while self._latencies and self._latencies[0][0] < horizon:
+            self._latencies.popleft()
+        if not self._latencies:
+            return None
+        return float(np.percentile([latency for _, latency in self._latencies], 95))
+
+    def _overloaded(self):
+        p95 = self.p95_ms()
+        if self.degraded:
+            # Recover only well clear of the thresholds
+            depth_ok = not self.quick_depth or self.in_flight < max(self.quick_depth // 2, 1)
+            latency_ok = not self.quick_p95_ms or p95 is None or p95 < 0.8 * self.quick_p95_ms
+            return not (depth_ok and latency_ok)
+        return bool(
+            (self.quick_depth and self.in_flight >= self.quick_depth)
+            or (self.quick_p95_ms and p95 is not None and p95 > self.quick_p95_ms)
+        )
+
+    def choose(self, requested=None):
+        """Profile for the next upload: the requested one, the configured one, or by load"""
+        if requested is not None:
+            if requested not in FIDELITY_PROFILES:
+                raise ValueError(f"Unknown analysis profile {requested!r}; expected one of {', '.join(FIDELITY_PROFILES)}")
+            profile = requested
+        elif self.mode != 'auto':
+            profile = self.mode
+        else:
+            overloaded = self._overloaded()
+            if overloaded and not self.degraded:
+                self.degradations += 1
+            self.degraded = overloaded
+            profile = 'quick' if overloaded else DEFAULT_PROFILE
+        self.chosen[profile] += 1
+        return profile
+
+    @contextmanager
+    def track(self, profile):
+        """Count an analysis as in flight, and record its latency if it was a full one"""
+        self.in_flight += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            finished = time.monotonic()
+            if profile == DEFAULT_PROFILE:
+                self._latencies.append((finished, (finished - started) * 1000))
+
+    def stats(self):
+        p95 = self.p95_ms()
+        return {
+            'mode': self.mode,
+            'degraded': self.degraded,
+            'in_flight': self.in_flight,
+            'full_p95_ms': round(p95, 1) if p95 is not None else None,
+            'degradations': self.degradations,
+            'profiles': dict(self.chosen),
+        }
@@ -0,0 +1,181 @@
+"""
+Shared-memory hand-off of decoded PCM between processes.
+
+Decoded audio lives in a `multiprocessing.shared_memory` segment and only a
+small PCMDescriptor (name, dtype, shape) crosses process boundaries, so a
+minute of 48 kHz audio is not pickled and copied on every hop.
+
+Lifecycle: the API process owns every segment. Analysis workers only
+attach, decoder workers create segments on the owner's behalf, and the
+owner unlinks in a `finally` even when a worker crashes. Segment names
+carry the owner and creator PIDs, so segments orphaned by a crashed decoder
+worker or a killed API process can be swept.
+"""
+
+import atexit
+import logging
+import os
+import uuid
+from multiprocessing import shared_memory
+from typing import NamedTuple, Tuple
+
+import numpy as np
+
+SEGMENT_PREFIX = 'eniguity-pcm'
+SHM_DIR = '/dev/shm'
+
+logger = logging.getLogger(__name__)
+
+# Segments owned by this process that have not been released yet
+_live_segments = {}
+
+
+class PCMDescriptor(NamedTuple):
+    name: str
+    dtype: str
+    shape: Tuple[int, ...]
+
+
+def segment_name(owner_pid=None):
+    """Name for a new segment owned by `owner_pid` and created by this process"""
+    owner_pid = owner_pid or os.getpid()
+    return f"{SEGMENT_PREFIX}-{owner_pid}-{os.getpid()}-{uuid.uuid4().hex[:12]}"
+
+
+class PCMSegment:
+    """Owner-side handle for a shared-memory PCM buffer"""
+
+    def __init__(self, segment, dtype, shape):
+        self._segment = segment
+        self.descriptor = PCMDescriptor(segment.name, np.dtype(dtype).str, tuple(shape))
+        self.array = np.ndarray(shape, dtype=dtype, buffer=segment.buf)
+        _live_segments[segment.name] = self
+
+    @classmethod
+    def allocate(cls, shape, dtype=np.float32, owner_pid=None):
+        nbytes = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+        segment = shared_memory.SharedMemory(name=segment_name(owner_pid), create=True, size=nbytes)
+        return cls(segment, dtype, shape)
+
+    @classmethod
+    def from_array(cls, array):
+        """Copy an array into a new segment (the one copy on the way in)"""
+        owned = cls.allocate(array.shape, array.dtype)
+        owned.array[...] = array
+        return owned
+
+    @classmethod
+    def adopt(cls, descriptor):
+        """Take ownership of a segment another process created for us"""
+        segment = shared_memory.SharedMemory(name=descriptor.name)
+        return cls(segment, descriptor.dtype, descriptor.shape)
+
+    def release(self):
+        """Drop the view and unlink the segment; safe to call twice"""
+        if self._segment is None:
+            return
+        self.array = None
+        _live_segments.pop(self._segment.name, None)
+        try:
+            self._segment.close()
+            self._segment.unlink()
+        except FileNotFoundError:
+            pass
+        self._segment = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class attach:
+    """
+    Consumer-side view of a segment described by a PCMDescriptor.
+
+        with attach(descriptor) as audio_data:
+            ...
+
+    The view must not outlive the block; the segment is only closed here,
+    unlinking stays with the owner.
+    """
+
+    def __init__(self, descriptor):
+        self.descriptor = descriptor
+        self._segment = None
+
+    def __enter__(self):
+        # Spawned workers share the owner's resource tracker, so the
+        # registration made by attaching is the owner's and stays in place
+        self._segment = shared_memory.SharedMemory(name=self.descriptor.name)
+        return np.ndarray(self.descriptor.shape, dtype=self.descriptor.dtype, buffer=self._segment.buf)
+
+    def __exit__(self, *exc_info):
+        self._segment.close()
+
+
+def write_segment(array, owner_pid):
+    """Copy an array into a segment owned by `owner_pid` and detach from it (worker side)"""
+    array = np.ascontiguousarray(array)
+    nbytes = max(array.nbytes, 1)
+    # Ownership moves to the parent, which unlinks it after adopting; until
+    # then the shared resource tracker covers a crash of the parent
+    segment = shared_memory.SharedMemory(name=segment_name(owner_pid), create=True, size=nbytes)
+    try:
+        np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)[...] = array
+    finally:
+        segment.close()
+    return PCMDescriptor(segment.name, array.dtype.str, array.shape)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def sweep_segments(creator_pid=None):
+    """
+    Unlink orphaned segments.
+
+    With `creator_pid`, removes segments a (now dead) worker created for this
+    process that were never adopted. Without it, removes segments whose owning
+    process no longer exists.
+    """
+    try:
+        names = os.listdir(SHM_DIR)
+    except FileNotFoundError:
+        return 0
+
+    removed = 0
+    for name in names:
+        if not name.startswith(f"{SEGMENT_PREFIX}-"):
+            continue
+        try:
+            owner, creator = (int(part) for part in name[len(SEGMENT_PREFIX) + 1:].split('-')[:2])
+        except ValueError:
+            continue
+        if creator_pid is not None:
+            orphaned = owner == os.getpid() and creator == creator_pid and name not in _live_segments
+        else:
+            orphaned = not _pid_alive(owner)
+        if orphaned:
+            try:
+                os.unlink(os.path.join(SHM_DIR, name))
+                removed += 1
+            except FileNotFoundError:
+                pass
+    if removed:
+        logger.warning(f"Removed {removed} orphaned PCM shared-memory segments")
+    return removed
+
+
+@atexit.register
+def _release_live_segments():
+    for owned in list(_live_segments.values()):
+        owned.release()
@@ -0,0 +1,197 @@
+"""
+Write-behind buffering of diagnostic results.
+
+Instead of one insert_one per analysed clip, results are queued in memory and
+written with unordered insert_many once RESULT_BATCH_SIZE documents are
+waiting or RESULT_FLUSH_INTERVAL_MS has passed since the oldest one arrived.
+
+Modes (RESULT_WRITE_MODE):
+    direct    insert_one per result before responding (no buffering)
+    ack       buffered, but the request waits until its batch is written
+              (group commit: same durability as direct, far fewer writes)
+    deferred  respond immediately and persist in the background; results
+              still buffered are lost if the process dies without a
+              graceful shutdown
+
+Configuration:
+    RESULT_WRITE_MODE          direct | ack | deferred
+    RESULT_BATCH_SIZE          documents per insert_many
+    RESULT_FLUSH_INTERVAL_MS   longest a result waits in the buffer
+    RESULT_BUFFER_LIMIT        buffered results before writers must wait
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+
+RESULT_WRITE_MODE = os.environ.get('RESULT_WRITE_MODE', 'direct')
+RESULT_BATCH_SIZE = int(os.environ.get('RESULT_BATCH_SIZE', 100))
+RESULT_FLUSH_INTERVAL_MS = float(os.environ.get('RESULT_FLUSH_INTERVAL_MS', 50))
+RESULT_BUFFER_LIMIT = int(os.environ.get('RESULT_BUFFER_LIMIT', 10000))
+
+WRITE_MODES = ('direct', 'ack', 'deferred')
+
+# Failed batches are retried this many times before the results are dropped
+MAX_FLUSH_ATTEMPTS = 3
+
+logger = logging.getLogger(__name__)
+
+
+class ResultWriter:
+    """Buffers documents for one collection and flushes them in batches"""
+
+    def __init__(self, collection, mode=RESULT_WRITE_MODE, batch_size=RESULT_BATCH_SIZE,
+                 flush_interval_ms=RESULT_FLUSH_INTERVAL_MS, buffer_limit=RESULT_BUFFER_LIMIT):
+        if mode not in WRITE_MODES:
+            raise ValueError(f"Unknown result write mode {mode!r}; expected one of {', '.join(WRITE_MODES)}")
+        self.collection = collection
+        self.mode = mode
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.buffer_limit = buffer_limit
+        # (document, future or None, attempts)
+        self._buffer = deque()
+        self._pending = asyncio.Event()  # buffer is non-empty
+        self._full = asyncio.Event()     # a whole batch is waiting
+        self._space = asyncio.Condition()
+        self._task = None
+        self._closing = False
+        # Metrics
+        self.flushes = 0
+        self.documents_written = 0
+        self.documents_dropped = 0
+        self.failed_flushes = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+        self.max_depth = 0
+
+    def start(self):
+        if self.mode != 'direct' and self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Flush everything still buffered; called on graceful shutdown"""
+        self._closing = True
+        if self._task is not None:
+            self._pending.set()
+            self._full.set()
+            await self._task
+            self._task = None
+        while self._buffer:
+            await self._flush_batch()
+        if self.flushes:
+            logger.info(f"Result writer stopped after {self.documents_written} documents in {self.flushes} flushes")
+
+    async def write(self, document):
+        """Persist one result according to the configured mode"""
+        if self.mode == 'direct' or self._task is None:
+            await self.collection.insert_one(document)
+            self.documents_written += 1
+            return
+
+        # Bound memory: past the limit, writers wait for the next flush
+        if len(self._buffer) >= self.buffer_limit:
+            async with self._space:
+                await self._space.wait_for(lambda: len(self._buffer) < self.buffer_limit)
+
+        future = asyncio.get_running_loop().create_future() if self.mode == 'ack' else None
+        self._buffer.append((document, future, 0))
+        self.max_depth = max(self.max_depth, len(self._buffer))
+        self._pending.set()
+        if len(self._buffer) >= self.batch_size:
+            self._full.set()
+        if future is not None:
+            await future
+
+    async def _flush_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._pending.wait()
+            if self._closing:
+                return
+            # Give a partial batch up to one interval to fill
+            deadline = loop.time() + self.flush_interval
+            while len(self._buffer) < self.batch_size and not self._closing:
+                self._full.clear()
+                try:
+                    await asyncio.wait_for(self._full.wait(), max(deadline - loop.time(), 0))
+                except asyncio.TimeoutError:
+                    break
+            # Flush what is buffered now; retried documents wait for the next round
+            for _ in range(-(-len(self._buffer) // self.batch_size)):
+                await self._flush_batch()
+            # stop() may have set _pending during the flush; clearing it then would leave
+            # this loop waiting forever instead of returning for the final drain
+            if not self._buffer and not self._closing:
+                self._pending.clear()
+
+    async def _flush_batch(self):
+        batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+        async with self._space:
+            self._space.notify_all()
+
+        started = time.perf_counter()
+        failed = {}
+        try:
+            await self.collection.insert_many([document for document, _, _ in batch], ordered=False)
+        except Exception as e:
+            # BulkWriteError lists the failed positions; anything else failed the whole batch
+            write_errors = getattr(e, 'details', None) or {}
+            write_errors = write_errors.get('writeErrors') if isinstance(write_errors, dict) else None
+            if write_errors:
+                failed = {error['index']: e for error in write_errors}
+            else:
+                failed = {index: e for index in range(len(batch))}
+            self.failed_flushes += 1
+            logger.error(f"Result flush of {len(batch)} documents had {len(failed)} failures: {e}")
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.flushes += 1
+        self.last_flush_ms = elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+        self._total_flush_ms += elapsed_ms
+
+        retry = []
+        for index, (document, future, attempts) in enumerate(batch):
+            error = failed.get(index)
+            if error is None:
+                self.documents_written += 1
+                if future is not None and not future.done():
+                    future.set_result(None)
+            elif future is not None:
+                # The request is still waiting: report the failure to it
+                if not future.done():
+                    future.set_exception(error)
+            elif attempts + 1 < MAX_FLUSH_ATTEMPTS and not _is_duplicate(error, index):
+                retry.append((document, None, attempts + 1))
+            else:
+                self.documents_dropped += 1
+                logger.error(f"Dropping diagnostic result {document.get('id')} after {attempts + 1} attempts")
+        # Retried documents go to the front so ordering stays roughly by arrival
+        self._buffer.extendleft(reversed(retry))
+
+    def stats(self):
+        return {
+            'mode': self.mode,
+            'buffer_depth': len(self._buffer),
+            'max_buffer_depth': self.max_depth,
+            'flushes': self.flushes,
+            'failed_flushes': self.failed_flushes,
+            'documents_written': self.documents_written,
+            'documents_dropped': self.documents_dropped,
+            'last_flush_ms': round(self.last_flush_ms, 3),
+            'max_flush_ms': round(self.max_flush_ms, 3),
+            'avg_flush_ms': round(self._total_flush_ms / self.flushes, 3) if self.flushes else 0.0,
+        }
+
+
+def _is_duplicate(error, index):
+    """Duplicate-key failures will never succeed on retry"""
+    details = getattr(error, 'details', None) or {}
+    for write_error in details.get('writeErrors', []) if isinstance(details, dict) else []:
+        if write_error.get('index') == index and write_error.get('code') == 11000:
+            return True
+    return False
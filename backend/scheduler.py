@@ -0,0 +1,163 @@
+"""
+Priority + shortest-job-first admission to the analysis stage.
+
+Decoding and feature extraction run under one of ANALYSIS_SLOTS slots.
+When every slot is busy, uploads wait in a queue ordered by priority
+class, then by estimated cost, rather than by arrival, so one long upload
+no longer holds up a run of short clips behind it.
+
+Cost is estimated before decoding, from the container headers probed
+during upload: duration x sample rate, i.e. the samples to decode and
+analyse. A clip whose headers give no duration is costed as
+MAX_AUDIO_SECONDS.
+
+Each waiting job's position is a virtual start time:
+
+    enqueued at + class delay + cost / SCHEDULER_AGING_RATE
+
+Bulk jobs start SCHEDULER_BULK_DELAY seconds "later" than interactive
+ones. A job of N samples yields to shorter jobs for N / SCHEDULER_AGING_RATE
+seconds. Because every waiting job ages at the same rate, the order is
+fixed at enqueue time, which keeps the queue a heap. No job waits
+indefinitely: once its virtual start time has passed, nothing arriving
+later can overtake it.
+
+Configuration:
+    ANALYSIS_SLOTS           concurrent analyses (defaults to ANALYSIS_WORKERS, at least 1)
+    SCHEDULER_POLICY         sjf | fifo
+    SCHEDULER_AGING_RATE     samples of estimated cost forgiven per second waited
+    SCHEDULER_BULK_DELAY     seconds of head start interactive jobs get over bulk
+    SCHEDULER_SHORT_SECONDS  clips up to this long are reported as "short" in metrics
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+import numpy as np
+
+from analysis_pool import ANALYSIS_WORKERS
+from uploads import MAX_AUDIO_SECONDS
+
+ANALYSIS_SLOTS = int(os.environ.get('ANALYSIS_SLOTS', max(ANALYSIS_WORKERS, 1)))
+SCHEDULER_POLICY = os.environ.get('SCHEDULER_POLICY', 'sjf')
+SCHEDULER_AGING_RATE = float(os.environ.get('SCHEDULER_AGING_RATE', 1_000_000))
+SCHEDULER_BULK_DELAY = float(os.environ.get('SCHEDULER_BULK_DELAY', 30))
+SCHEDULER_SHORT_SECONDS = float(os.environ.get('SCHEDULER_SHORT_SECONDS', 30))
+
+POLICIES = ('sjf', 'fifo')
+PRIORITY_CLASSES = ('interactive', 'bulk')
+DEFAULT_PRIORITY = 'interactive'
+
+# Assumed when the headers give no sample rate
+FALLBACK_SAMPLE_RATE = 44100
+
+# Recent latencies kept per (class, length) for percentiles
+LATENCY_WINDOW = 1000
+
+
+def estimate_cost(probe):
+    """Samples to decode and analyse, from the upload's container headers"""
+    duration = probe.duration if probe.duration is not None else MAX_AUDIO_SECONDS
+    return duration * (probe.sample_rate or FALLBACK_SAMPLE_RATE)
+
+
+def _percentiles(values):
+    if not values:
+        return {'p50_ms': None, 'p95_ms': None}
+    p50, p95 = np.percentile(values, [50, 95])
+    return {'p50_ms': round(float(p50), 1), 'p95_ms': round(float(p95), 1)}
+
+
+class AnalysisScheduler:
+    """Hands out analysis slots by priority class, estimated cost and age"""
+
+    def __init__(self, slots=ANALYSIS_SLOTS, policy=SCHEDULER_POLICY, aging_rate=SCHEDULER_AGING_RATE,
+                 bulk_delay=SCHEDULER_BULK_DELAY, short_seconds=SCHEDULER_SHORT_SECONDS):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown scheduler policy {policy!r}; expected one of {', '.join(POLICIES)}")
+        self.slots = max(slots, 1)
+        self.policy = policy
+        self.aging_rate = aging_rate
+        self.class_delay = {'interactive': 0.0, 'bulk': bulk_delay}
+        self.short_seconds = short_seconds
+        self.running = 0
+        # (virtual start, sequence, future)
+        self._queue = []
+        self._sequence = itertools.count()
+        # Metrics, per "class/short" or "class/long"
+        self.completed = {}
+        self._waits = {}
+        self._latencies = {}
+
+    def _virtual_start(self, priority, cost, enqueued):
+        if self.policy == 'fifo':
+            return enqueued
+        return enqueued + self.class_delay[priority] + cost / self.aging_rate
+
+    @asynccontextmanager
+    async def slot(self, priority, cost, duration=None):
+        """Hold an analysis slot for the body of the `async with`"""
+        if priority not in self.class_delay:
+            raise ValueError(f"Unknown priority class {priority!r}; expected one of {', '.join(PRIORITY_CLASSES)}")
+        enqueued = time.monotonic()
+        if self.running < self.slots and not self._queue:
+            self.running += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._queue, (self._virtual_start(priority, cost, enqueued), next(self._sequence), future))
+            try:
+                await future
+            except asyncio.CancelledError:
+                # The client went away; if the slot was already handed over, pass it on
+                if future.done() and not future.cancelled():
+                    self._release()
+                else:
+                    future.cancel()
+                raise
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release()
+            self._record(priority, duration, started - enqueued, time.monotonic() - enqueued)
+
+    def _release(self):
+        """Hand the slot to the first live waiter, or free it"""
+        while self._queue:
+            _, _, future = heapq.heappop(self._queue)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.running -= 1
+
+    def _record(self, priority, duration, waited, total):
+        length = 'short' if duration is not None and duration <= self.short_seconds else 'long'
+        key = f"{priority}/{length}"
+        if key not in self.completed:
+            self.completed[key] = 0
+            self._waits[key] = deque(maxlen=LATENCY_WINDOW)
+            self._latencies[key] = deque(maxlen=LATENCY_WINDOW)
+        self.completed[key] += 1
+        self._waits[key].append(waited * 1000)
+        self._latencies[key].append(total * 1000)
+
+    def stats(self):
+        return {
+            'policy': self.policy,
+            'slots': self.slots,
+            'running': self.running,
+            'queued': sum(1 for _, _, future in self._queue if not future.done()),
+            'classes': {
+                key: {
+                    'completed': self.completed[key],
+                    'wait': _percentiles(self._waits[key]),
+                    'latency': _percentiles(self._latencies[key]),
+                }
+                for key in sorted(self.completed)
+            },
+        }
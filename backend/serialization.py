@@ -0,0 +1,96 @@
+"""
+Fast JSON responses for the read endpoints.
+
+Documents read from Mongo with an `{'_id': 0}` projection are already
+JSON-shaped (strings, numbers, lists, naive UTC datetimes), so they are
+encoded directly with orjson instead of being validated into pydantic
+models and run through jsonable_encoder and json.dumps. Large bodies are
+compressed with brotli or gzip when the client accepts it.
+
+orjson and brotli are optional: without them the stdlib json encoder and
+gzip are used.
+
+Configuration:
+    RESPONSE_COMPRESS_MIN_BYTES   smallest body worth compressing (0 disables)
+"""
+
+import gzip
+import json
+import os
+from datetime import datetime
+
+from pydantic import BaseModel
+from starlette.responses import Response
+
+RESPONSE_COMPRESS_MIN_BYTES = int(os.environ.get('RESPONSE_COMPRESS_MIN_BYTES', 16384))
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def _default(value):
+    if isinstance(value, BaseModel):
+        return value.model_dump()
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content):
+    """Encode trusted content to JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(content, default=_default, separators=(',', ':')).encode()
+
+
+def _accepted_encodings(request):
+    header = request.headers.get('accept-encoding', '') if request is not None else ''
+    accepted = set()
+    for part in header.split(','):
+        coding, _, params = part.partition(';')
+        # q=0 means "not acceptable"; other weights only rank codings, and ours are ranked already
+        quality = params.strip().lower()
+        if quality.startswith('q='):
+            try:
+                if float(quality[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if coding.strip():
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def compress(body, accepted):
+    """(body, content-encoding) using the best encoding the client accepts"""
+    if not RESPONSE_COMPRESS_MIN_BYTES or len(body) < RESPONSE_COMPRESS_MIN_BYTES:
+        return body, None
+    if brotli is not None and 'br' in accepted:
+        return brotli.compress(body, quality=BROTLI_QUALITY), 'br'
+    if 'gzip' in accepted:
+        return gzip.compress(body, compresslevel=GZIP_LEVEL), 'gzip'
+    return body, None
+
+
+def json_response(content, request=None, status_code=200, headers=None):
+    """JSON response encoded in one pass, compressed when large"""
+    return encoded_response(dumps(content), request, status_code, headers)
+
+
+def encoded_response(body, request=None, status_code=200, headers=None):
+    """Response for an already encoded JSON body"""
+    body, encoding = compress(body, _accepted_encodings(request))
+    headers = dict(headers or {})
+    headers['Vary'] = 'Accept-Encoding'
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    return Response(body, status_code=status_code, headers=headers, media_type='application/json')
@@ -1,12 +1,13 @@
-from fastapi import FastAPI, APIRouter, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, APIRouter, Depends, Request, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import re
+import asyncio
 import logging
+import time
 import aiofiles
-import librosa
 import numpy as np
 import random
 from pathlib import Path
@@ -15,17 +16,54 @@ from typing import List, Optional
 import uuid
 from datetime import datetime, timedelta
 import base64
+import shutil
+from contextlib import asynccontextmanager
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Local modules read their settings from the environment at import time
+from alerts import AlertEngine
+from analytics import GRANULARITIES, FleetAnalytics
+from analysis import ANALYSIS_VERSION
+from analysis_pool import AnalysisPool
+from baselines import FEATURE_NAMES, BaselineStore
+from cohorts import CohortBaselines, deviation
+from bulk_import import IMPORT_FORMATS, import_format, import_vehicles, normalize_vin
+from decoder_pool import DECODER_POOL_SIZE, POOL_FORMATS, DecoderPool
+from decoders import decode_audio
+from diagnosis_batcher import DiagnosisBatcher
+from events import EventBroker
+from fidelity import FidelityController
+from exports import (
+    DIAGNOSTIC_COLUMNS, EXPORT_BATCH_SIZE, EXPORT_FORMATS, VEHICLE_COLUMNS,
+    diagnostics_query, stream_export, vehicles_query,
+)
+from pcm_shm import PCMSegment
+from result_writer import ResultWriter
+from scheduler import DEFAULT_PRIORITY, PRIORITY_CLASSES, AnalysisScheduler, estimate_cost
+from serialization import encoded_response, dumps, json_response
+from vehicle_search import (
+    VEHICLE_PROJECTION, InvalidCursor, PageCache, build_query, ensure_vehicle_indexes, search_keys, search_page,
+)
+from upload_sessions import UploadSessions, missing_ranges
+from uploads import (
+    FORMAT_EXTENSIONS, MAX_UPLOAD_BYTES, UploadSizeLimitMiddleware, check_duration, check_extension, probe_file,
+    receive_form_upload,
+)
+from wav_mmap import wav_file
+
+# Optional directory where uploaded audio is kept so results can be
+# reprocessed later by the backfill engine (see backfill.py)
+AUDIO_ARCHIVE_DIR = os.environ.get('AUDIO_ARCHIVE_DIR')
+
+# Client-side filename extensions accepted for uploads (content is sniffed as well)
+
+# Content-Range of a resumable upload chunk: bytes start-end/size (end inclusive)
+CONTENT_RANGE = re.compile(r'bytes (\d+)-(\d+)/(\d+|\*)$')
 
-# Create the main app without a prefix
-app = FastAPI(title="Eniguity Diagnostics API")
+# Largest page the list endpoints return
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 10000))
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -37,6 +75,7 @@ class VehicleInfo(BaseModel):
     model: str
     year: int
     mileage: int
+    vin: Optional[str] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class DiagnosticResult(BaseModel):
@@ -50,8 +89,23 @@ class DiagnosticResult(BaseModel):
     recommendations: List[str]
     estimated_cost: Optional[float] = None
     urgency_level: str  # immediate, week, month, monitoring
+    # Distance from the vehicle's own acoustic baseline (None until it has enough history)
+    anomaly_score: Optional[float] = None
+    baseline_samples: Optional[int] = None
+    # Same, against vehicles of the same make, model, year band and mileage band
+    cohort_score: Optional[float] = None
+    cohort_samples: Optional[int] = None
+    # Fidelity profile the features were extracted with (quick, full or detailed)
+    analysis_profile: str = 'full'
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+class UploadSessionCreate(BaseModel):
+    filename: str
+    size: int
+    vehicle_id: Optional[str] = None
+    profile: Optional[str] = None
+    priority: str = DEFAULT_PRIORITY
+
 class HealthScore(BaseModel):
     overall_score: int
     engine_health: int
@@ -60,151 +114,6 @@ class HealthScore(BaseModel):
     exhaust_health: int
     last_updated: datetime = Field(default_factory=datetime.utcnow)
 
-# Mock AI Analysis Functions
-def extract_audio_features(audio_data, sr):
-    """Extract MFCC and other audio features"""
-    try:
-        # Validate input
-        if len(audio_data) == 0:
-            logging.error("Audio data is empty")
-            return None
-            
-        if sr <= 0:
-            logging.error(f"Invalid sample rate: {sr}")
-            return None
-            
-        # Ensure audio is not too short (minimum 0.1 seconds)
-        min_samples = int(0.1 * sr)
-        if len(audio_data) < min_samples:
-            logging.warning(f"Audio too short ({len(audio_data)} samples), padding")
-            audio_data = np.pad(audio_data, (0, min_samples - len(audio_data)), mode='constant')
-        
-        # Extract MFCC features with error handling
-        try:
-            mfcc = librosa.feature.mfcc(y=audio_data, sr=sr, n_mfcc=13)
-            mfcc_mean = np.mean(mfcc, axis=1)
-        except Exception as e:
-            logging.error(f"MFCC extraction failed: {e}")
-            mfcc_mean = np.zeros(13)  # Fallback
-        
-        # Extract spectral features with error handling
-        try:
-            spectral_centroid = np.mean(librosa.feature.spectral_centroid(y=audio_data, sr=sr))
-        except Exception as e:
-            logging.error(f"Spectral centroid extraction failed: {e}")
-            spectral_centroid = 0.0
-            
-        try:
-            spectral_rolloff = np.mean(librosa.feature.spectral_rolloff(y=audio_data, sr=sr))
-        except Exception as e:
-            logging.error(f"Spectral rolloff extraction failed: {e}")
-            spectral_rolloff = 0.0
-        
-        # Zero crossing rate with error handling
-        try:
-            zcr = np.mean(librosa.feature.zero_crossing_rate(audio_data))
-        except Exception as e:
-            logging.error(f"ZCR extraction failed: {e}")
-            zcr = 0.0
-        
-        features = {
-            'mfcc_features': mfcc_mean.tolist(),
-            'spectral_centroid': float(spectral_centroid),
-            'spectral_rolloff': float(spectral_rolloff),
-            'zero_crossing_rate': float(zcr),
-            'duration': len(audio_data) / sr,
-            'sample_rate': sr,
-            'samples': len(audio_data)
-        }
-        
-        logging.info(f"Successfully extracted features - Duration: {features['duration']:.2f}s, SR: {sr}")
-        return features
-        
-    except Exception as e:
-        logging.error(f"Feature extraction error: {e}")
-        return None
-
-def generate_mock_diagnosis(features):
-    """Generate realistic mock automotive diagnosis based on audio features"""
-    
-    diagnoses_db = [
-        {
-            'component': 'Engine',
-            'diagnosis': 'Timing Belt Wear Detected',
-            'confidence': random.uniform(0.75, 0.95),
-            'severity': 'high',
-            'recommendations': [
-                'Schedule timing belt replacement within 2 weeks',
-                'Check water pump condition during replacement',
-                'Inspect tensioner and idler pulleys'
-            ],
-            'estimated_cost': random.uniform(800, 1200),
-            'urgency': 'week'
-        },
-        {
-            'component': 'Engine',
-            'diagnosis': 'Healthy Engine Operation',
-            'confidence': random.uniform(0.85, 0.98),
-            'severity': 'low',
-            'recommendations': [
-                'Continue regular maintenance schedule',
-                'Monitor oil levels monthly',
-                'Next service in 3 months'
-            ],
-            'estimated_cost': 0,
-            'urgency': 'monitoring'
-        },
-        {
-            'component': 'Brakes',
-            'diagnosis': 'Brake Pad Wear - Front Axle',
-            'confidence': random.uniform(0.80, 0.94),
-            'severity': 'medium',
-            'recommendations': [
-                'Replace brake pads within 1 month',
-                'Inspect brake rotors for scoring',
-                'Check brake fluid level'
-            ],
-            'estimated_cost': random.uniform(300, 500),
-            'urgency': 'month'
-        },
-        {
-            'component': 'Engine',
-            'diagnosis': 'Bearing Wear - Connecting Rod',
-            'confidence': random.uniform(0.70, 0.88),
-            'severity': 'critical',
-            'recommendations': [
-                'IMMEDIATE ENGINE SHUTDOWN RECOMMENDED',
-                'Tow to certified mechanic',
-                'Complete engine inspection required'
-            ],
-            'estimated_cost': random.uniform(2000, 4000),
-            'urgency': 'immediate'
-        },
-        {
-            'component': 'Exhaust',
-            'diagnosis': 'Exhaust Leak - Mid-Pipe Section',
-            'confidence': random.uniform(0.65, 0.82),
-            'severity': 'medium',
-            'recommendations': [
-                'Repair exhaust leak within 2 weeks',
-                'Check emissions compliance',
-                'Inspect catalytic converter'
-            ],
-            'estimated_cost': random.uniform(200, 400),
-            'urgency': 'week'
-        }
-    ]
-    
-    # Simulate intelligent selection based on features
-    if features and features.get('spectral_centroid', 0) > 2000:
-        # High frequency suggests brake squeal
-        return [d for d in diagnoses_db if d['component'] == 'Brakes'][0]
-    elif features and features.get('zero_crossing_rate', 0) > 0.1:
-        # High ZCR might suggest engine issues
-        return random.choice([d for d in diagnoses_db if d['component'] == 'Engine'])
-    else:
-        return random.choice(diagnoses_db)
-
 def generate_health_scores():
     """Generate realistic vehicle health scores"""
     return HealthScore(
@@ -215,71 +124,195 @@ def generate_health_scores():
         exhaust_health=random.randint(65, 88)
     )
 
+def get_db(request: Request):
+    """MongoDB database handle created in the app lifespan"""
+    return request.app.state.db
+
+async def extract_upload_features(state, temp_path, probe, profile):
+    """Decode an upload into shared memory and run feature extraction on it with a fidelity profile"""
+    if probe.format == 'wav':
+        # Large PCM WAV files are read in place rather than decoded
+        wav = wav_file(temp_path)
+        if wav is not None:
+            return await state.analysis_pool.extract_wav_features(wav, profile)
+    
+    decoder_pool = state.decoder_pool
+    # Compressed formats go to the persistent decoder pool; the rest decode inline
+    if decoder_pool is not None and probe.format in POOL_FORMATS:
+        async with aiofiles.open(temp_path, 'rb') as f:
+            encoded = await f.read()
+        segment, sample_rate = await decoder_pool.decode(encoded, probe.format)
+    else:
+        audio_data, sample_rate = decode_audio(temp_path, probe.format)
+        segment = PCMSegment.from_array(np.asarray(audio_data, dtype=np.float32))
+    
+    try:
+        # Verify audio was loaded successfully
+        if segment.array.shape[0] == 0:
+            raise ValueError("Audio file appears to be empty or corrupted")
+        
+        if sample_rate is None or sample_rate <= 0:
+            raise ValueError("Invalid sample rate detected")
+        
+        return await state.analysis_pool.extract_features(segment, sample_rate, profile)
+    finally:
+        segment.release()
+
+# Stored alongside a result but never returned to clients or pushed to dashboards
+PRIVATE_RESULT_FIELDS = ('_id', 'audio_features', 'audio_path')
+RESULT_PROJECTION = {field: 0 for field in PRIVATE_RESULT_FIELDS}
+
+async def record_result(state, result_dict, vehicle):
+    """Fold a stored diagnostic result into the views derived from it and notify dashboards"""
+    try:
+        await state.analytics.record(result_dict, vehicle)
+    except Exception as e:
+        # Derived views must never fail the upload that produced the result
+        logging.error(f"Analytics rollup update failed for result {result_dict['id']}: {e}")
+    
+    try:
+        alerts = await state.alerts.record(result_dict)
+    except Exception as e:
+        logging.error(f"Alert evaluation failed for result {result_dict['id']}: {e}")
+        alerts = []
+    
+    state.events.publish('diagnostic', {
+        key: value for key, value in result_dict.items() if key not in PRIVATE_RESULT_FIELDS
+    })
+    state.events.publish('health', generate_health_scores().dict())
+    for alert in alerts:
+        state.events.publish('alert', alert)
+
 # API Routes
+async def store_diagnosis(state, features, vehicle, filename, profile, audio_path, file_extension):
+    """Score, diagnose and store the features of an uploaded clip; returns the DiagnosticResult"""
+    vehicle_id = vehicle['id'] if vehicle is not None else None
+    # Score against the vehicle's own and cohort baselines, then fold this clip into both.
+    # Quick features come from a shorter, downsampled clip and would skew the statistics.
+    baseline = {}
+    if vehicle is not None and profile != 'quick':
+        try:
+            baseline = await state.baselines.observe(vehicle_id, features)
+        except Exception as e:
+            logging.error(f"Baseline update failed for vehicle {vehicle_id}: {e}")
+        baseline.update(state.cohorts.observe(vehicle, features))
+    
+    # Generate mock diagnosis, batched with concurrent requests
+    diagnosis_data = await state.diagnosis_batcher.diagnose(features)
+    
+    # Create diagnostic result
+    result = DiagnosticResult(
+        vehicle_id=vehicle_id,
+        audio_filename=filename,
+        component=diagnosis_data['component'],
+        diagnosis=diagnosis_data['diagnosis'],
+        confidence_score=diagnosis_data['confidence'],
+        severity=diagnosis_data['severity'],
+        recommendations=diagnosis_data['recommendations'],
+        estimated_cost=diagnosis_data['estimated_cost'],
+        urgency_level=diagnosis_data['urgency'],
+        analysis_profile=profile,
+        **baseline
+    )
+    
+    # Store in database along with the inputs needed to reprocess it
+    result_dict = result.dict()
+    result_dict['audio_features'] = features
+    result_dict['analysis_version'] = ANALYSIS_VERSION
+    if AUDIO_ARCHIVE_DIR:
+        archive_path = os.path.join(AUDIO_ARCHIVE_DIR, f"{result.id}{file_extension}")
+        os.makedirs(AUDIO_ARCHIVE_DIR, exist_ok=True)
+        shutil.move(audio_path, archive_path)
+        result_dict['audio_path'] = archive_path
+    # Direct insert, or buffered per RESULT_WRITE_MODE (see result_writer.py)
+    await state.result_writer.write(result_dict)
+    await record_result(state, result_dict, vehicle)
+    return result
+
+async def check_upload_options(request, db, filename, vehicle_id, profile, priority):
+    """Validate an upload's filename, vehicle, profile and priority; returns (vehicle, profile)"""
+    # Validate file type
+    check_extension(filename)
+    
+    # The vehicle places the result in its make/model cohort for analytics
+    vehicle = None
+    if vehicle_id:
+        vehicle = await db.vehicles.find_one({'id': vehicle_id}, {'_id': 0})
+        if vehicle is None:
+            raise HTTPException(status_code=404, detail="Vehicle not found")
+    
+    if priority not in PRIORITY_CLASSES:
+        raise HTTPException(status_code=400, detail=f"priority must be one of: {', '.join(PRIORITY_CLASSES)}")
+    
+    # Explicit profile, or quick while the service is overloaded
+    fidelity = request.app.state.fidelity
+    try:
+        profile = fidelity.choose(profile)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return vehicle, profile
+
+def upload_options(fields):
+    """(vehicle_id, profile, priority) from analyze-audio form fields"""
+    return fields.get('vehicle_id') or None, fields.get('profile') or None, fields.get('priority') or DEFAULT_PRIORITY
+
 @api_router.get("/")
 async def root():
     return {"message": "Eniguity Diagnostics API v1.0"}
 
+@api_router.get("/ready")
+async def readiness(request: Request):
+    """Readiness probe: 503 until the analysis kernels have been warmed up"""
+    if not getattr(request.app.state, 'ready', False):
+        return JSONResponse(status_code=503, content={"status": "warming_up"})
+    return {"status": "ready"}
+
 @api_router.post("/analyze-audio")
-async def analyze_audio(file: UploadFile = File(...)):
-    """Analyze uploaded audio file for vehicle diagnostics"""
+async def analyze_audio(request: Request, db=Depends(get_db)):
+    """
+    Analyze uploaded audio file for vehicle diagnostics.
+    multipart/form-data: file, plus optional vehicle_id, profile (quick, full or
+    detailed; chosen by load if omitted) and priority (interactive or bulk).
+    Options sent ahead of the file are checked before any of its bytes are read.
+    """
+    checked = {}
+
+    async def check_options(filename, fields):
+        checked['fields'] = fields
+        checked['options'] = await check_upload_options(request, db, filename or '', *upload_options(fields))
+
     try:
-        # Validate file type
-        allowed_extensions = ('.wav', '.mp3', '.m4a', '.ogg', '.flac')
-        if not file.filename.lower().endswith(allowed_extensions):
-            raise HTTPException(status_code=400, detail="Unsupported audio format. Please upload WAV, MP3, M4A, OGG, or FLAC files.")
-        
-        # Read and process audio file
-        contents = await file.read()
-        
-        # Get file extension to preserve format
-        file_extension = os.path.splitext(file.filename.lower())[1]
-        if not file_extension:
-            file_extension = '.wav'  # Default fallback
-            
-        # Save temporarily with correct extension for librosa
-        temp_path = f"/tmp/{uuid.uuid4()}{file_extension}"
-        async with aiofiles.open(temp_path, 'wb') as f:
-            await f.write(contents)
+        # Parse the form as it streams in, with size, format and duration checks on the
+        # first bytes of the file, so bad uploads are refused before the rest arrives
+        temp_path, probe, filename, fields = await receive_form_upload(request, check_options)
+        file_extension = os.path.splitext(temp_path)[1]
+        try:
+            if fields != checked['fields']:
+                # Options that followed the file
+                checked['options'] = await check_upload_options(request, db, filename or '', *upload_options(fields))
+        except HTTPException:
+            os.remove(temp_path)
+            raise
+        vehicle, profile = checked['options']
+        priority = upload_options(fields)[2]
+        fidelity = request.app.state.fidelity
         
         try:
-            # Load audio with librosa - it will handle different formats automatically
-            audio_data, sample_rate = librosa.load(temp_path, sr=None)
-            
-            # Verify audio was loaded successfully
-            if len(audio_data) == 0:
-                raise ValueError("Audio file appears to be empty or corrupted")
-            
-            if sample_rate is None or sample_rate <= 0:
-                raise ValueError("Invalid sample rate detected")
-            
-            # Extract features
-            features = extract_audio_features(audio_data, sample_rate)
+            # Wait for an analysis slot (by priority, then estimated cost from the headers),
+            # then decode into shared memory and extract features in the analysis pool
+            with fidelity.track(profile):
+                async with request.app.state.scheduler.slot(priority, estimate_cost(probe), probe.duration):
+                    features = await extract_upload_features(request.app.state, temp_path, probe, profile)
             
             if features is None:
                 raise ValueError("Failed to extract audio features")
             
-            # Generate mock diagnosis
-            diagnosis_data = generate_mock_diagnosis(features)
-            
-            # Create diagnostic result
-            result = DiagnosticResult(
-                audio_filename=file.filename,
-                component=diagnosis_data['component'],
-                diagnosis=diagnosis_data['diagnosis'],
-                confidence_score=diagnosis_data['confidence'],
-                severity=diagnosis_data['severity'],
-                recommendations=diagnosis_data['recommendations'],
-                estimated_cost=diagnosis_data['estimated_cost'],
-                urgency_level=diagnosis_data['urgency']
-            )
-            
-            # Store in database
-            result_dict = result.dict()
-            await db.diagnostic_results.insert_one(result_dict)
+            result = await store_diagnosis(request.app.state, features, vehicle, filename, profile,
+                                           temp_path, file_extension)
             
             # Clean up temp file
-            os.remove(temp_path)
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
             
             return result
             
@@ -287,7 +320,7 @@ async def analyze_audio(file: UploadFile = File(...)):
             # Clean up temp file on error
             if os.path.exists(temp_path):
                 os.remove(temp_path)
-            logging.error(f"Audio processing error for file {file.filename}: {str(e)}")
+            logging.error(f"Audio processing error for file {filename}: {str(e)}")
             raise HTTPException(status_code=400, detail=f"Audio processing failed. Please ensure you uploaded a valid audio file. Error: {str(e)}")
             
     except HTTPException:
@@ -296,77 +329,355 @@ async def analyze_audio(file: UploadFile = File(...)):
         logging.error(f"Unexpected error in analyze_audio: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
+def get_upload_session(request, upload_id):
+    session = request.app.state.upload_sessions.get(upload_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Upload not found or expired")
+    return session
+
+@api_router.post("/uploads", status_code=201)
+async def create_upload(request: Request, upload: UploadSessionCreate, db=Depends(get_db)):
+    """
+    Start a resumable upload. PUT byte ranges of the file to /api/uploads/{id}
+    with a Content-Range header, in any order and again after a dropped
+    connection, then POST /api/uploads/{id}/finalize for the diagnosis.
+    """
+    if upload.size <= 0:
+        raise HTTPException(status_code=400, detail="size must be positive")
+    if upload.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"File too large. Maximum upload size is {MAX_UPLOAD_BYTES // (1024 * 1024)} MB.")
+    _, profile = await check_upload_options(request, db, upload.filename, upload.vehicle_id, upload.profile, upload.priority)
+    
+    sessions = request.app.state.upload_sessions
+    session = sessions.create(upload.filename, upload.size, upload.vehicle_id, profile, upload.priority)
+    return sessions.describe(session)
+
+@api_router.get("/uploads/{upload_id}")
+async def get_upload(request: Request, upload_id: str):
+    """Received and missing byte ranges of a resumable upload, for resuming it"""
+    return request.app.state.upload_sessions.describe(get_upload_session(request, upload_id))
+
+@api_router.put("/uploads/{upload_id}")
+async def put_upload_range(request: Request, upload_id: str):
+    """Write one byte range of a resumable upload (Content-Range: bytes start-end/size)"""
+    sessions = request.app.state.upload_sessions
+    session = get_upload_session(request, upload_id)
+    if session.finalizing:
+        raise HTTPException(status_code=409, detail="Upload is being finalized")
+    
+    match = CONTENT_RANGE.match(request.headers.get('content-range', ''))
+    if match is None:
+        raise HTTPException(status_code=400, detail="Content-Range header must be 'bytes start-end/size'")
+    start, end = int(match[1]), int(match[2]) + 1
+    if start >= end or end > session.size or (match[3] != '*' and int(match[3]) != session.size):
+        raise HTTPException(status_code=416, detail=f"Range {match[1]}-{match[2]} is outside the {session.size}-byte upload")
+    
+    await sessions.write(session, start, end, request.stream())
+    try:
+        # Format and duration checks once the header is in; WAV segments are analysed as they complete
+        sessions.advance(session)
+    except HTTPException:
+        # Rejected content; the rest of the file is not worth receiving
+        sessions.delete(session)
+        raise
+    return sessions.describe(session)
+
+@api_router.delete("/uploads/{upload_id}", status_code=204)
+async def delete_upload(request: Request, upload_id: str):
+    """Abandon a resumable upload and delete what was received"""
+    request.app.state.upload_sessions.delete(get_upload_session(request, upload_id))
+
+@api_router.post("/uploads/{upload_id}/finalize")
+async def finalize_upload(request: Request, upload_id: str, db=Depends(get_db)):
+    """Analyse a fully received resumable upload; responds like /api/analyze-audio"""
+    state = request.app.state
+    sessions = state.upload_sessions
+    session = get_upload_session(request, upload_id)
+    if session.finalizing:
+        raise HTTPException(status_code=409, detail="Upload is already being finalized")
+    missing = missing_ranges(session.received, session.size)
+    if missing:
+        raise HTTPException(status_code=409, detail=f"Upload is incomplete: {len(missing)} byte ranges missing")
+    session.finalizing = True
+    
+    try:
+        vehicle = None
+        if session.vehicle_id:
+            vehicle = await db.vehicles.find_one({'id': session.vehicle_id}, {'_id': 0})
+            if vehicle is None:
+                raise HTTPException(status_code=404, detail="Vehicle not found")
+        
+        try:
+            sessions.advance(session)
+            probe = probe_file(session.data_path, session.format)
+            check_duration(probe)
+        except HTTPException:
+            sessions.delete(session)
+            raise
+        
+        # Segments analysed while the upload arrived are kept; only the rest is left to do here
+        await sessions.settle(session)
+        with state.fidelity.track(session.profile):
+            if session.streaming:
+                async with state.scheduler.slot(session.priority, sessions.outstanding_samples(session), probe.duration):
+                    features = await sessions.features(session)
+            else:
+                async with state.scheduler.slot(session.priority, estimate_cost(probe), probe.duration):
+                    features = await extract_upload_features(state, session.data_path, probe, session.profile)
+        
+        if features is None:
+            raise ValueError("Failed to extract audio features")
+        
+        result = await store_diagnosis(state, features, vehicle, session.filename, session.profile,
+                                       session.data_path, FORMAT_EXTENSIONS[session.format])
+        sessions.complete(session)
+        return result
+    
+    except HTTPException:
+        session.finalizing = False
+        raise
+    except Exception as e:
+        # The session is kept, so finalize can be retried
+        session.finalizing = False
+        logging.error(f"Audio processing error for upload {upload_id}: {str(e)}")
+        raise HTTPException(status_code=400, detail=f"Audio processing failed. Please ensure you uploaded a valid audio file. Error: {str(e)}")
+
+@api_router.get("/events")
+async def stream_events(request: Request):
+    """Server-sent events: new diagnostics, alerts and health scores as they are written"""
+    broker = request.app.state.events
+    if broker.full():
+        raise HTTPException(status_code=503, detail="Too many open event streams")
+    return StreamingResponse(
+        broker.stream(),
+        media_type="text/event-stream",
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+@api_router.get("/metrics")
+async def get_metrics(request: Request):
+    """Operational counters for the result writer, event streams and worker pools"""
+    state = request.app.state
+    return {
+        'result_writer': state.result_writer.stats(),
+        'events': state.events.stats(),
+        'alerts': state.alerts.stats(),
+        'baselines': {'conflicts': state.baselines.conflicts},
+        'cohorts': state.cohorts.stats(),
+        'diagnosis_batches': state.diagnosis_batcher.stats(),
+        'fidelity': state.fidelity.stats(),
+        'scheduler': state.scheduler.stats(),
+        'upload_sessions': state.upload_sessions.stats(),
+        'vehicle_cache': state.vehicle_cache.stats(),
+        'decoder_pool': state.decoder_pool.stats() if state.decoder_pool is not None else None,
+    }
+
+@api_router.get("/analytics/rollups")
+async def get_analytics_rollups(request: Request, granularity: str = 'day', days: int = 7,
+                                component: Optional[str] = None, severity: Optional[str] = None,
+                                make: Optional[str] = None, model: Optional[str] = None):
+    """Pre-aggregated result counts per time bucket, component, severity and make/model"""
+    if granularity not in GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of: {', '.join(GRANULARITIES)}")
+    if days <= 0:
+        raise HTTPException(status_code=400, detail="days must be positive")
+    since = datetime.utcnow() - timedelta(days=days)
+    buckets = await request.app.state.analytics.rollups(
+        granularity, since=since, component=component, severity=severity, make=make, model=model
+    )
+    return json_response({'granularity': granularity, 'days': days, 'buckets': buckets}, request)
+
+@api_router.get("/analytics/summary")
+async def get_analytics_summary(request: Request, days: int = 7, component: Optional[str] = None,
+                                severity: Optional[str] = None, make: Optional[str] = None,
+                                model: Optional[str] = None):
+    """Totals per component and severity over the last `days` days"""
+    if days <= 0:
+        raise HTTPException(status_code=400, detail="days must be positive")
+    return await request.app.state.analytics.summary(
+        days, component=component, severity=severity, make=make, model=model
+    )
+
+@api_router.get("/alerts")
+async def get_alerts(request: Request, vehicle_id: Optional[str] = None, limit: int = 20):
+    """Active alerts raised by the rule engine, most recent first"""
+    alerts = await request.app.state.alerts.active(vehicle_id=vehicle_id, limit=max(1, min(limit, 200)))
+    return json_response(alerts, request)
+
+@api_router.post("/alerts/{alert_id}/resolve")
+async def resolve_alert(request: Request, alert_id: str):
+    """Close an active alert; the rule can raise a new one on later results"""
+    if not await request.app.state.alerts.resolve(alert_id, datetime.utcnow()):
+        raise HTTPException(status_code=404, detail="Active alert not found")
+    return {"id": alert_id, "status": "resolved"}
+
 @api_router.get("/health-overview")
-async def get_health_overview():
+async def get_health_overview(request: Request, db=Depends(get_db)):
     """Get overall vehicle health dashboard data"""
     health_scores = generate_health_scores()
     
     # Get recent diagnostics
-    recent_diagnostics = await db.diagnostic_results.find().sort("created_at", -1).limit(5).to_list(5)
-    # Clean up MongoDB ObjectIds
-    for diagnostic in recent_diagnostics:
-        if '_id' in diagnostic:
-            del diagnostic['_id']
+    recent_diagnostics = await db.diagnostic_results.find({}, RESULT_PROJECTION).sort("created_at", -1).limit(5).to_list(5)
     
-    # Generate alerts based on health scores
-    alerts = []
-    if health_scores.brake_health < 70:
-        alerts.append({
-            'type': 'warning',
-            'message': 'Brake system requires attention',
-            'severity': 'medium'
-        })
-    if health_scores.engine_health < 75:
-        alerts.append({
-            'type': 'error',
-            'message': 'Engine diagnostics show concerns',
-            'severity': 'high'
-        })
+    # Alerts are raised when results are written (see alerts.py); this is a plain read
+    alerts = await request.app.state.alerts.active(limit=10)
     
-    return {
+    return json_response({
         'health_scores': health_scores,
         'recent_diagnostics': recent_diagnostics,
         'alerts': alerts,
         'total_diagnostics': await db.diagnostic_results.count_documents({})
-    }
+    }, request)
 
 @api_router.get("/diagnostics/history")
-async def get_diagnostic_history():
+async def get_diagnostic_history(request: Request, limit: int = 20, db=Depends(get_db)):
     """Get diagnostic history"""
-    diagnostics = await db.diagnostic_results.find().sort("created_at", -1).limit(20).to_list(20)
-    # Convert MongoDB documents to JSON-serializable format
-    for diagnostic in diagnostics:
-        if '_id' in diagnostic:
-            del diagnostic['_id']  # Remove MongoDB ObjectId
-    return diagnostics
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    diagnostics = await db.diagnostic_results.find({}, RESULT_PROJECTION).sort("created_at", -1).limit(limit).to_list(limit)
+    return json_response(diagnostics, request)
 
 @api_router.post("/vehicle", response_model=VehicleInfo)
-async def create_vehicle(vehicle_data: dict):
+async def create_vehicle(request: Request, vehicle_data: dict, db=Depends(get_db)):
     """Create new vehicle profile"""
+    from pymongo.errors import DuplicateKeyError
+
+    if vehicle_data.get('vin'):
+        # Stored the way bulk imports store it, so both upsert onto the same vehicle
+        try:
+            vehicle_data = {**vehicle_data, 'vin': normalize_vin(vehicle_data['vin'])}
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    else:
+        # Blank VINs stay out of the unique VIN index
+        vehicle_data = {**vehicle_data, 'vin': None}
     vehicle = VehicleInfo(**vehicle_data)
-    await db.vehicles.insert_one(vehicle.dict())
+    vehicle_doc = vehicle.dict()
+    try:
+        await db.vehicles.insert_one({**vehicle_doc, **search_keys(vehicle_doc)})
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail=f"A vehicle with VIN {vehicle.vin} already exists")
+    request.app.state.vehicle_cache.invalidate()
     return vehicle
 
+@api_router.post("/vehicles/bulk")
+async def bulk_import(request: Request, format: Optional[str] = None, db=Depends(get_db)):
+    """Import NDJSON or CSV vehicle rows, upserting on VIN, with per-row errors"""
+    fmt = format or import_format(request.headers.get('content-type'))
+    if fmt not in IMPORT_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail="Send NDJSON (application/x-ndjson) or CSV (text/csv), or pass format=ndjson|csv",
+        )
+    try:
+        summary = await import_vehicles(request.stream(), fmt, db.vehicles, VehicleInfo)
+    finally:
+        request.app.state.vehicle_cache.invalidate()
+    logging.info(f"Bulk vehicle import: {summary['rows']} rows, {summary['failed']} failed, "
+                 f"{summary['rows_per_second']} rows/s")
+    return summary
+
+@api_router.get("/vehicles/{vehicle_id}/baseline")
+async def get_vehicle_baseline(request: Request, vehicle_id: str):
+    """Per-feature mean and spread of a vehicle's acoustic baseline"""
+    baseline = await request.app.state.baselines.get(vehicle_id)
+    if baseline.n == 0:
+        raise HTTPException(status_code=404, detail="No baseline recorded for this vehicle")
+    std = np.sqrt(np.diag(baseline.covariance()))
+    return {
+        'vehicle_id': vehicle_id,
+        'samples': baseline.n,
+        'features': {
+            name: {'mean': float(mean), 'std': float(spread)}
+            for name, mean, spread in zip(FEATURE_NAMES, baseline.mean, std)
+        },
+    }
+
+@api_router.get("/vehicles/{vehicle_id}/cohort")
+async def get_vehicle_cohort_deviation(request: Request, vehicle_id: str, db=Depends(get_db)):
+    """How a vehicle's baseline deviates from its make/model/year/mileage cohort"""
+    vehicle = await db.vehicles.find_one({'id': vehicle_id}, VEHICLE_PROJECTION)
+    if vehicle is None:
+        raise HTTPException(status_code=404, detail="Vehicle not found")
+    
+    cohorts = request.app.state.cohorts
+    cohort, cohort_baseline = cohorts.get(vehicle)
+    if cohort_baseline is None or cohort_baseline.n < cohorts.min_samples:
+        raise HTTPException(status_code=404, detail="Not enough clips recorded for this vehicle's cohort")
+    vehicle_baseline = await request.app.state.baselines.get(vehicle_id)
+    if vehicle_baseline.n == 0:
+        raise HTTPException(status_code=404, detail="No baseline recorded for this vehicle")
+    
+    return {
+        'vehicle_id': vehicle_id,
+        'cohort': cohort,
+        'cohort_samples': cohort_baseline.n,
+        'vehicle_samples': vehicle_baseline.n,
+        **deviation(vehicle_baseline, cohort_baseline, cohorts.min_samples),
+    }
+
 @api_router.get("/vehicles", response_model=List[VehicleInfo])
-async def get_vehicles():
-    """Get all vehicles"""
-    vehicles = await db.vehicles.find().to_list(100)
-    # Clean up MongoDB ObjectIds
-    for vehicle in vehicles:
-        if '_id' in vehicle:
-            del vehicle['_id']
-    return [VehicleInfo(**vehicle) for vehicle in vehicles]
-
-# Include the router in the main app
-app.include_router(api_router)
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=["*"],
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+async def get_vehicles(request: Request, make: Optional[str] = None, model: Optional[str] = None,
+                       prefix: bool = False, year_min: Optional[int] = None, year_max: Optional[int] = None,
+                       mileage_min: Optional[int] = None, mileage_max: Optional[int] = None,
+                       cursor: Optional[str] = None, limit: int = 100, db=Depends(get_db)):
+    """Search vehicles, newest first; the next page's cursor is in the X-Next-Cursor header"""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    cache = request.app.state.vehicle_cache
+    cache_key = cache.key(make=make, model=model, prefix=prefix, year_min=year_min, year_max=year_max,
+                          mileage_min=mileage_min, mileage_max=mileage_max, cursor=cursor, limit=limit)
+    page = cache.get(cache_key)
+    if page is None:
+        try:
+            query = build_query(make, model, prefix, year_min, year_max, mileage_min, mileage_max, cursor)
+        except InvalidCursor as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        # Stored documents were validated by VehicleInfo on the way in, so they are
+        # encoded as read instead of being validated and serialized again
+        vehicles, next_cursor = await search_page(db.vehicles, query, limit)
+        page = (dumps(vehicles), next_cursor)
+        cache.put(cache_key, page)
+    
+    body, next_cursor = page
+    return encoded_response(body, request, headers={'X-Next-Cursor': next_cursor} if next_cursor else None)
+
+def export_response(cursor, fmt, columns, name):
+    """Stream a cursor as an NDJSON or CSV attachment"""
+    timestamp = datetime.utcnow().strftime('%Y%m%dT%H%M%S')
+    return StreamingResponse(
+        stream_export(cursor, fmt, columns),
+        media_type=EXPORT_FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename="{name}-{timestamp}.{fmt}"'},
+    )
+
+def check_export_format(fmt):
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+
+@api_router.get("/export/diagnostics")
+async def export_diagnostics(format: str = 'ndjson', vehicle_id: Optional[str] = None,
+                             component: Optional[str] = None, severity: Optional[str] = None,
+                             since: Optional[datetime] = None, until: Optional[datetime] = None,
+                             include_features: bool = False, db=Depends(get_db)):
+    """Stream diagnostic results matching the filters, oldest first"""
+    check_export_format(format)
+    # Features only on request; the server-side archive path never
+    projection = {'_id': 0, 'audio_path': 0}
+    if not include_features:
+        projection['audio_features'] = 0
+    cursor = db.diagnostic_results.find(
+        diagnostics_query(vehicle_id, component, severity, since, until), projection, batch_size=EXPORT_BATCH_SIZE
+    ).sort('created_at', 1)
+    return export_response(cursor, format, DIAGNOSTIC_COLUMNS, 'diagnostics')
+
+@api_router.get("/export/vehicles")
+async def export_vehicles(format: str = 'ndjson', make: Optional[str] = None, model: Optional[str] = None,
+                          year_min: Optional[int] = None, year_max: Optional[int] = None, db=Depends(get_db)):
+    """Stream vehicle profiles matching the filters"""
+    check_export_format(format)
+    cursor = db.vehicles.find(
+        vehicles_query(make, model, year_min, year_max), VEHICLE_PROJECTION, batch_size=EXPORT_BATCH_SIZE
+    )
+    return export_response(cursor, format, VEHICLE_COLUMNS, 'vehicles')
 
 # Configure logging
 logging.basicConfig(
@@ -375,6 +686,125 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+@asynccontextmanager
+async def lifespan(app):
+    """Connect to MongoDB and start worker pools; the DSP stack itself loads lazily"""
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    app.state.mongo_client = client
+    app.state.db = client[os.environ['DB_NAME']]
+
+    # Batches diagnostic result inserts unless RESULT_WRITE_MODE is 'direct'
+    app.state.result_writer = ResultWriter(app.state.db.diagnostic_results)
+    app.state.result_writer.start()
+
+    # Rollups and alert rules updated on every stored result
+    app.state.analytics = FleetAnalytics(app.state.db)
+    app.state.alerts = AlertEngine(app.state.db)
+    # Per-vehicle acoustic baselines used to score each new clip
+    app.state.baselines = BaselineStore(app.state.db)
+    # Make/model/year/mileage cohorts, scored in memory and snapshotted periodically
+    app.state.cohorts = CohortBaselines(app.state.db)
+    app.state.cohorts.start()
+    index_task = asyncio.create_task(ensure_indexes(app))
+
+    # Recently served /api/vehicles pages, cleared on vehicle writes
+    app.state.vehicle_cache = PageCache()
+
+    # Pushes new results to dashboards over /api/events
+    app.state.events = EventBroker()
+
+    # Long-lived decoder processes for compressed uploads
+    app.state.decoder_pool = DecoderPool() if DECODER_POOL_SIZE > 0 else None
+    if app.state.decoder_pool is not None:
+        await app.state.decoder_pool.start()
+
+    # Feature extraction workers reading decoded PCM from shared memory
+    app.state.analysis_pool = AnalysisPool()
+    app.state.analysis_pool.start()
+
+    # Orders waiting analyses by priority class and estimated cost
+    app.state.scheduler = AnalysisScheduler()
+
+    # Resumable uploads on local disk; WAV segments are analysed as their bytes arrive
+    app.state.upload_sessions = UploadSessions(app.state.analysis_pool, app.state.scheduler)
+
+    # Picks the analysis profile per upload from the current load
+    app.state.fidelity = FidelityController()
+
+    # Diagnoses clips from concurrent requests in micro-batches
+    app.state.diagnosis_batcher = DiagnosisBatcher()
+    app.state.diagnosis_batcher.start()
+
+    # Warm the DSP kernels in the background: cheap reads are served meanwhile,
+    # but /api/ready only reports ready once analysis will not hit a cold path
+    app.state.ready = False
+    warm_up_task = asyncio.create_task(warm_up(app))
+
+    try:
+        yield
+    finally:
+        warm_up_task.cancel()
+        index_task.cancel()
+        app.state.events.close()
+        await app.state.diagnosis_batcher.stop()
+        # Flush buffered results and cohort statistics before the client goes away
+        await app.state.result_writer.stop()
+        try:
+            await app.state.cohorts.stop()
+        except Exception as e:
+            logger.error(f"Final cohort snapshot failed: {e}")
+        app.state.analysis_pool.stop()
+        if app.state.decoder_pool is not None:
+            await app.state.decoder_pool.stop()
+        client.close()
+
+async def ensure_indexes(app):
+    """Create the indexes the read paths rely on (idempotent, off the startup path)"""
+    try:
+        # History, overview and exports sort results by time, optionally per vehicle
+        await app.state.db.diagnostic_results.create_index([('created_at', -1)])
+        await app.state.db.diagnostic_results.create_index([('vehicle_id', 1), ('created_at', -1)])
+        # Bulk imports upsert on VIN; vehicles created without one are not indexed
+        await app.state.db.vehicles.create_index(
+            'vin', unique=True, partialFilterExpression={'vin': {'$type': 'string'}}
+        )
+        await ensure_vehicle_indexes(app.state.db.vehicles)
+        await app.state.analytics.ensure_indexes()
+        await app.state.alerts.ensure_indexes()
+        await app.state.baselines.ensure_indexes()
+        await app.state.cohorts.ensure_indexes()
+    except Exception as e:
+        logger.error(f"Index creation failed: {e}")
+
+async def warm_up(app):
+    started = time.monotonic()
+    try:
+        await app.state.analysis_pool.warm_up()
+    except Exception as e:
+        # A failed warm-up only costs latency; do not keep the worker out of rotation
+        logger.error(f"Analysis warm-up failed: {e}")
+    app.state.ready = True
+    logger.info(f"Worker ready after {time.monotonic() - started:.2f}s warm-up")
+
+def create_app():
+    """Build the API application (cheap: no database or DSP work happens here)"""
+    app = FastAPI(title="Eniguity Diagnostics API", lifespan=lifespan)
+
+    # Include the router in the main app
+    app.include_router(api_router)
+
+    app.add_middleware(UploadSizeLimitMiddleware, paths=["/api/analyze-audio", "/api/uploads"])
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_credentials=True,
+        allow_origins=["*"],
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["X-Next-Cursor"],
+    )
+    return app
+
+app = create_app()
@@ -0,0 +1,507 @@
+"""
+Resumable chunked uploads.
+
+A client on an unreliable link creates an upload session, PUTs byte ranges
+of the file (in any order, as often as it needs) and finalizes once every
+byte is in. The partial file and the session state (declared size,
+received ranges, analysis progress) are kept under UPLOAD_SESSION_DIR, so
+a dropped connection only costs the bytes that were not yet written, and
+sessions survive a server restart. Asking for a session's status lists
+the ranges still missing.
+
+Several API processes may serve the same session. Each one keeps its own
+copy of the state, so every save takes an exclusive flock on the session's
+lock file, merges in whatever the other processes saved, and only then
+writes. Every request also reloads the state under a shared lock first.
+Received ranges and analysed segments only ever grow, so merging is a union.
+
+PCM WAV uploads are analysed while they arrive. The file is preallocated
+at its declared size, so once the header is in, the position of every
+sample is known and the clip is divided into segments of about
+UPLOAD_SEGMENT_SECONDS (see analysis.extract_segment). As soon as every
+byte under a segment's frames has arrived, a worker analyses it from a
+memory map of the partial file (see wav_mmap.py) and writes its mel rows
+into a mel matrix file kept with the upload. Finalize then only analyses
+the segments still outstanding (usually the last one) and merges the
+partial sums, which gives exactly the single-pass features. Other formats
+and the quick profile are analysed in full at finalize.
+
+Configuration:
+    UPLOAD_SESSION_DIR          where partial uploads and their state are kept
+    UPLOAD_SESSION_TTL_SECONDS  sessions idle for this long are deleted
+    UPLOAD_SEGMENT_SECONDS      length of the segments analysed as a WAV upload arrives
+"""
+
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+import aiofiles
+import numpy as np
+from fastapi import HTTPException
+
+from analysis import (
+    DEFAULT_PROFILE, FIDELITY_PROFILES, N_FFT, extract_segment, mel_shape, merge_segments,
+)
+from feature_pipeline import BLOCK_FRAMES, frame_count
+from uploads import SNIFF_BYTES, check_duration, parse_header, sniff_format
+from wav_mmap import WavFile, read_layout
+
+UPLOAD_SESSION_DIR = os.environ.get('UPLOAD_SESSION_DIR', '/tmp/eniguity-uploads')
+UPLOAD_SESSION_TTL_SECONDS = float(os.environ.get('UPLOAD_SESSION_TTL_SECONDS', 24 * 3600))
+UPLOAD_SEGMENT_SECONDS = float(os.environ.get('UPLOAD_SEGMENT_SECONDS', 10))
+
+# Bytes of the received prefix read to sniff the format and parse the header
+HEADER_BYTES = 64 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+def add_range(ranges, start, end):
+    """Merge [start, end) into a sorted list of disjoint [start, end) ranges"""
+    merged = []
+    for low, high in ranges:
+        if high < start or low > end:
+            merged.append([low, high])
+        else:
+            start, end = min(low, start), max(high, end)
+    merged.append([start, end])
+    return sorted(merged)
+
+
+def missing_ranges(ranges, size):
+    """The [start, end) ranges of [0, size) not covered by `ranges`"""
+    missing = []
+    position = 0
+    for low, high in ranges:
+        if low > position:
+            missing.append([position, low])
+        position = max(position, high)
+    if position < size:
+        missing.append([position, size])
+    return missing
+
+
+def covers(ranges, start, end):
+    """Whether bytes [start, end) have all been received"""
+    return start >= end or any(low <= start and end <= high for low, high in ranges)
+
+
+def streamable(wav, profile):
+    """Whether a WAV upload can be analysed segment by segment as it arrives"""
+    spec = FIDELITY_PROFILES[profile]
+    # The quick profile resamples and truncates, and clips under 0.1 s are padded first
+    return (wav is not None and spec['max_seconds'] is None and spec['max_sample_rate'] is None
+            and wav.frames >= 0.1 * wav.sample_rate)
+
+
+def upload_segments(wav, profile, seconds=UPLOAD_SEGMENT_SECONDS):
+    """(first frame, stop frame, byte offset, byte end) per segment of a WAV upload"""
+    hop = FIDELITY_PROFILES[profile]['hop_length']
+    n_frames = frame_count(wav.frames, hop)
+    per_segment = max(round(seconds * wav.sample_rate / hop / BLOCK_FRAMES), 1) * BLOCK_FRAMES
+    segments = []
+    for first in range(0, n_frames, per_segment):
+        stop = min(first + per_segment, n_frames)
+        # The samples under frames [first, stop), without the centre padding
+        start_sample = max(first * hop - N_FFT // 2, 0)
+        stop_sample = min((stop - 1) * hop - N_FFT // 2 + N_FFT, wav.frames)
+        segments.append((first, stop, *wav.sample_bytes(start_sample, stop_sample)))
+    return segments
+
+
+def extract_upload_segment(wav, mel_path, profile, first, stop):
+    """Analyse one segment of a partial upload into its mel matrix file (runs in a worker process)"""
+    mel_frames = np.memmap(mel_path, dtype=np.float32, mode='r+', shape=mel_shape(wav.frames, profile))
+    with wav.open() as audio_data:
+        return extract_segment(audio_data, wav.sample_rate, profile, first, stop, mel_frames)
+
+
+def merge_upload_segments(wav, mel_path, profile, partials):
+    """Clip features from an upload's segment partials (runs in a worker process)"""
+    # Copy-on-write, as the dB conversion runs in place: the file stays valid if finalize is retried
+    mel_frames = np.memmap(mel_path, dtype=np.float32, mode='c', shape=mel_shape(wav.frames, profile))
+    return merge_segments(wav.frames, wav.sample_rate, profile, partials, mel_frames)
+
+
+def _partial_to_json(partial):
+    frame_values = partial['frame_values']
+    return {**partial, 'frame_values': {name: values.tolist() for name, values in frame_values.items()}
+            if frame_values is not None else None}
+
+
+def _partial_from_json(partial):
+    frame_values = partial['frame_values']
+    return {**partial, 'frame_values': {name: np.asarray(values, dtype=np.float32)
+                                        for name, values in frame_values.items()}
+            if frame_values is not None else None}
+
+
+def _read_state(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class UploadSession:
+    """One resumable upload: its declared size, received byte ranges and analysed segments"""
+
+    def __init__(self, directory, upload_id, filename, size, vehicle_id=None, profile=DEFAULT_PROFILE,
+                 priority='interactive', created_at=None, updated_at=None, received=None, format=None,
+                 streaming=None, layout=None, partials=None):
+        self.id = upload_id
+        self.filename = filename
+        self.size = size
+        self.vehicle_id = vehicle_id
+        self.profile = profile
+        self.priority = priority
+        self.created_at = created_at or time.time()
+        self.updated_at = updated_at or self.created_at
+        # Disjoint, sorted [start, end) byte ranges written so far
+        self.received = received or []
+        # Sniffed from the first bytes; None until they arrive
+        self.format = format
+        # Whether segments are analysed as they arrive; None until the header is in
+        self.streaming = streaming
+        self.layout = layout
+        # Partial sums per analysed segment, by first frame
+        self.partials = partials or {}
+        self.data_path = os.path.join(directory, f"{upload_id}.upload")
+        self.mel_path = os.path.join(directory, f"{upload_id}.mel")
+        self.state_path = os.path.join(directory, f"{upload_id}.json")
+        self.lock_path = os.path.join(directory, f"{upload_id}.lock")
+        self.segments = upload_segments(layout, profile) if layout is not None else []
+        # Segment analyses in flight, by first frame, and those holding a worker
+        self.tasks = {}
+        self.running = set()
+        self.finalizing = False
+        self.deleted = False
+
+    @property
+    def prefix(self):
+        """Length of the contiguous run of bytes received from the start of the file"""
+        if self.received and self.received[0][0] == 0:
+            return self.received[0][1]
+        return 0
+
+    @property
+    def complete(self):
+        return covers(self.received, 0, self.size)
+
+    @contextmanager
+    def locked(self, operation=fcntl.LOCK_EX):
+        """Hold the session's file lock, shared with the other API processes"""
+        with open(self.lock_path, 'a') as f:
+            # Released when the file is closed
+            fcntl.flock(f, operation)
+            yield
+
+    def _merge(self, state):
+        """Fold in state saved by another process; ranges and partials only ever grow"""
+        for start, end in state['received']:
+            self.received = add_range(self.received, start, end)
+        for partial in state['partials']:
+            if partial['first'] not in self.partials:
+                self.partials[partial['first']] = _partial_from_json(partial)
+        self.updated_at = max(self.updated_at, state['updated_at'])
+        if self.format is None:
+            self.format = state['format']
+        if self.streaming is None:
+            self.streaming = state['streaming']
+        if self.layout is None and state['layout'] is not None:
+            self.layout = WavFile(self.data_path, *state['layout'])
+            self.segments = upload_segments(self.layout, self.profile)
+
+    def refresh(self):
+        """Catch up with saves made by other processes; False once the session is gone"""
+        # Checked before locking too, so a finished session does not get its lock file back
+        if self.deleted or not os.path.exists(self.data_path):
+            self.deleted = True
+            return False
+        with self.locked(fcntl.LOCK_SH):
+            state = _read_state(self.state_path)
+        if state is None or not os.path.exists(self.data_path):
+            self.deleted = True
+            return False
+        self._merge(state)
+        return True
+
+    def save(self):
+        """Merge and write the session state next to the file (atomically, so a crash never leaves half of it)"""
+        # Completed or deleted, here or by another process
+        if self.deleted or not os.path.exists(self.data_path):
+            self.deleted = True
+            return
+        with self.locked():
+            # Completed or deleted by another process while we waited for the lock
+            if not os.path.exists(self.data_path):
+                self.deleted = True
+                return
+            state = _read_state(self.state_path)
+            if state is not None:
+                self._merge(state)
+            state = {
+                'id': self.id,
+                'filename': self.filename,
+                'size': self.size,
+                'vehicle_id': self.vehicle_id,
+                'profile': self.profile,
+                'priority': self.priority,
+                'created_at': self.created_at,
+                'updated_at': self.updated_at,
+                'received': self.received,
+                'format': self.format,
+                'streaming': self.streaming,
+                'layout': list(self.layout[1:]) if self.layout is not None else None,
+                'partials': [_partial_to_json(partial) for partial in self.partials.values()],
+            }
+            temp_path = f"{self.state_path}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump(state, f)
+            os.replace(temp_path, self.state_path)
+
+    @classmethod
+    def load(cls, directory, upload_id):
+        """Session state saved by an earlier request or process, or None"""
+        state = _read_state(os.path.join(directory, f"{upload_id}.json"))
+        if state is None:
+            return None
+        layout = state.pop('layout')
+        if layout is not None:
+            layout = WavFile(os.path.join(directory, f"{upload_id}.upload"), *layout)
+        partials = {partial['first']: _partial_from_json(partial) for partial in state.pop('partials')}
+        return cls(directory, state.pop('id'), layout=layout, partials=partials, **state)
+
+
+class UploadSessions:
+    """Resumable upload sessions on local disk, with WAV segments analysed as their bytes arrive"""
+
+    def __init__(self, analysis_pool, scheduler, directory=UPLOAD_SESSION_DIR,
+                 ttl_seconds=UPLOAD_SESSION_TTL_SECONDS):
+        self.analysis_pool = analysis_pool
+        self.scheduler = scheduler
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self._sessions = {}
+        # Metrics
+        self.created = 0
+        self.completed = 0
+        self.expired = 0
+        self.bytes_received = 0
+        self.segments_while_uploading = 0
+        self.segments_at_finalize = 0
+
+    def create(self, filename, size, vehicle_id=None, profile=DEFAULT_PROFILE, priority='interactive'):
+        """Start a session with an empty, preallocated file of `size` bytes"""
+        self.sweep()
+        os.makedirs(self.directory, exist_ok=True)
+        session = UploadSession(self.directory, str(uuid.uuid4()), filename, size, vehicle_id, profile, priority)
+        with open(session.data_path, 'wb') as f:
+            f.truncate(size)
+        session.save()
+        self._sessions[session.id] = session
+        self.created += 1
+        return session
+
+    def get(self, upload_id):
+        """A live session by id (loading it from disk after a restart), or None"""
+        session = self._sessions.get(upload_id)
+        if session is not None and not session.refresh():
+            # Completed or deleted by another process
+            self._sessions.pop(upload_id, None)
+            return None
+        if session is None:
+            # Ids name files, so accept nothing but the canonical uuid form
+            try:
+                if str(uuid.UUID(upload_id)) != upload_id:
+                    return None
+            except ValueError:
+                return None
+            session = UploadSession.load(self.directory, upload_id)
+            if session is None:
+                return None
+            self._sessions[upload_id] = session
+        if session.updated_at < time.time() - self.ttl_seconds:
+            self.delete(session)
+            self.expired += 1
+            return None
+        return session
+
+    async def write(self, session, start, end, chunks):
+        """Write bytes [start, end) of the file from an async iterator of chunks"""
+        written = 0
+        try:
+            async with aiofiles.open(session.data_path, 'r+b') as f:
+                await f.seek(start)
+                async for chunk in chunks:
+                    if written + len(chunk) > end - start:
+                        raise HTTPException(status_code=400, detail="Request body is longer than its Content-Range.")
+                    await f.write(chunk)
+                    written += len(chunk)
+        finally:
+            # Keep whatever arrived before a dropped connection, so a retry only resends the rest
+            if written:
+                session.received = add_range(session.received, start, start + written)
+                session.updated_at = time.time()
+                session.save()
+                self.bytes_received += written
+        if written < end - start:
+            raise HTTPException(status_code=400, detail=f"Request body ended after {written} of {end - start} bytes.")
+
+    def advance(self, session):
+        """
+        Check the format and duration once the first bytes are in, then start
+        analysing every segment whose bytes have all arrived. Raises
+        HTTPException for uploads /api/analyze-audio would reject.
+        """
+        prefix = session.prefix
+        if session.format is None and prefix >= min(SNIFF_BYTES, session.size):
+            with open(session.data_path, 'rb') as f:
+                head = f.read(min(prefix, HEADER_BYTES))
+            fmt = sniff_format(head)
+            if fmt is None:
+                raise HTTPException(status_code=400, detail="File content is not a supported audio format. Please upload WAV, MP3, M4A, OGG, FLAC, or WebM files.")
+            check_duration(parse_header(fmt, head))
+            session.format = fmt
+            session.streaming = None if fmt == 'wav' else False
+            session.save()
+
+        if session.streaming is None and session.format == 'wav':
+            layout = read_layout(session.data_path, available=prefix)
+            if layout is not None or prefix == session.size:
+                session.streaming = streamable(layout, session.profile)
+                if session.streaming:
+                    session.layout = layout
+                    session.segments = upload_segments(layout, session.profile)
+                    with open(session.mel_path, 'wb') as f:
+                        f.truncate(int(np.prod(mel_shape(layout.frames, session.profile))) * 4)
+                session.save()
+
+        if session.streaming and not session.finalizing:
+            for first, stop, start, end in session.segments:
+                if first not in session.partials and first not in session.tasks and covers(session.received, start, end):
+                    session.tasks[first] = asyncio.create_task(self._analyse(session, first, stop))
+
+    async def _analyse(self, session, first, stop):
+        layout = session.layout
+        samples = (stop - first) * FIDELITY_PROFILES[session.profile]['hop_length']
+        try:
+            # Scheduled like a short clip of the session's priority class
+            async with self.scheduler.slot(session.priority, samples, samples / layout.sample_rate):
+                session.running.add(first)
+                partial = await self.analysis_pool.run(
+                    extract_upload_segment, layout, session.mel_path, session.profile, first, stop
+                )
+            session.partials[first] = partial
+            session.save()
+            self.segments_while_uploading += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Analysis of frames {first}-{stop} of upload {session.id} failed, left for finalize: {e}")
+        finally:
+            session.running.discard(first)
+            session.tasks.pop(first, None)
+
+    async def settle(self, session):
+        """Before finalizing: drop segment analyses still waiting for a slot and await the running ones"""
+        session.finalizing = True
+        tasks = list(session.tasks.values())
+        for first, task in list(session.tasks.items()):
+            if first not in session.running:
+                task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def outstanding_samples(self, session):
+        """Samples still to analyse at finalize"""
+        hop = FIDELITY_PROFILES[session.profile]['hop_length']
+        return sum((stop - first) * hop for first, stop, _, _ in session.segments if first not in session.partials)
+
+    async def features(self, session):
+        """Features of a fully received streamed upload: the outstanding segments, then the merge"""
+        outstanding = [(first, stop) for first, stop, _, _ in session.segments if first not in session.partials]
+        partials = await asyncio.gather(*(
+            self.analysis_pool.run(extract_upload_segment, session.layout, session.mel_path, session.profile, first, stop)
+            for first, stop in outstanding
+        ))
+        self.segments_at_finalize += len(outstanding)
+        return await self.analysis_pool.run(
+            merge_upload_segments, session.layout, session.mel_path, session.profile,
+            [*session.partials.values(), *partials]
+        )
+
+    def describe(self, session):
+        """Public view of a session: what has arrived, what is missing and how far analysis got"""
+        missing = missing_ranges(session.received, session.size)
+        return {
+            'upload_id': session.id,
+            'filename': session.filename,
+            'size': session.size,
+            'received': session.received,
+            'missing': missing,
+            'complete': not missing,
+            'format': session.format,
+            'profile': session.profile,
+            'priority': session.priority,
+            'streaming': bool(session.streaming),
+            'segments': len(session.segments),
+            'segments_analysed': len(session.partials),
+            'expires_at': datetime.utcfromtimestamp(session.updated_at + self.ttl_seconds),
+        }
+
+    def complete(self, session):
+        self.completed += 1
+        self.delete(session)
+
+    def delete(self, session):
+        """Cancel a session's analyses and remove its files"""
+        session.deleted = True
+        for task in session.tasks.values():
+            task.cancel()
+        self._sessions.pop(session.id, None)
+        for path in (session.data_path, session.mel_path, session.state_path, session.lock_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def sweep(self):
+        """Remove sessions (and stray files) whose newest file is older than the TTL"""
+        horizon = time.time() - self.ttl_seconds
+        for session in list(self._sessions.values()):
+            if session.updated_at < horizon:
+                self.delete(session)
+                self.expired += 1
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        by_id = {}
+        for name in names:
+            by_id.setdefault(name.split('.', 1)[0], []).append(os.path.join(self.directory, name))
+        for upload_id, paths in by_id.items():
+            try:
+                if max(os.path.getmtime(path) for path in paths) >= horizon:
+                    continue
+                for path in paths:
+                    os.remove(path)
+            except OSError:
+                continue
+            self.expired += 1
+
+    def stats(self):
+        return {
+            'sessions': len(self._sessions),
+            'created': self.created,
+            'completed': self.completed,
+            'expired': self.expired,
+            'bytes_received': self.bytes_received,
+            'segments_while_uploading': self.segments_while_uploading,
+            'segments_at_finalize': self.segments_at_finalize,
+        }
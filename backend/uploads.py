@@ -0,0 +1,584 @@
+"""
+Bounded upload handling for audio files.
+
+Uploads are streamed to disk in fixed-size chunks with a byte cap, the
+container format is confirmed from the first KB of content (magic bytes),
+and the clip duration is read from the container headers before anything
+is decoded, so oversized, overlong or non-audio uploads are rejected early.
+receive_form_upload parses the multipart body as it streams in, so these
+checks run on the first KB of the file rather than once the whole request
+has been received.
+"""
+
+import logging
+import os
+import struct
+import uuid
+from typing import NamedTuple, Optional
+
+import aiofiles
+from fastapi import HTTPException
+from multipart.multipart import MultipartParser, parse_options_header
+from starlette.responses import JSONResponse
+
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', 100 * 1024 * 1024))
+MAX_AUDIO_SECONDS = float(os.environ.get('MAX_AUDIO_SECONDS', 900))
+SNIFF_BYTES = 1024
+
+# Form fields other than the file are short options (vehicle id, profile, priority)
+MAX_FORM_FIELD_BYTES = 1024
+
+# Slack for multipart boundaries and part headers around the file itself
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+# Canonical temp-file extension per sniffed container, so decoders see the
+# real format even when the client-side filename is wrong
+FORMAT_EXTENSIONS = {
+    'wav': '.wav',
+    'flac': '.flac',
+    'ogg': '.ogg',
+    'mp3': '.mp3',
+    'm4a': '.m4a',
+    'webm': '.webm',
+}
+
+# Filenames accepted for upload (the content is sniffed regardless)
+ALLOWED_EXTENSIONS = ('.wav', '.mp3', '.m4a', '.ogg', '.opus', '.flac', '.webm', '.weba')
+
+
+class AudioProbe(NamedTuple):
+    format: str
+    duration: Optional[float] = None
+    sample_rate: Optional[int] = None
+    channels: Optional[int] = None
+
+
+def check_extension(filename):
+    """Reject filenames without an audio extension"""
+    if not filename.lower().endswith(ALLOWED_EXTENSIONS):
+        raise HTTPException(status_code=400, detail="Unsupported audio format. Please upload WAV, MP3, M4A, OGG, FLAC, or WebM files.")
+
+
+def sniff_format(head):
+    """Identify the audio container from its leading bytes, or None if unrecognised"""
+    if len(head) >= 12 and head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+        return 'wav'
+    if head[:4] == b'fLaC':
+        return 'flac'
+    if head[:4] == b'OggS':
+        return 'ogg'
+    if len(head) >= 12 and head[4:8] == b'ftyp':
+        return 'm4a'
+    if head[:4] == b'\x1a\x45\xdf\xa3':
+        return 'webm'
+    if head[:3] == b'ID3' or _parse_mp3_frame_header(head, 0) is not None:
+        return 'mp3'
+    return None
+
+
+def _parse_wav_header(data, file_size=None):
+    """Read format and duration from RIFF chunks"""
+    pos = 12
+    sample_rate = channels = byte_rate = None
+    while pos + 8 <= len(data):
+        chunk_id = data[pos:pos + 4]
+        chunk_size = struct.unpack('<I', data[pos + 4:pos + 8])[0]
+        if chunk_id == b'fmt ' and pos + 24 <= len(data):
+            channels, sample_rate, byte_rate = struct.unpack('<HII', data[pos + 10:pos + 20])
+        elif chunk_id == b'data':
+            if not byte_rate:
+                break
+            if chunk_size in (0, 0xFFFFFFFF):
+                # Streaming writers leave the size unset; fall back to the file size
+                if file_size is None:
+                    break
+                chunk_size = file_size - (pos + 8)
+            return AudioProbe('wav', chunk_size / byte_rate, sample_rate, channels)
+        pos += 8 + chunk_size + (chunk_size & 1)
+    return AudioProbe('wav', None, sample_rate, channels)
+
+
+def _parse_flac_header(data):
+    """Read STREAMINFO (always the first metadata block)"""
+    if len(data) < 8 + 18 or data[4] & 0x7F != 0:
+        return AudioProbe('flac')
+    packed = int.from_bytes(data[18:26], 'big')
+    sample_rate = packed >> 44
+    channels = ((packed >> 41) & 0x7) + 1
+    total_samples = packed & 0xFFFFFFFFF
+    duration = total_samples / sample_rate if sample_rate and total_samples else None
+    return AudioProbe('flac', duration, sample_rate, channels)
+
+
+_MP3_BITRATES = {
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_MP3_SAMPLE_RATES = {1: (44100, 48000, 32000), 2: (22050, 24000, 16000), 25: (11025, 12000, 8000)}
+
+
+def _parse_mp3_frame_header(data, pos):
+    """Decode the 4-byte MPEG audio frame header at `pos`, or None if it is not one"""
+    if pos + 4 > len(data) or data[pos] != 0xFF or data[pos + 1] & 0xE0 != 0xE0:
+        return None
+    version_bits = (data[pos + 1] >> 3) & 0x3
+    layer_bits = (data[pos + 1] >> 1) & 0x3
+    bitrate_index = data[pos + 2] >> 4
+    rate_index = (data[pos + 2] >> 2) & 0x3
+    if version_bits == 1 or layer_bits == 0 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    version = {3: 1, 2: 2, 0: 25}[version_bits]
+    layer = 4 - layer_bits
+    bitrate = _MP3_BITRATES[(min(version, 2), layer)][bitrate_index] * 1000
+    sample_rate = _MP3_SAMPLE_RATES[version][rate_index]
+    channels = 1 if data[pos + 3] >> 6 == 3 else 2
+    if layer == 1:
+        samples_per_frame = 384
+    elif layer == 3 and version != 1:
+        samples_per_frame = 576
+    else:
+        samples_per_frame = 1152
+    return {
+        'version': version,
+        'bitrate': bitrate,
+        'sample_rate': sample_rate,
+        'channels': channels,
+        'samples_per_frame': samples_per_frame,
+    }
+
+
+def _find_mp3_frame(data, start=0):
+    """Offset of the first plausible MPEG frame header at or after `start`"""
+    pos = data.find(b'\xff', start)
+    while pos != -1:
+        if _parse_mp3_frame_header(data, pos) is not None:
+            return pos
+        pos = data.find(b'\xff', pos + 1)
+    return None
+
+
+def _parse_mp3_header(data, file_size):
+    """Duration from the Xing/Info frame count, or a CBR estimate from the file size"""
+    start = 0
+    if data[:3] == b'ID3' and len(data) >= 10:
+        tag_size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        start = 10 + tag_size
+    pos = _find_mp3_frame(data, start)
+    if pos is None:
+        return AudioProbe('mp3')
+    frame = _parse_mp3_frame_header(data, pos)
+
+    side_info = {(1, 1): 17, (1, 2): 32}.get((frame['version'], frame['channels']),
+                                             9 if frame['channels'] == 1 else 17)
+    xing_pos = pos + 4 + side_info
+    if data[xing_pos:xing_pos + 4] in (b'Xing', b'Info'):
+        flags = struct.unpack('>I', data[xing_pos + 4:xing_pos + 8])[0]
+        if flags & 0x1:
+            frames = struct.unpack('>I', data[xing_pos + 8:xing_pos + 12])[0]
+            duration = frames * frame['samples_per_frame'] / frame['sample_rate']
+            return AudioProbe('mp3', duration, frame['sample_rate'], frame['channels'])
+
+    duration = None
+    if file_size is not None and frame['bitrate']:
+        duration = (file_size - pos) * 8 / frame['bitrate']
+    return AudioProbe('mp3', duration, frame['sample_rate'], frame['channels'])
+
+
+def _parse_ogg_header(head, tail):
+    """Identification header from the first page, duration from the last granule position"""
+    sample_rate = channels = None
+    pre_skip = 0
+    granule_rate = None
+    if len(head) >= 27:
+        segments = head[26]
+        packet = head[27 + segments:]
+        if packet[:7] == b'\x01vorbis' and len(packet) >= 16:
+            channels = packet[11]
+            sample_rate = struct.unpack('<I', packet[12:16])[0]
+            granule_rate = sample_rate
+        elif packet[:8] == b'OpusHead' and len(packet) >= 16:
+            channels = packet[9]
+            pre_skip = struct.unpack('<H', packet[10:12])[0]
+            sample_rate = struct.unpack('<I', packet[12:16])[0] or 48000
+            granule_rate = 48000  # Opus granule positions always count 48 kHz samples
+
+    duration = None
+    last_page = tail.rfind(b'OggS')
+    if granule_rate and last_page != -1 and last_page + 14 <= len(tail):
+        granule = struct.unpack('<q', tail[last_page + 6:last_page + 14])[0]
+        if granule > 0:
+            duration = max(granule - pre_skip, 0) / granule_rate
+    return AudioProbe('ogg', duration, sample_rate, channels)
+
+
+def _iter_mp4_boxes(data, start=0, end=None):
+    """Yield (type, payload_start, payload_end) for the boxes in data[start:end]"""
+    end = len(data) if end is None else end
+    pos = start
+    while pos + 8 <= end:
+        size, box_type = struct.unpack('>I4s', data[pos:pos + 8])
+        header = 8
+        if size == 1:
+            size = struct.unpack('>Q', data[pos + 8:pos + 16])[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header:
+            return
+        yield box_type, pos + header, min(pos + size, end)
+        pos += size
+
+
+def _parse_mp4_moov(moov):
+    """Duration from mvhd and the audio sample rate from the first mdhd"""
+    duration = sample_rate = None
+    for box_type, start, end in _iter_mp4_boxes(moov):
+        if box_type == b'mvhd':
+            if moov[start] == 1:
+                timescale, length = struct.unpack('>IQ', moov[start + 20:start + 32])
+            else:
+                timescale, length = struct.unpack('>II', moov[start + 12:start + 20])
+            if timescale:
+                duration = length / timescale
+        elif box_type == b'trak' and sample_rate is None:
+            for mdia_type, mdia_start, mdia_end in _iter_mp4_boxes(moov, start, end):
+                if mdia_type != b'mdia':
+                    continue
+                for sub_type, sub_start, _ in _iter_mp4_boxes(moov, mdia_start, mdia_end):
+                    if sub_type == b'mdhd':
+                        offset = 20 if moov[sub_start] == 1 else 12
+                        sample_rate = struct.unpack('>I', moov[sub_start + offset:sub_start + offset + 4])[0]
+    return AudioProbe('m4a', duration, sample_rate)
+
+
+def _read_mp4_moov(f, file_size, max_moov_bytes=16 * 1024 * 1024):
+    """Walk the top-level boxes on disk and return the moov payload (it may sit at the end)"""
+    pos = 0
+    while pos + 8 <= file_size:
+        f.seek(pos)
+        header = f.read(16)
+        size, box_type = struct.unpack('>I4s', header[:8])
+        header_len = 8
+        if size == 1:
+            size = struct.unpack('>Q', header[8:16])[0]
+            header_len = 16
+        elif size == 0:
+            size = file_size - pos
+        if size < header_len:
+            return None
+        if box_type == b'moov':
+            if size > max_moov_bytes:
+                return None
+            f.seek(pos + header_len)
+            return f.read(size - header_len)
+        pos += size
+    return None
+
+
+# EBML element IDs needed to find the duration and audio format of a WebM file
+_EBML_SEGMENT = 0x18538067
+_EBML_INFO = 0x1549A966
+_EBML_TIMECODE_SCALE = 0x2AD7B1
+_EBML_DURATION = 0x4489
+_EBML_TRACKS = 0x1654AE6B
+_EBML_TRACK_ENTRY = 0xAE
+_EBML_AUDIO = 0xE1
+_EBML_SAMPLING_FREQUENCY = 0xB5
+_EBML_CHANNELS = 0x9F
+_EBML_CLUSTER = 0x1F43B675
+_EBML_MASTERS = {_EBML_SEGMENT, _EBML_INFO, _EBML_TRACKS, _EBML_TRACK_ENTRY, _EBML_AUDIO}
+
+
+def _read_ebml_vint(data, pos, keep_marker=False):
+    """Read an EBML variable-length integer, returning (value, length, all_ones)"""
+    if pos >= len(data):
+        raise ValueError("Truncated EBML element")
+    first = data[pos]
+    length = 1
+    while length <= 8 and not first & (0x80 >> (length - 1)):
+        length += 1
+    if length > 8 or pos + length > len(data):
+        raise ValueError("Invalid EBML variable-length integer")
+    value = first if keep_marker else first & (0xFF >> length)
+    for byte in data[pos + 1:pos + length]:
+        value = (value << 8) | byte
+    all_ones = value == (1 << (7 * length)) - 1
+    return value, length, all_ones
+
+
+def _parse_webm_header(data):
+    """Walk the EBML tree up to the first Cluster for Info duration and audio track format"""
+    timecode_scale = 1000000
+    duration_ticks = sample_rate = channels = None
+    pos = 0
+    try:
+        while pos < len(data):
+            element_id, id_len, _ = _read_ebml_vint(data, pos, keep_marker=True)
+            size, size_len, unknown_size = _read_ebml_vint(data, pos + id_len)
+            payload = pos + id_len + size_len
+            if element_id == _EBML_CLUSTER:
+                break
+            if element_id in _EBML_MASTERS:
+                # Descend into containers; live recorders leave the Segment size unknown
+                pos = payload
+                continue
+            if unknown_size or payload + size > len(data):
+                break
+            value = data[payload:payload + size]
+            if element_id == _EBML_TIMECODE_SCALE:
+                timecode_scale = int.from_bytes(value, 'big')
+            elif element_id == _EBML_DURATION:
+                duration_ticks = struct.unpack('>f' if size == 4 else '>d', value)[0]
+            elif element_id == _EBML_SAMPLING_FREQUENCY and sample_rate is None:
+                sample_rate = int(struct.unpack('>f' if size == 4 else '>d', value)[0])
+            elif element_id == _EBML_CHANNELS and channels is None:
+                channels = int.from_bytes(value, 'big')
+            pos = payload + size
+    except (ValueError, struct.error):
+        pass
+    # MediaRecorder streams are written live and usually carry no Duration
+    duration = duration_ticks * timecode_scale / 1e9 if duration_ticks else None
+    return AudioProbe('webm', duration, sample_rate, channels)
+
+
+def parse_header(fmt, head):
+    """Probe what the first bytes of an upload reveal, before the rest has arrived"""
+    if fmt == 'wav':
+        return _parse_wav_header(head)
+    if fmt == 'flac':
+        return _parse_flac_header(head)
+    if fmt == 'webm':
+        return _parse_webm_header(head)
+    return AudioProbe(fmt)
+
+
+def probe_file(path, fmt):
+    """Probe format, duration and sample rate of a file on disk without decoding it"""
+    file_size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        head = f.read(64 * 1024)
+        if fmt == 'wav':
+            return _parse_wav_header(head, file_size)
+        if fmt == 'flac':
+            return _parse_flac_header(head)
+        if fmt == 'mp3':
+            return _parse_mp3_header(head, file_size)
+        if fmt == 'ogg':
+            f.seek(max(file_size - 64 * 1024, 0))
+            return _parse_ogg_header(head, f.read())
+        if fmt == 'm4a':
+            moov = _read_mp4_moov(f, file_size)
+            return _parse_mp4_moov(moov) if moov else AudioProbe('m4a')
+        if fmt == 'webm':
+            return _parse_webm_header(head)
+    return AudioProbe(fmt)
+
+
+def check_duration(probe):
+    """Reject clips whose container reports a duration over MAX_AUDIO_SECONDS"""
+    if probe.duration is not None and probe.duration > MAX_AUDIO_SECONDS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Audio is too long ({probe.duration:.0f}s). Maximum duration is {MAX_AUDIO_SECONDS:.0f} seconds."
+        )
+
+
+class _AudioPart:
+    """Temp file for an uploaded audio file, checked as its bytes arrive"""
+
+    def __init__(self):
+        self.head = bytearray()
+        self.received = 0
+        self.fmt = None
+        self.temp_path = None
+        self._file = None
+
+    async def write(self, data):
+        self.received += len(data)
+        if self.received > MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail=f"File too large. Maximum upload size is {MAX_UPLOAD_BYTES // (1024 * 1024)} MB.")
+        if self._file is None:
+            self.head += data
+            if len(self.head) >= SNIFF_BYTES:
+                await self._open()
+            return
+        await self._file.write(data)
+
+    async def _open(self):
+        """Sniff the format and check the header duration from the first bytes, then start the temp file"""
+        head = bytes(self.head)
+        if not head:
+            raise HTTPException(status_code=400, detail="Uploaded file is empty.")
+        fmt = sniff_format(head)
+        if fmt is None:
+            raise HTTPException(status_code=400, detail="File content is not a supported audio format. Please upload WAV, MP3, M4A, OGG, FLAC, or WebM files.")
+        check_duration(parse_header(fmt, head))
+        self.fmt = fmt
+        self.temp_path = f"/tmp/{uuid.uuid4()}{FORMAT_EXTENSIONS[fmt]}"
+        self._file = await aiofiles.open(self.temp_path, 'wb')
+        await self._file.write(head)
+        self.head = None
+
+    async def finish(self):
+        """Close the temp file and probe the whole of it"""
+        if self._file is None:
+            await self._open()
+        await self._file.close()
+        probe = probe_file(self.temp_path, self.fmt)
+        check_duration(probe)
+        return probe
+
+    async def discard(self):
+        if self._file is not None:
+            await self._file.close()
+        if self.temp_path is not None and os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+
+def _form_part(headers):
+    """(field name, filename or None) from a part's Content-Disposition"""
+    _, options = parse_options_header(headers.get(b'content-disposition', b''))
+    name = options.get(b'name', b'').decode('utf-8', 'replace')
+    filename = options.get(b'filename')
+    return name, filename.decode('utf-8', 'replace') if filename is not None else None
+
+
+async def receive_form_upload(request, on_file=None, file_field='file'):
+    """
+    Parse a multipart/form-data request while it streams in. The audio part
+    goes to a temp file; the format sniff and header duration check run on
+    its first SNIFF_BYTES and the byte cap as it arrives, so a mislabelled,
+    overlong or oversized file is rejected without reading the rest of the
+    body. Returns (temp_path, probe, filename, fields) with the other form
+    values in `fields`; the caller owns the file.
+
+    The filename extension is checked as soon as the file part's headers are
+    in, and `on_file(filename, fields)` is then awaited with the fields sent
+    ahead of the file, so the caller can refuse the upload before any of its
+    bytes are read.
+    """
+    content_type, options = parse_options_header(request.headers.get('content-type', ''))
+    if content_type != b'multipart/form-data' or b'boundary' not in options:
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload.")
+
+    # The parser's callbacks are synchronous: they queue events that are handled after each chunk
+    events = []
+    header = [b'', b'']
+    headers = {}
+
+    def on_header_field(data, start, end):
+        header[0] += data[start:end]
+
+    def on_header_value(data, start, end):
+        header[1] += data[start:end]
+
+    def on_header_end():
+        headers[header[0].lower()] = header[1]
+        header[0] = header[1] = b''
+
+    def on_headers_finished():
+        events.append(('part', _form_part(headers)))
+        headers.clear()
+
+    def on_part_data(data, start, end):
+        events.append(('data', bytes(data[start:end])))
+
+    def on_part_end():
+        events.append(('end', None))
+
+    parser = MultipartParser(options[b'boundary'], {
+        'on_header_field': on_header_field,
+        'on_header_value': on_header_value,
+        'on_header_end': on_header_end,
+        'on_headers_finished': on_headers_finished,
+        'on_part_data': on_part_data,
+        'on_part_end': on_part_end,
+    })
+
+    audio = None
+    filename = None
+    fields = {}
+    name = value = None
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            for event, data in events:
+                if event == 'part':
+                    name, part_filename = data
+                    if name == file_field and audio is None:
+                        check_extension(part_filename or '')
+                        if on_file is not None:
+                            await on_file(part_filename, dict(fields))
+                        audio, filename = _AudioPart(), part_filename
+                        value = None
+                    else:
+                        value = bytearray()
+                elif event == 'data':
+                    if value is None:
+                        await audio.write(data)
+                    else:
+                        value += data
+                        if len(value) > MAX_FORM_FIELD_BYTES:
+                            raise HTTPException(status_code=400, detail=f"Form field {name!r} is too long.")
+                elif value is not None:
+                    fields[name] = value.decode('utf-8', 'replace')
+                    value = bytearray()
+            events.clear()
+        parser.finalize()
+
+        if audio is None:
+            raise HTTPException(status_code=400, detail=f"No {file_field!r} file in the upload.")
+        probe = await audio.finish()
+        return audio.temp_path, probe, filename, fields
+    except BaseException:
+        if audio is not None:
+            await audio.discard()
+        raise
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Reject oversized request bodies on upload routes before they are parsed.
+
+    Requests declaring a Content-Length over the cap get a 413 without the body
+    being read; chunked requests are cut off as soon as the running total
+    passes it.
+    """
+
+    def __init__(self, app, paths, max_body_bytes=None):
+        self.app = app
+        self.paths = tuple(paths)
+        self.max_body_bytes = max_body_bytes or MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not scope['path'].startswith(self.paths):
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get('headers') or [])
+        content_length = headers.get(b'content-length')
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_body_bytes:
+            logging.warning(f"Rejected upload to {scope['path']}: Content-Length {int(content_length)} exceeds limit")
+            response = JSONResponse(
+                status_code=413,
+                content={'detail': f"File too large. Maximum upload size is {MAX_UPLOAD_BYTES // (1024 * 1024)} MB."}
+            )
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+                if received > self.max_body_bytes:
+                    raise HTTPException(status_code=413, detail=f"File too large. Maximum upload size is {MAX_UPLOAD_BYTES // (1024 * 1024)} MB.")
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,188 @@
+"""
+Indexed vehicle search with keyset pagination.
+
+Vehicles are listed newest first, ordered by (created_at, id). A page ends
+with an opaque cursor holding the last (created_at, id) seen, and the next
+page resumes strictly after it. Every page is therefore one bounded index
+scan, whatever its position in a fleet of millions, unlike skip/limit.
+
+make and model filters (exact or prefix) are case-insensitive. They match
+lower-cased copies stored on each vehicle (make_key, model_key), which
+anchored prefix regexes can walk in the index.
+
+The hot-list cache keeps recently served pages as encoded JSON for
+VEHICLE_CACHE_TTL seconds, and any vehicle write in this process clears it.
+Writes handled by other workers show up once the TTL expires.
+
+Configuration:
+    VEHICLE_CACHE_SIZE   pages kept in the hot-list cache (0 disables it)
+    VEHICLE_CACHE_TTL    seconds a cached page may be served
+"""
+
+import base64
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+VEHICLE_CACHE_SIZE = int(os.environ.get('VEHICLE_CACHE_SIZE', 256))
+VEHICLE_CACHE_TTL = float(os.environ.get('VEHICLE_CACHE_TTL', 30))
+
+# Stored search keys are internal; responses and exports leave them out
+VEHICLE_PROJECTION = {'_id': 0, 'make_key': 0, 'model_key': 0}
+
+SORT = [('created_at', -1), ('id', -1)]
+
+# Equality fields first, then the keyset sort, then range fields, so that a
+# filtered page is still read in sort order and stops after `limit` entries.
+# Year and mileage ranges are checked against index keys without fetching.
+# Not index-backed: make/model prefix matches are ranges on make_key/model_key,
+# so those pages either sort the prefix range in memory (bounded by limit) or
+# walk the sort order filtering fetched documents; year ranges wider than a
+# single year are likewise filtered rather than seeked.
+VEHICLE_INDEXES = [
+    # Unfiltered listing, and year/mileage ranges on their own
+    [('created_at', -1), ('id', -1), ('year', 1), ('mileage', 1)],
+    # Exact make, make+model or model, each optionally with ranges
+    [('make_key', 1), ('created_at', -1), ('id', -1), ('year', 1), ('mileage', 1)],
+    [('make_key', 1), ('model_key', 1), ('created_at', -1), ('id', -1), ('year', 1), ('mileage', 1)],
+    [('model_key', 1), ('created_at', -1), ('id', -1), ('year', 1), ('mileage', 1)],
+    # A single model year
+    [('year', 1), ('created_at', -1), ('id', -1), ('mileage', 1)],
+]
+
+
+class InvalidCursor(ValueError):
+    """A pagination cursor that was not issued by this API"""
+
+
+def search_keys(vehicle):
+    """Lower-cased make/model stored alongside a vehicle for case-insensitive search"""
+    return {'make_key': str(vehicle.get('make', '')).lower(), 'model_key': str(vehicle.get('model', '')).lower()}
+
+
+def encode_cursor(vehicle):
+    raw = json.dumps([vehicle['created_at'].isoformat(), vehicle['id']]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, vehicle_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), str(vehicle_id)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {e}") from e
+
+
+def _range(low, high):
+    condition = {}
+    if low is not None:
+        condition['$gte'] = low
+    if high is not None:
+        condition['$lte'] = high
+    return condition
+
+
+def _text_match(value, prefix):
+    value = value.lower()
+    return {'$regex': f"^{re.escape(value)}"} if prefix else value
+
+
+def build_query(make=None, model=None, prefix=False, year_min=None, year_max=None,
+                mileage_min=None, mileage_max=None, cursor=None):
+    """Mongo filter for a search page; `prefix` makes make/model prefix matches"""
+    query = {}
+    if make:
+        query['make_key'] = _text_match(make, prefix)
+    if model:
+        query['model_key'] = _text_match(model, prefix)
+    for field, low, high in (('year', year_min, year_max), ('mileage', mileage_min, mileage_max)):
+        if low is not None and low == high:
+            # An equality can lead an index ahead of the sort; a range cannot
+            query[field] = low
+            continue
+        condition = _range(low, high)
+        if condition:
+            query[field] = condition
+    if cursor:
+        created_at, vehicle_id = decode_cursor(cursor)
+        query['$or'] = [
+            {'created_at': {'$lt': created_at}},
+            {'created_at': created_at, 'id': {'$lt': vehicle_id}},
+        ]
+    return query
+
+
+async def search_page(collection, query, limit):
+    """(vehicles, next cursor or None) for one page"""
+    # One extra document tells whether another page exists
+    vehicles = await collection.find(query, VEHICLE_PROJECTION).sort(SORT).limit(limit + 1).to_list(limit + 1)
+    if len(vehicles) <= limit:
+        return vehicles, None
+    vehicles = vehicles[:limit]
+    return vehicles, encode_cursor(vehicles[-1])
+
+
+async def ensure_vehicle_indexes(collection):
+    """Create search indexes and fill in search keys for vehicles stored before them"""
+    await collection.update_many(
+        {'make_key': {'$exists': False}},
+        [{'$set': {'make_key': {'$toLower': '$make'}, 'model_key': {'$toLower': '$model'}}}],
+    )
+    for keys in VEHICLE_INDEXES:
+        await collection.create_index(keys)
+
+
+class PageCache:
+    """Small TTL + LRU cache of encoded vehicle pages, cleared on every write"""
+
+    def __init__(self, max_entries=VEHICLE_CACHE_SIZE, ttl=VEHICLE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key(**params):
+        return tuple(sorted((name, value) for name, value in params.items() if value is not None))
+
+    def get(self, key):
+        if not self.max_entries:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        if not self.max_entries:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+        }
@@ -0,0 +1,184 @@
+"""
+Memory-mapped reading of uncompressed WAV files.
+
+Decoding a WAV file converts every sample to float32 up front, and the
+result is then copied into shared memory for the analysis workers: for an
+hour of 48 kHz stereo that is more than a gigabyte resident before
+analysis starts. Large PCM and IEEE-float WAV files skip both. The RIFF
+chunks are parsed to find the data chunk, which is mapped read-only with
+np.memmap, and samples are converted to mono float32 only for the span
+being read. FeatureAccumulator reads one block of frames at a time, so
+resident memory stays at one block plus the clip's mel matrix (512 bytes
+per frame). Parallel segment workers map the same file and each touches
+only its own region, with nothing copied between processes.
+
+Supported: PCM 8/16/24/32-bit and IEEE float 32/64-bit, including
+WAVE_FORMAT_EXTENSIBLE. Anything else (ADPCM, mu-law, ...) and small files
+go through the regular decoders.
+
+Configuration:
+    WAV_MMAP_MIN_BYTES   files at least this large are memory-mapped (0 disables)
+"""
+
+import os
+import struct
+from typing import NamedTuple
+
+import numpy as np
+
+WAV_MMAP_MIN_BYTES = int(os.environ.get('WAV_MMAP_MIN_BYTES', 32 * 1024 * 1024))
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# (format, bits per sample) -> stored sample type; 24-bit samples are unpacked from bytes
+SAMPLE_TYPES = {
+    (WAVE_FORMAT_PCM, 8): 'u1',
+    (WAVE_FORMAT_PCM, 16): '<i2',
+    (WAVE_FORMAT_PCM, 24): 'i24',
+    (WAVE_FORMAT_PCM, 32): '<i4',
+    (WAVE_FORMAT_IEEE_FLOAT, 32): '<f4',
+    (WAVE_FORMAT_IEEE_FLOAT, 64): '<f8',
+}
+
+
+class WavFile(NamedTuple):
+    """Where the samples of a WAV file are and how they are stored (picklable, for workers)"""
+    path: str
+    data_offset: int
+    frames: int
+    channels: int
+    sample_rate: int
+    sample_type: str
+
+    def open(self):
+        return WavReader(self)
+
+    def sample_bytes(self, start, stop):
+        """Byte range [offset, end) of the file holding sample frames [start, stop)"""
+        frame_bytes = self.channels * (3 if self.sample_type == 'i24' else np.dtype(self.sample_type).itemsize)
+        return self.data_offset + start * frame_bytes, self.data_offset + stop * frame_bytes
+
+
+def read_layout(path, available=None):
+    """
+    WavFile for a PCM/float WAV file, or None if it is not one this module can map.
+    `available`: only the first that many bytes have been written (a partial
+    upload); None is also returned while the headers extend past them.
+    """
+    with open(path, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        limit = file_size if available is None else min(available, file_size)
+        riff = f.read(12)
+        if len(riff) < 12 or riff[:4] != b'RIFF' or riff[8:12] != b'WAVE':
+            return None
+        fmt = None
+        while True:
+            if f.tell() + 8 > limit:
+                return None
+            header = f.read(8)
+            chunk_id, chunk_size = header[:4], struct.unpack('<I', header[4:])[0]
+            if chunk_id == b'fmt ':
+                if f.tell() + chunk_size > limit:
+                    return None
+                fmt = _parse_fmt(f.read(chunk_size))
+                f.seek(chunk_size & 1, os.SEEK_CUR)
+            elif chunk_id == b'data':
+                data_offset = f.tell()
+                # Streaming writers leave the size unset; truncated files stop at EOF
+                if chunk_size in (0, 0xFFFFFFFF) or data_offset + chunk_size > file_size:
+                    chunk_size = file_size - data_offset
+                break
+            else:
+                f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+    if fmt is None:
+        return None
+    channels, sample_rate, block_align, sample_type = fmt
+    frames = chunk_size // block_align
+    if frames == 0:
+        return None
+    return WavFile(str(path), data_offset, frames, channels, sample_rate, sample_type)
+
+
+def _parse_fmt(body):
+    """(channels, sample rate, block align, sample type) from a fmt chunk, or None if unsupported"""
+    if len(body) < 16:
+        return None
+    format_tag, channels, sample_rate, _, block_align, bits = struct.unpack('<HHIIHH', body[:16])
+    if format_tag == WAVE_FORMAT_EXTENSIBLE and len(body) >= 26:
+        # The first two bytes of the sub-format GUID are the actual format tag
+        format_tag = struct.unpack('<H', body[24:26])[0]
+    if not channels or not sample_rate or not block_align:
+        return None
+    # Samples are stored in containers of block_align / channels bytes
+    container_bits = block_align // channels * 8
+    if container_bits != bits and not (format_tag == WAVE_FORMAT_PCM and bits < container_bits):
+        return None
+    sample_type = SAMPLE_TYPES.get((format_tag, container_bits))
+    if sample_type is None:
+        return None
+    return channels, sample_rate, block_align, sample_type
+
+
+def wav_file(path, min_bytes=WAV_MMAP_MIN_BYTES):
+    """WavFile when `path` is large enough to be worth mapping and in a supported format"""
+    if not min_bytes or os.path.getsize(path) < min_bytes:
+        return None
+    return read_layout(path)
+
+
+class WavReader:
+    """
+    Mono float32 samples of a WavFile, converted on access:
+    `reader[start:stop]` maps only that span of the file.
+    """
+
+    def __init__(self, wav):
+        self.wav = wav
+        if wav.sample_type == 'i24':
+            dtype, shape = np.uint8, (wav.frames, wav.channels, 3)
+        else:
+            dtype, shape = np.dtype(wav.sample_type), (wav.frames, wav.channels)
+        self._data = np.memmap(wav.path, dtype=dtype, mode='r', offset=wav.data_offset, shape=shape)
+
+    def __len__(self):
+        return self.wav.frames
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            raise TypeError("WavReader only supports slicing")
+        start, stop, step = key.indices(self.wav.frames)
+        if step != 1:
+            raise ValueError("WavReader slices must be contiguous")
+        return self._to_float(self._data[start:max(stop, start)])
+
+    def __array__(self, dtype=None):
+        samples = self[:]
+        return samples if dtype is None else samples.astype(dtype, copy=False)
+
+    def _to_float(self, raw):
+        """Scale like libsndfile and average the channels like decoders._to_mono"""
+        sample_type = self.wav.sample_type
+        if sample_type == 'i24':
+            samples = (raw[..., 0].astype(np.int32) << 8 | raw[..., 1].astype(np.int32) << 16
+                       | raw[..., 2].astype(np.int32) << 24) >> 8
+            samples = samples.astype(np.float32) * np.float32(1 / (1 << 23))
+        elif sample_type == 'u1':
+            samples = (raw.astype(np.float32) - 128) * np.float32(1 / 128)
+        elif sample_type[1] == 'i':
+            samples = raw.astype(np.float32) * np.float32(1 / (1 << (raw.dtype.itemsize * 8 - 1)))
+        else:
+            samples = raw.astype(np.float32, copy=False)
+        if self.wav.channels == 1:
+            return np.ascontiguousarray(samples[:, 0])
+        return samples.mean(axis=1, dtype=np.float32)
+
+    def close(self):
+        self._data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Decode throughput per audio format.
+
+Encodes the same synthetic engine clip into every supported container and
+times the in-process decoders (decoders.decode_audio) against the generic
+librosa.load path, reporting clips/sec and x-realtime for each format.
+
+Usage:
+    python benchmarks/decode_benchmark.py [--seconds 5] [--repeat 20]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+from decoders import decode_audio, decode_librosa, load_av  # noqa: E402
+
+av = load_av()
+
+
+def synth_engine_clip(seconds, sample_rate):
+    """Idle-engine style harmonics plus noise"""
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    audio = (
+        np.sin(2 * np.pi * 80 * t) * 0.5 +
+        np.sin(2 * np.pi * 160 * t) * 0.25 +
+        np.random.normal(0, 0.05, t.shape)
+    )
+    return (audio * 0.8).astype(np.float32)
+
+
+def encode_pyav(path, audio, sample_rate, codec):
+    container = av.open(path, 'w')
+    stream = container.add_stream(codec, rate=sample_rate)
+    stream.layout = 'mono'
+    frame = av.AudioFrame.from_ndarray(audio.reshape(1, -1), format='flt', layout='mono')
+    frame.sample_rate = sample_rate
+    for packet in stream.encode(frame):
+        container.mux(packet)
+    for packet in stream.encode(None):
+        container.mux(packet)
+    container.close()
+
+
+def build_fixtures(directory, seconds):
+    """Write one clip per format; returns {label: (path, fmt)}"""
+    import soundfile as sf
+    fixtures = {}
+    audio = synth_engine_clip(seconds, 44100)
+    opus_audio = synth_engine_clip(seconds, 48000)
+
+    for label, fmt, kwargs in [
+        ('wav', 'wav', {}),
+        ('flac', 'flac', {}),
+        ('ogg-vorbis', 'ogg', {'format': 'OGG', 'subtype': 'VORBIS'}),
+        ('mp3', 'mp3', {'format': 'MP3'}),
+    ]:
+        path = os.path.join(directory, f"clip-{label}.{fmt}")
+        try:
+            sf.write(path, audio, 44100, **kwargs)
+            fixtures[label] = (path, fmt)
+        except Exception as e:
+            print(f"skipping {label}: {e}")
+
+    path = os.path.join(directory, "clip-ogg-opus.ogg")
+    try:
+        sf.write(path, opus_audio, 48000, format='OGG', subtype='OPUS')
+        fixtures['ogg-opus'] = (path, 'ogg')
+    except Exception as e:
+        print(f"skipping ogg-opus: {e}")
+
+    if av is not None:
+        for label, fmt, codec, rate, clip in [
+            ('webm-opus', 'webm', 'libopus', 48000, opus_audio),
+            ('m4a-aac', 'm4a', 'aac', 44100, audio),
+        ]:
+            path = os.path.join(directory, f"clip-{label}.{fmt}")
+            try:
+                encode_pyav(path, clip, rate, codec)
+                fixtures[label] = (path, fmt)
+            except Exception as e:
+                print(f"skipping {label}: {e}")
+    else:
+        print("PyAV not installed: skipping webm-opus and m4a-aac")
+    return fixtures
+
+
+def time_decoder(decode, repeat):
+    decode()  # warm-up (codec init, page cache)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        decode()
+    return (time.perf_counter() - started) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--seconds', type=float, default=5.0, help="Clip length")
+    parser.add_argument('--repeat', type=int, default=20, help="Decodes per format and path")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        fixtures = build_fixtures(directory, args.seconds)
+        print(f"\n{'format':<12} {'path':<10} {'ms/clip':>9} {'clips/s':>9} {'x-realtime':>11}")
+        for label, (path, fmt) in fixtures.items():
+            for name, decode in [
+                ('in-process', lambda: decode_audio(path, fmt)),
+                ('librosa', lambda: decode_librosa(path)),
+            ]:
+                try:
+                    seconds_per_clip = time_decoder(decode, args.repeat)
+                except Exception as e:
+                    print(f"{label:<12} {name:<10} failed: {e}")
+                    continue
+                print(
+                    f"{label:<12} {name:<10} {seconds_per_clip * 1000:>9.2f} "
+                    f"{1 / seconds_per_clip:>9.1f} {args.seconds / seconds_per_clip:>11.1f}"
+                )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Import-time budget check for the API module.
+
+Runs `python -X importtime -c "import server"` in a clean interpreter (with
+no MONGO_URL set), takes the best of several runs and fails if importing
+the app exceeds the budget or drags in the DSP stack, which must stay
+lazily imported so new workers can serve cheap reads straight away.
+
+Usage:
+    python benchmarks/import_time_benchmark.py [--budget-ms 1200] [--runs 5]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / 'backend'
+
+# Heavy modules that must only load on the first analysis (or in warm-up)
+DEFERRED_MODULES = ('librosa', 'numba', 'scipy', 'sklearn', 'av', 'soundfile', 'motor')
+
+
+def import_profile(module):
+    """Return ({package: cumulative_us}, wall_ms) for one cold import of `module`"""
+    env = {key: value for key, value in os.environ.items() if key not in ('MONGO_URL', 'DB_NAME')}
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    cumulative = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative_us, package = line[len('import time:'):].split('|')
+        if cumulative_us.strip().isdigit():
+            cumulative[package.strip()] = int(cumulative_us)
+    return cumulative
+
+
+def best_of(module, runs):
+    profiles = [import_profile(module) for _ in range(runs)]
+    return min(profiles, key=lambda profile: profile.get(module, float('inf')))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--budget-ms', type=float, default=float(os.environ.get('IMPORT_BUDGET_MS', 1200)))
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    profile = best_of('server', args.runs)
+    server_ms = profile['server'] / 1000
+    heaviest = sorted(
+        ((package, us) for package, us in profile.items() if '.' not in package and package != 'server'),
+        key=lambda item: item[1], reverse=True
+    )[:8]
+
+    print(f"import server: {server_ms:.1f} ms (budget {args.budget_ms:.0f} ms)")
+    for package, us in heaviest:
+        print(f"  {package:<24} {us / 1000:>8.1f} ms")
+
+    # librosa lazy-loads its submodules; the spectral features are what analysis pulls in
+    deferred = best_of('librosa.feature.spectral', 1).get('librosa.feature.spectral', 0) / 1000
+    print(f"deferred until first analysis: librosa.feature.spectral {deferred:.1f} ms")
+
+    failures = []
+    if server_ms > args.budget_ms:
+        failures.append(f"import time {server_ms:.1f} ms exceeds budget of {args.budget_ms:.0f} ms")
+    leaked = [module for module in DEFERRED_MODULES if module in profile]
+    if leaked:
+        failures.append(f"heavy modules imported eagerly: {', '.join(leaked)}")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if not failures:
+        print("PASS")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Per-request CPU cost of serializing read-endpoint pages.
+
+For 100, 1,000 and 10,000 rows of vehicles and diagnostic results, compares
+the previous path (delete `_id` in Python, validate into pydantic models,
+jsonable_encoder + json.dumps as FastAPI's default response does) with the
+projection + orjson path in serialization.py, and the cost and size of
+gzip/brotli compression on top.
+
+Usage:
+    python benchmarks/serialization_benchmark.py [--repeat 20]
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+
+import serialization  # noqa: E402
+from server import VehicleInfo  # noqa: E402
+
+PAGE_SIZES = (100, 1000, 10000)
+
+
+def make_vehicle(i):
+    return {
+        '_id': uuid.uuid4().hex[:24],
+        'id': str(uuid.uuid4()),
+        'make': random.choice(['Toyota', 'Ford', 'Honda', 'BMW']),
+        'model': f"Model {i % 40}",
+        'year': 2000 + i % 24,
+        'mileage': random.randint(0, 250000),
+        'created_at': datetime(2024, 1, 1) + timedelta(minutes=i),
+    }
+
+
+def make_diagnostic(i):
+    return {
+        '_id': uuid.uuid4().hex[:24],
+        'id': str(uuid.uuid4()),
+        'vehicle_id': str(uuid.uuid4()),
+        'audio_filename': f"clip-{i}.webm",
+        'component': random.choice(['Engine', 'Brakes', 'Exhaust']),
+        'diagnosis': 'Brake Pad Wear - Front Axle',
+        'confidence_score': random.random(),
+        'severity': random.choice(['low', 'medium', 'high', 'critical']),
+        'recommendations': ['Replace brake pads within 1 month', 'Inspect brake rotors for scoring'],
+        'estimated_cost': random.uniform(100, 900),
+        'urgency_level': 'month',
+        'created_at': datetime(2024, 1, 1) + timedelta(minutes=i),
+        'audio_features': {'mfcc_features': [random.random() for _ in range(13)], 'spectral_centroid': 1500.0},
+        'analysis_version': 1,
+    }
+
+
+def previous_vehicles(docs):
+    docs = [dict(doc) for doc in docs]  # to_list hands out fresh dicts
+    for doc in docs:
+        del doc['_id']
+    models = [VehicleInfo(**doc) for doc in docs]
+    # response_model validates and serializes the returned models again
+    validated = [VehicleInfo.model_validate(model.model_dump()) for model in models]
+    return json.dumps(jsonable_encoder(validated)).encode()
+
+
+def previous_diagnostics(docs):
+    docs = [dict(doc) for doc in docs]
+    for doc in docs:
+        del doc['_id']
+    return json.dumps(jsonable_encoder(docs)).encode()
+
+
+def projected(docs):
+    # Mongo applies the projection server-side; dropping the key stands in for it
+    return [{key: value for key, value in doc.items() if key != '_id'} for doc in docs]
+
+
+def cpu_ms(fn, arg, repeat):
+    fn(arg)
+    started = time.process_time()
+    for _ in range(repeat):
+        result = fn(arg)
+    return (time.process_time() - started) / repeat * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"orjson: {'yes' if serialization.orjson else 'no'}, brotli: {'yes' if serialization.brotli else 'no'}\n")
+    print(f"{'endpoint':<12} {'rows':>6} {'previous ms':>12} {'orjson ms':>10} {'speedup':>8} "
+          f"{'KB':>8} {'gzip ms':>8} {'gzip KB':>8} {'br ms':>7} {'br KB':>7}")
+    for name, make, previous in [('vehicles', make_vehicle, previous_vehicles),
+                                 ('history', make_diagnostic, previous_diagnostics)]:
+        for rows in PAGE_SIZES:
+            docs = [make(i) for i in range(rows)]
+            before_ms, _ = cpu_ms(previous, docs, args.repeat)
+            rows_out = projected(docs)
+            after_ms, body = cpu_ms(serialization.dumps, rows_out, args.repeat)
+            gzip_ms, gzipped = cpu_ms(lambda b: serialization.compress(b, {'gzip'})[0], body, args.repeat)
+            if serialization.brotli is not None:
+                br_ms, brotlied = cpu_ms(lambda b: serialization.compress(b, {'br'})[0], body, args.repeat)
+                br = f"{br_ms:>7.2f} {len(brotlied) / 1024:>7.1f}"
+            else:
+                br = f"{'-':>7} {'-':>7}"
+            print(f"{name:<12} {rows:>6} {before_ms:>12.2f} {after_ms:>10.2f} {before_ms / after_ms:>7.1f}x "
+                  f"{len(body) / 1024:>8.1f} {gzip_ms:>8.2f} {len(gzipped) / 1024:>8.1f} {br}")
+
+
+if __name__ == '__main__':
+    main()
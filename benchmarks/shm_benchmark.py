@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Shared-memory vs pickle hand-off of decoded PCM to a worker process.
+
+For clip lengths from 1 to 60 seconds, times sending a float32 clip to a
+process-pool worker that reads every sample, once by pickling the array
+and once by passing a PCMDescriptor for a shared-memory segment.
+
+Usage:
+    python benchmarks/shm_benchmark.py [--sample-rate 48000] [--repeat 30]
+"""
+
+import argparse
+import multiprocessing
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+from pcm_shm import PCMSegment, attach  # noqa: E402
+
+CLIP_SECONDS = (1, 5, 15, 30, 60)
+
+
+def touch_pickled(audio_data):
+    return float(audio_data.sum())
+
+
+def touch_shared(descriptor):
+    with attach(descriptor) as audio_data:
+        return float(audio_data.sum())
+
+
+def time_round_trips(pool, fn, arg, repeat):
+    pool.submit(fn, arg).result()  # warm-up
+    started = time.perf_counter()
+    for _ in range(repeat):
+        pool.submit(fn, arg).result()
+    return (time.perf_counter() - started) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sample-rate', type=int, default=48000)
+    parser.add_argument('--repeat', type=int, default=30)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        # Baseline: the same call with no payload, to separate IPC overhead
+        empty = time_round_trips(pool, touch_pickled, np.zeros(1, dtype=np.float32), args.repeat)
+        print(f"empty round trip: {empty * 1000:.3f} ms\n")
+        print(f"{'clip':>6} {'MB':>7} {'pickle ms':>10} {'shm ms':>8} {'speedup':>8}")
+        for seconds in CLIP_SECONDS:
+            audio_data = np.random.uniform(-1, 1, seconds * args.sample_rate).astype(np.float32)
+            pickled = time_round_trips(pool, touch_pickled, audio_data, args.repeat)
+            with PCMSegment.from_array(audio_data) as segment:
+                shared = time_round_trips(pool, touch_shared, segment.descriptor, args.repeat)
+            print(
+                f"{seconds:>5}s {audio_data.nbytes / 1e6:>7.2f} {pickled * 1000:>10.3f} "
+                f"{shared * 1000:>8.3f} {pickled / shared:>7.1f}x"
+            )
+
+
+if __name__ == '__main__':
+    main()
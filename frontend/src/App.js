@@ -30,7 +30,13 @@ const AudioRecorder = ({ onAudioRecorded }) => {
       source.connect(analyser.current);
       analyser.current.fftSize = 256;
       
-      mediaRecorder.current = new MediaRecorder(stream);
+      // Prefer WebM/Opus, which the backend decodes in-process; fall back to
+      // whatever container the browser records natively (e.g. MP4 on Safari)
+      const preferredType = ['audio/webm;codecs=opus', 'audio/ogg;codecs=opus', 'audio/mp4']
+        .find((type) => window.MediaRecorder.isTypeSupported && MediaRecorder.isTypeSupported(type));
+      mediaRecorder.current = preferredType
+        ? new MediaRecorder(stream, { mimeType: preferredType })
+        : new MediaRecorder(stream);
       audioChunks.current = [];
 
       mediaRecorder.current.ondataavailable = (event) => {  
@@ -38,10 +44,12 @@ const AudioRecorder = ({ onAudioRecorded }) => {
       };
 
       mediaRecorder.current.onstop = () => {
-        const audioBlob = new Blob(audioChunks.current, { type: 'audio/wav' });
+        const mimeType = mediaRecorder.current.mimeType || 'audio/webm';
+        const extension = mimeType.includes('mp4') ? 'm4a' : mimeType.includes('ogg') ? 'ogg' : 'webm';
+        const audioBlob = new Blob(audioChunks.current, { type: mimeType });
         const audioUrl = URL.createObjectURL(audioBlob);
         setAudioURL(audioUrl);
-        onAudioRecorded(audioBlob, 'recorded_audio.wav');
+        onAudioRecorded(audioBlob, `recorded_audio.${extension}`);
         
         // Clean up
         if (audioContext.current) {
@@ -564,7 +572,7 @@ const HealthDashboard = ({ healthData }) => {
           <div className="alerts-list">
             {healthData.alerts.map((alert, index) => (
               <motion.div 
-                key={index} 
+                key={alert.id || index} 
                 className={`alert ${alert.type}`}
                 initial={{ opacity: 0, x: -20 }}
                 animate={{ opacity: 1, x: 0 }}
@@ -672,12 +680,15 @@ function App() {
 
   useEffect(() => {
     fetchHealthOverview();
+    const events = subscribeToEvents();
     registerServiceWorker();
     
     // Request device motion permission on mobile
     if (motionSupported && /Mobi|Android/i.test(navigator.userAgent)) {
       requestPermission();
     }
+
+    return () => events && events.close();
   }, []);
 
   const registerServiceWorker = async () => {
@@ -700,6 +711,46 @@ function App() {
     }
   };
 
+  // Dashboard updates are pushed by the server as results are written, so the
+  // overview is only fetched on load and when the stream asks for a resync
+  const subscribeToEvents = () => {
+    if (!('EventSource' in window)) return null;
+    const events = new EventSource(`${API}/events`);
+    let connectedBefore = false;
+
+    events.onopen = () => {
+      // Events published while reconnecting were missed
+      if (connectedBefore) fetchHealthOverview();
+      connectedBefore = true;
+    };
+
+    events.addEventListener('diagnostic', (event) => {
+      const diagnostic = JSON.parse(event.data);
+      setHealthData((current) => current && {
+        ...current,
+        recent_diagnostics: [diagnostic, ...(current.recent_diagnostics || [])].slice(0, 5),
+        total_diagnostics: (current.total_diagnostics || 0) + 1
+      });
+    });
+
+    events.addEventListener('health', (event) => {
+      const healthScores = JSON.parse(event.data);
+      setHealthData((current) => current && { ...current, health_scores: healthScores });
+    });
+
+    events.addEventListener('alert', (event) => {
+      const alert = JSON.parse(event.data);
+      setHealthData((current) => current && {
+        ...current,
+        alerts: [alert, ...(current.alerts || []).filter((existing) => existing.id !== alert.id)].slice(0, 10)
+      });
+    });
+
+    events.addEventListener('resync', () => fetchHealthOverview());
+
+    return events;
+  };
+
   const analyzeAudio = async (audioFile, filename) => {
     setIsAnalyzing(true);
     setDiagnosticResults(null);
@@ -724,7 +775,6 @@ function App() {
       setTimeout(() => {
         setDiagnosticResults(response.data);
         setIsAnalyzing(false);
-        fetchHealthOverview(); // Refresh health data
       }, 3000); // Simulate processing time
     } catch (error) {
       console.error('Error analyzing audio:', error);
@@ -0,0 +1,145 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from alerts import ALERT_COUNTER_COLLECTION, UNASSIGNED_VEHICLE, AlertEngine
+
+START = datetime(2024, 3, 5, 12)
+
+
+def make_result(component='Engine', severity='low', hours=0, vehicle_id='v1', **extra):
+    return {
+        'id': f"r-{component}-{hours}",
+        'vehicle_id': vehicle_id,
+        'component': component,
+        'diagnosis': 'Bearing Wear - Connecting Rod',
+        'severity': severity,
+        'confidence_score': 0.9,
+        'created_at': START + timedelta(hours=hours),
+        **extra,
+    }
+
+
+def fired_ids(engine, result):
+    return sorted(rule.id for rule, _, _ in engine.evaluate(result))
+
+
+def test_match_rules_only_see_their_component():
+    engine = AlertEngine(None, [
+        {'id': 'brakes', 'component': 'Brakes', 'min_severity': 'medium',
+         'alert': {'type': 'warning', 'severity': 'medium', 'message': 'Brakes'}},
+    ])
+    assert fired_ids(engine, make_result('Engine', 'critical')) == []
+    assert fired_ids(engine, make_result('Brakes', 'low')) == []
+    assert fired_ids(engine, make_result('Brakes', 'high')) == ['brakes']
+
+
+def test_count_rule_uses_a_sliding_window_per_vehicle():
+    engine = AlertEngine(None, [
+        {'id': 'repeated', 'kind': 'count', 'count': 3, 'window_hours': 24, 'min_severity': 'medium',
+         'alert': {'type': 'warning', 'severity': 'high', 'message': '{count} {component} in {window_hours}h'}},
+    ])
+    assert fired_ids(engine, make_result(severity='medium', hours=0)) == []
+    assert fired_ids(engine, make_result(severity='medium', hours=1, vehicle_id='v2')) == []
+    assert fired_ids(engine, make_result(severity='high', hours=2)) == []
+    # Third within 24 h for v1 fires; v2's result is counted separately
+    (rule, vehicle_key, context), = engine.evaluate(make_result(severity='medium', hours=20))
+    assert (vehicle_key, context['count']) == ('v1', 3)
+    assert rule.alert['message'].format(**context) == '3 Engine in 24h'
+    # The results at hours 0 and 2 have left the window by hour 30
+    assert fired_ids(engine, make_result(severity='medium', hours=30)) == []
+
+
+def test_escalation_rule_fires_when_severity_rises():
+    engine = AlertEngine(None, [
+        {'id': 'escalation', 'kind': 'escalation',
+         'alert': {'type': 'warning', 'severity': 'high', 'message': '{previous_severity} -> {severity}'}},
+    ])
+    assert fired_ids(engine, make_result(severity='low')) == []
+    assert fired_ids(engine, make_result(severity='low', hours=1)) == []
+    (_, _, context), = engine.evaluate(make_result(severity='high', hours=2))
+    assert context['previous_severity'] == 'low'
+    assert fired_ids(engine, make_result(severity='medium', hours=3)) == []
+
+
+def test_results_without_vehicle_share_counters():
+    engine = AlertEngine(None)
+    (_, vehicle_key, _), *_ = engine.evaluate(make_result('Brakes', 'medium', vehicle_id=None))
+    assert vehicle_key == UNASSIGNED_VEHICLE
+
+
+def test_default_rule_messages_format():
+    engine = AlertEngine(None)
+    for rule, _, context in engine.evaluate(make_result('Engine', 'critical')):
+        assert rule.alert['message'].format(**context)
+
+
+def test_unknown_rule_kind_is_rejected():
+    with pytest.raises(ValueError):
+        AlertEngine(None, [{'id': 'x', 'kind': 'sometimes', 'alert': {}}])
+
+
+class Cursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    async def to_list(self, length):
+        return self.docs[:length]
+
+
+class CounterCollection:
+    """The counter queries AlertEngine issues, applied to a dict keyed by _id"""
+
+    def __init__(self):
+        self.docs = {}
+
+    async def update_one(self, query, update, upsert=False):
+        doc = self.docs.get(query['_id'])
+        if doc is None:
+            doc = self.docs[query['_id']] = {**query, **update.get('$setOnInsert', {})}
+        for field, amount in update.get('$inc', {}).items():
+            doc[field] = doc.get(field, 0) + amount
+
+    def find(self, query, projection):
+        query = dict(query)
+        after = query.pop('bucket')['$gt']
+        return Cursor([
+            dict(doc) for doc in self.docs.values()
+            if 'bucket' in doc and doc['bucket'] > after and all(doc.get(k) == v for k, v in query.items())
+        ])
+
+    async def find_one_and_update(self, query, update, upsert=False, return_document=None):
+        previous = self.docs.get(query['_id'])
+        self.docs[query['_id']] = {**(previous or query), **update['$set']}
+        return dict(previous) if previous is not None else None
+
+
+class SharedDatabase:
+    def __init__(self):
+        self.counters = CounterCollection()
+
+    def __getitem__(self, name):
+        return self.counters if name == ALERT_COUNTER_COLLECTION else None
+
+
+def test_api_workers_share_rule_state():
+    db = SharedDatabase()
+    rules = [
+        {'id': 'repeated', 'kind': 'count', 'count': 3, 'window_hours': 24, 'min_severity': 'medium',
+         'alert': {'type': 'warning', 'severity': 'high', 'message': '{count}'}},
+        {'id': 'escalation', 'kind': 'escalation', 'alert': {'type': 'warning', 'severity': 'high', 'message': ''}},
+    ]
+    # Each worker process has its own engine; results land on either one
+    workers = [AlertEngine(db, rules), AlertEngine(db, rules)]
+
+    def fired(worker, result):
+        return sorted(rule.id for rule, _, _ in asyncio.run(workers[worker].evaluate_shared(result)))
+
+    assert fired(0, make_result(severity='medium', hours=0)) == []
+    assert fired(1, make_result(severity='high', hours=2)) == ['escalation']
+    assert fired(0, make_result(severity='medium', hours=3, vehicle_id='v2')) == []
+    (_, _, context), = asyncio.run(workers[1].evaluate_shared(make_result(severity='medium', hours=20)))
+    assert context['count'] == 3
+    # The hours 0 and 2 buckets have left the window by hour 30
+    assert fired(0, make_result(severity='high', hours=30)) == ['escalation']
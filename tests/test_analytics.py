@@ -0,0 +1,62 @@
+from datetime import datetime
+
+from analytics import UNKNOWN_COHORT, bucket_start, rollup_corrections, rollup_updates, summarize_buckets
+
+
+def make_result(**overrides):
+    result = {
+        'id': 'r1',
+        'component': 'Brakes',
+        'severity': 'medium',
+        'confidence_score': 0.9,
+        'estimated_cost': 400.0,
+        'created_at': datetime(2024, 3, 5, 14, 37, 12),
+    }
+    result.update(overrides)
+    return result
+
+
+def test_bucket_start_truncates_to_hour_and_day():
+    timestamp = datetime(2024, 3, 5, 14, 37, 12, 500)
+    assert bucket_start(timestamp, 'hour') == datetime(2024, 3, 5, 14)
+    assert bucket_start(timestamp, 'day') == datetime(2024, 3, 5)
+
+
+def test_rollup_updates_increment_hour_and_day_buckets_for_cohort():
+    updates = rollup_updates(make_result(), {'make': 'Toyota', 'model': 'Corolla', 'year': 2015})
+
+    assert [query['_id'] for query, _ in updates] == [
+        'hour|2024-03-05T14:00:00|Brakes|medium|Toyota|Corolla',
+        'day|2024-03-05T00:00:00|Brakes|medium|Toyota|Corolla',
+    ]
+    _, update = updates[0]
+    assert update['$inc'] == {'count': 1, 'confidence_sum': 0.9, 'estimated_cost_sum': 400.0}
+    assert update['$setOnInsert']['bucket'] == datetime(2024, 3, 5, 14)
+
+
+def test_results_without_vehicle_use_unknown_cohort():
+    (query, update), _ = rollup_updates(make_result(estimated_cost=None))
+    assert query['_id'].endswith(f"|{UNKNOWN_COHORT}|{UNKNOWN_COHORT}")
+    assert update['$inc']['estimated_cost_sum'] == 0.0
+
+
+def test_rollup_corrections_move_a_result_to_its_new_diagnosis():
+    updates = rollup_corrections(make_result(), {'component': 'Engine', 'confidence_score': 0.5})
+    assert [(query['_id'].split('|')[2], update['$inc']['count']) for query, update in updates] == [
+        ('Brakes', -1), ('Brakes', -1), ('Engine', 1), ('Engine', 1),
+    ]
+    assert updates[0][1]['$inc']['confidence_sum'] == -0.9
+    assert updates[2][1]['$inc']['confidence_sum'] == 0.5
+
+
+def test_summarize_buckets_totals_per_component_and_severity():
+    buckets = [
+        {'component': 'Brakes', 'severity': 'medium', 'count': 3},
+        {'component': 'Engine', 'severity': 'critical', 'count': 1},
+        {'component': 'Brakes', 'severity': 'critical', 'count': 2},
+    ]
+    assert summarize_buckets(buckets) == {
+        'total': 6,
+        'by_component': {'Brakes': 5, 'Engine': 1},
+        'by_severity': {'medium': 3, 'critical': 3},
+    }
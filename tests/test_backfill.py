@@ -0,0 +1,193 @@
+import asyncio
+import io
+import json
+from datetime import datetime
+
+import numpy as np
+import soundfile as sf
+from bson import ObjectId
+
+import backfill
+from analysis import ANALYSIS_VERSION, extract_audio_features
+from analytics import ROLLUP_COLLECTION
+from backfill import load_checkpoint, run_backfill
+
+SAMPLE_RATE = 16000
+
+
+def tone(seconds=2.0, frequency=120):
+    t = np.arange(int(SAMPLE_RATE * seconds)) / SAMPLE_RATE
+    noise = 0.05 * np.random.default_rng(0).standard_normal(len(t))
+    return (0.5 * np.sin(2 * np.pi * frequency * t) + noise).astype(np.float32)
+
+
+# Features as the pipeline stores them alongside a result
+FEATURES = extract_audio_features(tone(), SAMPLE_RATE)
+
+
+class Update:
+    """Records what an UpdateOne was built with"""
+
+    def __init__(self, filter, update, upsert=False):
+        self.filter = filter
+        self.update = update
+        self.upsert = upsert
+
+
+class Cursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, key, direction):
+        self.docs.sort(key=lambda doc: doc[key], reverse=direction < 0)
+        return self
+
+    def limit(self, n):
+        self.docs = self.docs[:n]
+        return self
+
+    async def to_list(self, length):
+        return [dict(doc) for doc in self.docs[:length]]
+
+
+class ResultCollection:
+    """Stands in for diagnostic_results: the queries and bulk writes backfill issues"""
+
+    def __init__(self, docs):
+        self.docs = {doc['_id']: doc for doc in docs}
+        self.bulk_writes = 0
+
+    def find(self, query):
+        after = query.get('_id', {}).get('$gt')
+        ids = query.get('_id', {}).get('$in')
+        version = query['analysis_version']['$ne']
+        return Cursor([
+            doc for doc in self.docs.values()
+            if doc.get('analysis_version') != version and (after is None or doc['_id'] > after)
+            and (ids is None or doc['_id'] in ids)
+        ])
+
+    async def bulk_write(self, operations, ordered=True):
+        class Outcome:
+            modified_count = 0
+        self.bulk_writes += 1
+        for operation in operations:
+            self.docs[operation.filter['_id']].update(operation.update['$set'])
+            Outcome.modified_count += 1
+        return Outcome
+
+
+class RollupCollection:
+    def __init__(self):
+        self.counts = {}
+
+    async def bulk_write(self, operations, ordered=True):
+        for operation in operations:
+            key = operation.filter['_id']
+            self.counts[key] = self.counts.get(key, 0) + operation.update['$inc']['count']
+
+
+class VehicleCollection:
+    def __init__(self, vehicles):
+        self.vehicles = vehicles
+
+    def find(self, query, projection):
+        return Cursor([vehicle for vehicle in self.vehicles if vehicle['id'] in query['id']['$in']])
+
+
+class Database:
+    def __init__(self, docs, vehicles=()):
+        self.diagnostic_results = ResultCollection(docs)
+        self.rollups = RollupCollection()
+        self.vehicles = VehicleCollection(list(vehicles))
+
+    def __getitem__(self, name):
+        assert name == ROLLUP_COLLECTION
+        return self.rollups
+
+
+def result(version, features=FEATURES, **fields):
+    return {
+        '_id': ObjectId(), 'analysis_version': version, 'audio_features': features, 'diagnosis': 'old',
+        'component': 'Brakes', 'severity': 'low', 'confidence_score': 0.1, 'estimated_cost': 1.0,
+        'created_at': datetime(2024, 3, 5, 14), **fields,
+    }
+
+
+def backfill_run(db, checkpoint):
+    return asyncio.run(run_backfill(db, workers=1, batch_size=2, checkpoint_path=checkpoint))
+
+
+def test_stale_results_are_reprocessed_and_checkpointed(tmp_path, monkeypatch):
+    monkeypatch.setattr(backfill, 'UpdateOne', Update)
+    checkpoint = tmp_path / 'checkpoint.json'
+    # ObjectIds increase in creation order
+    stale = [result(ANALYSIS_VERSION - 1, vehicle_id='v1')]
+    current = result(ANALYSIS_VERSION)
+    stale.append(result(ANALYSIS_VERSION - 1))
+    unusable = result(ANALYSIS_VERSION - 1, features=None)
+    stale.append(result(ANALYSIS_VERSION - 1))
+    db = Database([*stale, current, unusable], vehicles=[{'id': 'v1', 'make': 'Toyota', 'model': 'Corolla'}])
+
+    report = backfill_run(db, checkpoint)
+
+    assert report['processed'] == 4
+    assert report['updated'] == 3 and report['skipped'] == 1 and report['failed'] == 0
+    assert db.diagnostic_results.bulk_writes == 2
+    for doc in stale:
+        stored = db.diagnostic_results.docs[doc['_id']]
+        assert stored['analysis_version'] == ANALYSIS_VERSION and stored['diagnosis'] != 'old'
+    assert db.diagnostic_results.docs[current['_id']]['diagnosis'] == 'old'
+
+    # The changed verdicts move out of their old rollups and into the new ones
+    assert report['diagnosis_changed'] == 3
+    assert db.rollups.counts['hour|2024-03-05T14:00:00|Brakes|low|unknown|unknown'] == -2
+    assert db.rollups.counts['day|2024-03-05T00:00:00|Brakes|low|Toyota|Corolla'] == -1
+    assert sum(count for count in db.rollups.counts.values() if count > 0) == 6
+
+    state = load_checkpoint(checkpoint)
+    assert state['last_id'] == stale[2]['_id'] and state['processed'] == 4
+
+    # A resumed run only picks up results added after the checkpoint
+    late = result(ANALYSIS_VERSION - 1)
+    db.diagnostic_results.docs[late['_id']] = late
+    report = backfill_run(db, checkpoint)
+    assert report['processed'] == 1
+    assert json.loads(checkpoint.read_text())['last_id'] == str(late['_id'])
+
+
+def test_archived_audio_is_analysed_like_an_upload(tmp_path, monkeypatch):
+    monkeypatch.setattr(backfill, 'UpdateOne', Update)
+    audio_path = tmp_path / 'clip.flac'
+    sf.write(audio_path, tone(frequency=300), SAMPLE_RATE, format='FLAC')
+    doc = result(ANALYSIS_VERSION - 1, audio_path=str(audio_path), analysis_profile='quick')
+    db = Database([doc])
+
+    backfill_run(db, tmp_path / 'checkpoint.json')
+
+    buffer = io.BytesIO(audio_path.read_bytes())
+    audio_data, sample_rate = sf.read(buffer, dtype='float32')
+    stored = db.diagnostic_results.docs[doc['_id']]
+    assert stored['audio_features'] == extract_audio_features(audio_data, sample_rate, 'quick')
+
+
+def test_failed_results_are_retried_on_the_next_run(tmp_path, monkeypatch):
+    monkeypatch.setattr(backfill, 'UpdateOne', Update)
+    checkpoint = tmp_path / 'checkpoint.json'
+    broken = tmp_path / 'broken.wav'
+    broken.write_bytes(b'not audio at all')
+    failing = result(ANALYSIS_VERSION - 1, audio_path=str(broken))
+    db = Database([failing, result(ANALYSIS_VERSION - 1)])
+
+    report = backfill_run(db, checkpoint)
+    assert report['failed'] == 1 and report['updated'] == 1
+    assert load_checkpoint(checkpoint)['failed_ids'] == [failing['_id']]
+
+    # Still failing: kept for the next run
+    assert backfill_run(db, checkpoint)['failed'] == 1
+
+    broken.unlink()
+    report = backfill_run(db, checkpoint)
+    assert report['processed'] == 1 and report['failed'] == 0
+    assert db.diagnostic_results.docs[failing['_id']]['analysis_version'] == ANALYSIS_VERSION
+    assert load_checkpoint(checkpoint)['failed_ids'] == []
@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+import baselines
+from baselines import (
+    BASELINE_PRIOR_WEIGHT, FEATURE_DIM, RunningBaseline, feature_vector, pack_symmetric, prior_matrix,
+    unpack_symmetric,
+)
+
+
+def observations(count, seed=0):
+    rng = np.random.default_rng(seed)
+    scale = baselines.FEATURE_PRIOR_STD
+    return rng.standard_normal((count, FEATURE_DIM)) * scale * 0.5 + scale * 3
+
+
+def test_online_statistics_match_batch_computation():
+    data = observations(40)
+    baseline = RunningBaseline()
+    for x in data:
+        baseline.update(x)
+
+    np.testing.assert_allclose(baseline.mean, data.mean(axis=0))
+    np.testing.assert_allclose(baseline.covariance(), np.cov(data, rowvar=False), rtol=1e-9)
+    # Sherman-Morrison updates track the exact inverse of M2 + prior
+    np.testing.assert_allclose(baseline.precision, np.linalg.inv(baseline.m2 + prior_matrix()), rtol=1e-6)
+
+
+def test_score_is_mahalanobis_distance_under_regularised_covariance():
+    data = observations(30, seed=1)
+    baseline = RunningBaseline()
+    for x in data:
+        baseline.update(x)
+    x = data[0] + baselines.FEATURE_PRIOR_STD
+
+    dof = len(data) - 1 + BASELINE_PRIOR_WEIGHT
+    covariance = (baseline.m2 + prior_matrix()) / dof
+    diff = x - data.mean(axis=0)
+    expected = np.sqrt(diff @ np.linalg.solve(covariance, diff))
+    assert baseline.score(x) == pytest.approx(expected, rel=1e-6)
+
+
+def test_no_score_until_enough_samples_and_outliers_score_higher():
+    baseline = RunningBaseline()
+    data = observations(baselines.BASELINE_MIN_SAMPLES + 20, seed=2)
+    assert baseline.score(data[0]) is None
+    for x in data[:-1]:
+        baseline.update(x)
+    typical = baseline.score(data[-1])
+    outlier = baseline.score(data[-1] + 6 * baselines.FEATURE_PRIOR_STD)
+    assert typical is not None and outlier > 3 * typical
+
+
+def test_document_round_trip_is_compact_and_lossless():
+    baseline = RunningBaseline()
+    for x in observations(10, seed=3):
+        baseline.update(x)
+    doc = baseline.to_document()
+    assert len(doc['m2']) == FEATURE_DIM * (FEATURE_DIM + 1) // 2 * 8
+
+    restored = RunningBaseline.from_document(doc)
+    assert restored.n == 10
+    np.testing.assert_array_equal(restored.mean, baseline.mean)
+    np.testing.assert_array_equal(restored.m2, unpack_symmetric(pack_symmetric(baseline.m2)))
+    np.testing.assert_allclose(restored.precision, baseline.precision)
+    assert RunningBaseline.from_document({**doc, 'version': -1}).n == 0
+
+
+def test_feature_vector_layout():
+    features = {'mfcc_features': list(range(13)), 'spectral_centroid': 1500.0,
+                'spectral_rolloff': 3000.0, 'zero_crossing_rate': 0.05}
+    vector = feature_vector(features)
+    assert vector.shape == (FEATURE_DIM,)
+    assert list(vector[-3:]) == [1500.0, 3000.0, 0.05]
+
+
+def test_merge_matches_single_pass_over_both_sets():
+    data = observations(50, seed=3)
+    first, second, whole = RunningBaseline(), RunningBaseline(), RunningBaseline()
+    for x in data[:20]:
+        first.update(x)
+    for x in data[20:]:
+        second.update(x)
+    for x in data:
+        whole.update(x)
+
+    merged = first.merge(second)
+    assert merged.n == 50
+    np.testing.assert_allclose(merged.mean, whole.mean)
+    np.testing.assert_allclose(merged.m2, whole.m2, rtol=1e-9)
+    np.testing.assert_allclose(merged.precision, np.linalg.inv(whole.m2 + prior_matrix()), rtol=1e-9)
+    assert RunningBaseline().merge(first).n == 20
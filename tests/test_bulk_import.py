@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+from bulk_import import VehicleImport, iter_csv_rows, iter_ndjson_rows, normalize_vin
+from server import VehicleInfo
+
+
+async def chunked(data, size):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def collect(rows):
+    async def run():
+        return [row async for row in rows]
+    return asyncio.run(run())
+
+
+class UpsertCollection:
+    """Applies UpdateOne upserts on vin to a dict, like an unordered bulk_write"""
+
+    def __init__(self):
+        self.vehicles = {}
+        self.calls = 0
+
+    async def bulk_write(self, requests, ordered=True):
+        assert ordered is False
+        self.calls += 1
+        upserted = matched = 0
+        for request in requests:
+            vin = request._filter['vin']
+            if vin in self.vehicles:
+                matched += 1
+            else:
+                upserted += 1
+                self.vehicles[vin] = dict(request._doc['$setOnInsert'], vin=vin)
+            self.vehicles[vin].update(request._doc['$set'])
+        return type('Result', (), {'bulk_api_result': {'nUpserted': upserted, 'nMatched': matched}})()
+
+
+def test_ndjson_rows_survive_chunk_boundaries_inside_multibyte_characters():
+    data = '{"vin": "A", "make": "Škoda"}\n\n{"vin": "B"}\n[1]'.encode()
+    rows = collect(iter_ndjson_rows(chunked(data, 3)))
+    assert rows == [(1, {'vin': 'A', 'make': 'Škoda'}), (2, {'vin': 'B'}), (3, "row must be a JSON object")]
+
+
+def test_csv_rows_use_header_and_allow_quoted_newlines():
+    data = b'VIN,Make,Model\r\nA,Ford,"F-150\nLariat"\r\nB,,Jetta\r\n'
+    rows = collect(iter_csv_rows(chunked(data, 5)))
+    assert rows == [(1, {'vin': 'A', 'make': 'Ford', 'model': 'F-150\nLariat'}), (2, {'vin': 'B', 'model': 'Jetta'})]
+
+
+def test_overlong_rows_are_reported_and_skipped():
+    data = b'{"vin": "A"}\n{"vin": "' + b'x' * 5000 + b'"}\n{"vin": "B"}'
+    rows = collect(iter_ndjson_rows(chunked(data, 7), max_line_bytes=100))
+    assert rows == [(1, {'vin': 'A'}), (2, "row is longer than 100 bytes"), (3, {'vin': 'B'})]
+
+    # A file with no newlines at all, and a quoted field that never closes
+    assert collect(iter_csv_rows(chunked(b'vin,make' + b',x' * 5000, 64), max_line_bytes=100)) == [
+        (1, "row is longer than 100 bytes"),
+    ]
+    data = b'vin,make\nA,"Ford\n' + b'more\n' * 50 + b'B,Honda\n'
+    rows = collect(iter_csv_rows(chunked(data, 64), max_line_bytes=100))
+    # The lines after the cut come out as rows of their own, which fail validation
+    assert rows[0] == (1, "row is longer than 100 bytes")
+    assert rows[-1][1] == {'vin': 'B', 'make': 'Honda'}
+
+
+def test_normalize_vin_rejects_bad_vins():
+    assert normalize_vin(' 1hgcm82633a004352 ') == '1HGCM82633A004352'
+    for vin in ('', '1HGCM82633A00435', '1HGCM82633A00435O'):
+        with pytest.raises(ValueError):
+            normalize_vin(vin)
+
+
+def test_import_upserts_on_vin_in_batches_and_reports_row_errors():
+    rows = [
+        {'vin': '1HGCM82633A004352', 'make': 'Honda', 'model': 'Accord', 'year': '2003', 'mileage': 150000},
+        {'vin': '1HGCM82633A004353', 'make': 'Honda', 'model': 'Civic', 'year': 2005},
+        {'vin': '1HGCM82633A004354', 'make': 'Honda', 'model': 'Civic', 'year': 2005, 'mileage': 1},
+        {'vin': '1HGCM82633A004352', 'make': 'Honda', 'model': 'Accord', 'year': 2003, 'mileage': 160000},
+    ]
+
+    async def run():
+        async def numbered():
+            for number, row in enumerate(rows, 1):
+                yield number, row
+        collection = UpsertCollection()
+        summary = await VehicleImport(collection, VehicleInfo, batch_size=2).run(numbered())
+        return collection, summary
+
+    collection, summary = asyncio.run(run())
+    assert (summary['rows'], summary['inserted'], summary['updated'], summary['failed']) == (4, 2, 1, 1)
+    assert summary['errors'][0]['row'] == 2 and 'mileage' in summary['errors'][0]['error']
+    assert collection.calls == 2
+    assert collection.vehicles['1HGCM82633A004352']['mileage'] == 160000
+    assert collection.vehicles['1HGCM82633A004352']['year'] == 2003
@@ -0,0 +1,128 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+import baselines
+from baselines import FEATURE_DIM, FEATURE_NAMES
+from cohorts import CohortBaselines, band, cohort_of, deviation
+
+
+class DocumentCollection:
+    """Stands in for a motor collection of cohort documents keyed on 'cohort'"""
+
+    def __init__(self):
+        self.docs = {}
+
+    async def find_one(self, query):
+        doc = self.docs.get(query['cohort'])
+        return dict(doc) if doc else None
+
+    async def insert_one(self, doc):
+        self.docs[doc['cohort']] = dict(doc)
+
+    async def replace_one(self, query, doc):
+        class Outcome:
+            modified_count = 0
+        current = self.docs.get(query['cohort'])
+        if current is not None and current['n'] == query['n']:
+            self.docs[query['cohort']] = dict(doc)
+            Outcome.modified_count = 1
+        return Outcome
+
+    async def _iterate(self):
+        for doc in list(self.docs.values()):
+            yield dict(doc)
+
+    def find(self, query):
+        return self._iterate()
+
+
+class Database(dict):
+    def __missing__(self, name):
+        self[name] = DocumentCollection()
+        return self[name]
+
+
+VEHICLE = {'make': 'Toyota', 'model': 'Corolla ', 'year': 2018, 'mileage': 64000}
+
+
+def features_from(x):
+    return {
+        'mfcc_features': list(x[:13]),
+        'spectral_centroid': x[13],
+        'spectral_rolloff': x[14],
+        'zero_crossing_rate': x[15],
+    }
+
+
+def clips(count, seed=0):
+    rng = np.random.default_rng(seed)
+    scale = baselines.FEATURE_PRIOR_STD
+    return rng.standard_normal((count, FEATURE_DIM)) * scale * 0.5 + scale * 3
+
+
+def test_cohort_fields_use_bands():
+    assert band(2018, 5) == '2015-2019'
+    assert band(64000, 50000) == '50000-99999'
+    assert cohort_of(VEHICLE) == {
+        'make': 'toyota', 'model': 'corolla', 'year_band': '2015-2019', 'mileage_band': '50000-99999',
+    }
+    assert cohort_of({**VEHICLE, 'mileage': 0})['mileage_band'] == '0-49999'
+
+
+def test_cohort_scores_once_it_has_enough_clips():
+    cohorts = CohortBaselines(Database(), min_samples=10)
+    data = clips(12)
+    observed = [cohorts.observe(VEHICLE, features_from(x)) for x in data]
+
+    assert [item['cohort_samples'] for item in observed] == list(range(12))
+    assert all(item['cohort_score'] is None for item in observed[:10])
+    assert observed[10]['cohort_score'] > 0
+    # Another vehicle in the same bands shares the cohort
+    same_cohort = {**VEHICLE, 'model': 'COROLLA', 'year': 2016, 'mileage': 99999}
+    assert cohorts.observe(same_cohort, features_from(data[0]))['cohort_samples'] == 12
+
+
+def test_snapshots_from_several_workers_merge():
+    db = Database()
+    data = clips(60, seed=4)
+    first, second = CohortBaselines(db), CohortBaselines(db)
+
+    async def scenario():
+        for x in data[:25]:
+            first.observe(VEHICLE, features_from(x))
+        for x in data[25:]:
+            second.observe(VEHICLE, features_from(x))
+        await first.snapshot()
+        await second.snapshot()
+        # A third worker starting up sees everything both have written
+        fresh = CohortBaselines(db)
+        await fresh.load()
+        return fresh
+
+    fresh = asyncio.run(scenario())
+    _, stored = fresh.get(VEHICLE)
+    assert stored.n == 60
+    np.testing.assert_allclose(stored.mean, data.mean(axis=0))
+    np.testing.assert_allclose(stored.covariance(), np.cov(data, rowvar=False), rtol=1e-9)
+    # The second worker adopted the merged statistics; nothing is left pending
+    assert second.get(VEHICLE)[1].n == 60
+    assert second.stats()['pending_clips'] == 0
+    assert first.get(VEHICLE)[1].n == 25
+
+
+def test_deviation_ranks_features_by_z_score():
+    cohort = baselines.RunningBaseline()
+    for x in clips(40, seed=5):
+        cohort.update(x)
+    vehicle = baselines.RunningBaseline()
+    shifted = cohort.mean.copy()
+    centroid = FEATURE_NAMES.index('spectral_centroid')
+    shifted[centroid] += 4 * np.sqrt(cohort.covariance()[centroid, centroid])
+    vehicle.update(shifted)
+
+    result = deviation(vehicle, cohort, min_samples=20)
+    assert result['features'][0]['feature'] == 'spectral_centroid'
+    assert result['features'][0]['z_score'] == pytest.approx(4.0)
+    assert result['distance'] > 0
@@ -0,0 +1,103 @@
+import asyncio
+import io
+import os
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from decoder_pool import DecoderError, DecoderPool
+from pcm_shm import SEGMENT_PREFIX, SHM_DIR
+
+
+def flac_bytes(seconds, sr=16000):
+    t = np.arange(int(sr * seconds)) / sr
+    noise = np.random.default_rng(0).standard_normal(len(t))
+    buf = io.BytesIO()
+    sf.write(buf, 0.3 * np.sin(2 * np.pi * 120 * t) + 0.1 * noise, sr, format='FLAC')
+    return buf.getvalue()
+
+
+def own_segments():
+    return [name for name in os.listdir(SHM_DIR) if name.startswith(f"{SEGMENT_PREFIX}-{os.getpid()}-")]
+
+
+def run_with_pool(scenario, **kwargs):
+    async def wrapper():
+        pool = DecoderPool(size=1, health_interval=0, **kwargs)
+        await pool.start()
+        try:
+            return await scenario(pool)
+        finally:
+            await pool.stop()
+
+    return asyncio.run(wrapper())
+
+
+async def decode_and_release(pool, data):
+    segment, sample_rate = await pool.decode(data, 'flac')
+    try:
+        return segment.array.shape[0], sample_rate
+    finally:
+        segment.release()
+
+
+def test_decodes_and_survives_bad_input():
+    async def scenario(pool):
+        with pytest.raises(DecoderError):
+            await pool.decode(b'fLaC not really', 'flac')
+        return await decode_and_release(pool, flac_bytes(1)), pool.restarts
+
+    (frames, sample_rate), restarts = run_with_pool(scenario)
+    assert (frames, sample_rate) == (16000, 16000)
+    # A decode error leaves the worker usable
+    assert restarts == 0
+    assert own_segments() == []
+
+
+def test_worker_killed_mid_decode_is_replaced():
+    async def scenario(pool):
+        worker = pool._workers[0]
+        decode = asyncio.create_task(pool.decode(flac_bytes(300), 'flac'))
+        await asyncio.sleep(0.05)
+        worker.process.kill()
+        with pytest.raises(Exception):
+            await decode
+        return await decode_and_release(pool, flac_bytes(1)), pool.restarts, pool._workers[0] is worker
+
+    (frames, _), restarts, same_worker = run_with_pool(scenario)
+    assert frames == 16000
+    assert restarts == 1 and not same_worker
+    assert own_segments() == []
+
+
+def test_cancelled_decode_returns_a_worker_to_the_pool():
+    async def scenario(pool):
+        decode = asyncio.create_task(pool.decode(flac_bytes(300), 'flac'))
+        await asyncio.sleep(0.05)
+        decode.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await decode
+        # The pool still has a worker to hand out
+        return await asyncio.wait_for(decode_and_release(pool, flac_bytes(1)), timeout=30), pool.restarts
+
+    (frames, _), restarts = run_with_pool(scenario)
+    assert frames == 16000
+    assert restarts == 1
+    assert own_segments() == []
+
+
+def test_health_check_replaces_dead_idle_worker():
+    async def scenario(pool):
+        worker = pool._workers[0]
+        worker.process.kill()
+        pool.health_interval = 0.05
+        pool._health_task = asyncio.create_task(pool._health_loop())
+        for _ in range(100):
+            if pool.restarts:
+                break
+            await asyncio.sleep(0.05)
+        return await decode_and_release(pool, flac_bytes(1)), pool.restarts
+
+    (frames, _), restarts = run_with_pool(scenario)
+    assert frames == 16000 and restarts == 1
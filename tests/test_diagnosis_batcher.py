@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from analysis import diagnose_batch
+from diagnosis_batcher import DiagnosisBatcher, size_bucket
+
+
+class EchoModel:
+    """Records each call's batch and answers with the clip ids"""
+
+    def __init__(self, fail=False):
+        self.calls = []
+        self.fail = fail
+
+    def __call__(self, features_list):
+        self.calls.append(len(features_list))
+        if self.fail:
+            raise RuntimeError("model unavailable")
+        return [{'clip': features['clip']} for features in features_list]
+
+
+def run_requests(batcher, count):
+    async def scenario():
+        batcher.start()
+        results = await asyncio.gather(
+            *(batcher.diagnose({'clip': i}) for i in range(count)), return_exceptions=True
+        )
+        await batcher.stop()
+        return results
+    return asyncio.run(scenario())
+
+
+def test_concurrent_requests_share_model_calls():
+    model = EchoModel()
+    batcher = DiagnosisBatcher(model, max_batch=4, max_wait_ms=50)
+    results = run_requests(batcher, 10)
+
+    assert results == [{'clip': i} for i in range(10)]
+    assert model.calls == [4, 4, 2]
+    stats = batcher.stats()
+    assert stats['batches'] == 3 and stats['items'] == 10
+    assert stats['batch_sizes'] == {'3-4': 2, '2': 1}
+
+
+def test_partial_batch_is_released_after_the_wait():
+    model = EchoModel()
+    batcher = DiagnosisBatcher(model, max_batch=32, max_wait_ms=5)
+
+    async def scenario():
+        batcher.start()
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        result = await batcher.diagnose({'clip': 7})
+        elapsed = loop.time() - started
+        await batcher.stop()
+        return result, elapsed
+
+    result, elapsed = asyncio.run(scenario())
+    assert result == {'clip': 7}
+    assert model.calls == [1]
+    assert elapsed < 1
+
+
+def test_batching_disabled_calls_model_per_request():
+    model = EchoModel()
+    batcher = DiagnosisBatcher(model, max_batch=32, max_wait_ms=0)
+    results = run_requests(batcher, 3)
+
+    assert not batcher.enabled
+    assert results == [{'clip': i} for i in range(3)]
+    assert model.calls == [1, 1, 1]
+
+
+def test_model_failure_reaches_every_request_in_the_batch():
+    batcher = DiagnosisBatcher(EchoModel(fail=True), max_batch=8, max_wait_ms=20)
+    results = run_requests(batcher, 3)
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+@pytest.mark.parametrize('size, bucket', [(1, '1'), (2, '2'), (3, '3-4'), (4, '3-4'), (5, '5-8'), (32, '17-32')])
+def test_size_buckets(size, bucket):
+    assert size_bucket(size) == bucket
+
+
+def test_diagnose_batch_applies_rules_per_clip():
+    results = diagnose_batch([
+        {'spectral_centroid': 3000, 'zero_crossing_rate': 0.2},
+        {'spectral_centroid': 500, 'zero_crossing_rate': 0.2},
+        None,
+    ])
+    assert [result['component'] for result in results[:2]] == ['Brakes', 'Engine']
+    assert len(results) == 3
+    # Every clip gets its own draw, not a shared dict
+    assert results[0] is not results[1]
+    assert diagnose_batch([]) == []
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+import scipy.fft
+
+import dsp_cache
+from analysis import extract_audio_features
+
+
+def test_dct_matrix_matches_scipy_ortho_dct():
+    values = np.random.default_rng(0).standard_normal((128, 7)).astype(np.float32)
+    expected = scipy.fft.dct(values, axis=0, type=2, norm='ortho')[:13]
+    np.testing.assert_allclose(dsp_cache.dct_matrix(13, 128) @ values, expected, rtol=1e-4, atol=1e-4)
+
+
+def test_cache_evicts_least_recently_used():
+    cache = dsp_cache.DSPBasisCache(max_entries=2)
+    first = cache.get(8000)
+    cache.get(16000)
+    assert cache.get(8000) is first  # refreshes 8000
+    cache.get(22050)                 # evicts 16000
+    assert cache.stats()['evictions'] == 1
+    assert cache.get(8000) is first
+    assert cache.stats()['misses'] == 3
+
+
+def test_persisted_basis_is_memory_mapped(tmp_path, monkeypatch):
+    monkeypatch.setattr(dsp_cache, 'DSP_CACHE_DIR', str(tmp_path))
+    built = dsp_cache.DSPBasisCache().get(16000)
+    loaded = dsp_cache.DSPBasisCache().get(16000)
+    assert isinstance(loaded.mel_basis, np.memmap)
+    np.testing.assert_array_equal(loaded.mel_basis, built.mel_basis)
+
+
+@pytest.mark.parametrize('sr', [8000, 22050, 48000])
+def test_features_match_librosa_reference(sr):
+    import librosa
+
+    t = np.arange(2 * sr) / sr
+    audio_data = (0.5 * np.sin(2 * np.pi * 150 * t) +
+                  0.1 * np.random.default_rng(sr).standard_normal(len(t))).astype(np.float32)
+
+    features = extract_audio_features(audio_data, sr)
+
+    mfcc = np.mean(librosa.feature.mfcc(y=audio_data, sr=sr, n_mfcc=13), axis=1)
+    np.testing.assert_allclose(features['mfcc_features'], mfcc, atol=1e-3)
+    assert features['spectral_centroid'] == pytest.approx(
+        np.mean(librosa.feature.spectral_centroid(y=audio_data, sr=sr)), rel=1e-4)
+    assert features['spectral_rolloff'] == pytest.approx(
+        np.mean(librosa.feature.spectral_rolloff(y=audio_data, sr=sr)), rel=1e-4)
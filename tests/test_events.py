@@ -0,0 +1,68 @@
+import asyncio
+import json
+
+from events import EventBroker, encode_event
+
+
+def parse_frame(frame):
+    fields = dict(line.split(': ', 1) for line in frame.decode().strip().split('\n'))
+    return fields['event'], json.loads(fields['data'])
+
+
+async def take(stream, count):
+    return [await stream.__anext__() for _ in range(count)]
+
+
+def test_encode_event_is_single_sse_frame():
+    frame = encode_event(7, 'diagnostic', {'component': 'Brakes', 'lines': 'a\nb'})
+    assert frame.startswith(b'id: 7\nevent: diagnostic\ndata: {')
+    assert frame.endswith(b'\n\n') and frame.count(b'\n\n') == 1
+
+
+def test_published_events_reach_every_subscriber():
+    async def scenario():
+        broker = EventBroker()
+        streams = [broker.stream() for _ in range(3)]
+        for stream in streams:
+            assert await stream.__anext__() == b'retry: 3000\n\n'
+        broker.publish('diagnostic', {'id': 'r1'})
+        received = [parse_frame(frame) for stream in streams for frame in await take(stream, 1)]
+        for stream in streams:
+            await stream.aclose()
+        return received, broker.stats()
+
+    received, stats = asyncio.run(scenario())
+    assert received == [('diagnostic', {'id': 'r1'})] * 3
+    assert stats['subscribers'] == 0
+
+
+def test_slow_subscriber_is_bounded_and_told_to_resync():
+    async def scenario():
+        broker = EventBroker(buffer_size=4)
+        stream = broker.stream()
+        await stream.__anext__()
+        for i in range(10):
+            broker.publish('diagnostic', {'id': i})
+        frames = [parse_frame(frame) for frame in await take(stream, 5)]
+        await stream.aclose()
+        return frames
+
+    frames = asyncio.run(scenario())
+    assert frames[0][0] == 'resync'
+    # Only the newest buffer_size events were kept
+    assert [data['id'] for _, data in frames[1:]] == [6, 7, 8, 9]
+
+
+def test_idle_stream_sends_keepalives_and_ends_on_close():
+    async def scenario():
+        broker = EventBroker(keepalive_seconds=0.01)
+        stream = broker.stream()
+        await stream.__anext__()
+        keepalive = await stream.__anext__()
+        broker.close()
+        remaining = [frame async for frame in stream]
+        return keepalive, remaining
+
+    keepalive, remaining = asyncio.run(scenario())
+    assert keepalive == b': keepalive\n\n'
+    assert remaining == []
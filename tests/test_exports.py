@@ -0,0 +1,74 @@
+import asyncio
+import csv
+import io
+import json
+from datetime import datetime
+
+import exports
+from exports import DIAGNOSTIC_COLUMNS, diagnostics_query, stream_export, vehicles_query
+
+
+class ListCursor:
+    """Async cursor over a list, recording whether it was closed"""
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.closed = False
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self.docs:
+            yield doc
+
+    async def close(self):
+        self.closed = True
+
+
+def diagnostic(i):
+    return {
+        'id': f"r{i}", 'vehicle_id': 'v1', 'audio_filename': 'clip, "front".wav', 'component': 'Brakes',
+        'diagnosis': 'Brake Pad Wear', 'confidence_score': 0.9, 'severity': 'medium', 'urgency_level': 'month',
+        'estimated_cost': None, 'recommendations': ['Replace pads', 'Check fluid'], 'analysis_version': 1,
+        'created_at': datetime(2024, 3, 5, 12, i),
+    }
+
+
+def collect(cursor, fmt):
+    async def run():
+        return [chunk async for chunk in stream_export(cursor, fmt, DIAGNOSTIC_COLUMNS)]
+    return asyncio.run(run())
+
+
+def test_csv_export_has_header_and_escaped_rows():
+    cursor = ListCursor([diagnostic(i) for i in range(3)])
+    rows = list(csv.reader(io.StringIO(b''.join(collect(cursor, 'csv')).decode())))
+
+    assert rows[0] == DIAGNOSTIC_COLUMNS
+    assert len(rows) == 4
+    first = dict(zip(rows[0], rows[1]))
+    assert first['audio_filename'] == 'clip, "front".wav'
+    assert first['recommendations'] == 'Replace pads; Check fluid'
+    assert first['estimated_cost'] == ''
+    assert first['created_at'] == '2024-03-05T12:00:00'
+    assert cursor.closed
+
+
+def test_ndjson_export_is_chunked_one_document_per_line(monkeypatch):
+    monkeypatch.setattr(exports, 'EXPORT_CHUNK_BYTES', 512)
+    cursor = ListCursor([diagnostic(i) for i in range(20)])
+    chunks = collect(cursor, 'ndjson')
+
+    assert len(chunks) > 1
+    lines = b''.join(chunks).decode().splitlines()
+    assert [json.loads(line)['id'] for line in lines] == [f"r{i}" for i in range(20)]
+
+
+def test_queries_only_include_given_filters():
+    since = datetime(2024, 1, 1)
+    assert diagnostics_query(component='Brakes', since=since) == {
+        'component': 'Brakes', 'created_at': {'$gte': since},
+    }
+    assert vehicles_query(make='Ford', year_max=2010) == {'make': 'Ford', 'year': {'$lte': 2010}}
+    assert diagnostics_query() == {}
@@ -0,0 +1,103 @@
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from analysis import HOP_LENGTH, N_FFT, N_MELS, extract_audio_features
+from feature_pipeline import SCRATCH_BOUND_BYTES, frame_count
+
+
+def engine_clip(sr, seconds, seed=0):
+    t = np.arange(int(sr * seconds)) / sr
+    noise = np.random.default_rng(seed).standard_normal(len(t))
+    return (0.5 * np.sin(2 * np.pi * 120 * t) + 0.1 * noise).astype(np.float32)
+
+
+def peak_allocation(fn, *args):
+    tracemalloc.start()
+    try:
+        fn(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.mark.parametrize('sr,seconds', [(16000, 5), (44100, 10), (48000, 30)])
+def test_peak_allocation_per_clip_is_bounded(sr, seconds):
+    audio_data = engine_clip(sr, seconds)
+    extract_audio_features(audio_data, sr)  # first clip sizes the worker's scratch buffers
+
+    # Independent of clip length: nothing per-stage is allocated for the whole clip
+    assert peak_allocation(extract_audio_features, audio_data, sr) < SCRATCH_BOUND_BYTES
+
+
+def test_first_clip_allocates_scratch_and_mel_matrix_only():
+    sr = 22050
+    audio_data = engine_clip(sr, 20, seed=1)
+    mel_bytes = frame_count(len(audio_data), HOP_LENGTH) * N_MELS * 4
+    block_bytes = 128 * (N_FFT + 3 * (N_FFT // 2 + 1)) * 4
+
+    extract_audio_features(engine_clip(sr, 0.5), sr)  # basis cached, small mel buffer
+    assert peak_allocation(extract_audio_features, audio_data, sr) < mel_bytes + block_bytes + SCRATCH_BOUND_BYTES
+
+
+def test_zero_crossing_rate_matches_librosa_at_clip_edges():
+    import librosa
+
+    sr = 8000
+    for n_samples in (800, 1601, 4097):
+        audio_data = engine_clip(sr, n_samples / sr, seed=n_samples)
+        audio_data[:100] = 0.0
+        features = extract_audio_features(audio_data, sr)
+        expected = np.mean(librosa.feature.zero_crossing_rate(audio_data))
+        assert features['zero_crossing_rate'] == pytest.approx(expected, abs=1e-9)
+
+
+def burst_clip(sr, seconds, bursts):
+    """Quiet engine hum with loud passages at the given (start, end) seconds"""
+    audio_data = 0.1 * engine_clip(sr, seconds)
+    for start, end in bursts:
+        audio_data[int(start * sr):int(end * sr)] *= 10
+    return audio_data
+
+
+@pytest.mark.parametrize('profile', ['full', 'detailed'])
+def test_segments_merge_into_single_pass_features(monkeypatch, profile):
+    import analysis
+
+    monkeypatch.setattr(analysis, 'PARALLEL_MIN_SECONDS', 4)
+    sr = 16000
+    # The second burst spans the boundary between the first two segments
+    audio_data = burst_clip(sr, 12, [(1.0, 1.5), (3.5, 4.8), (9.0, 9.2)])
+    ranges = analysis.segment_plan(len(audio_data), sr, profile, 3)
+    assert len(ranges) == 3 and ranges[0][0] == 0 and ranges[-1][1] == frame_count(len(audio_data), HOP_LENGTH)
+    assert all(stop == first for (_, stop), (first, _) in zip(ranges, ranges[1:]))
+
+    mel_frames = np.empty(analysis.mel_shape(len(audio_data), profile), dtype=np.float32)
+    # Segments may finish in any order
+    partials = [analysis.extract_segment(audio_data, sr, profile, first, stop, mel_frames)
+                for first, stop in reversed(ranges)]
+    merged = analysis.merge_segments(len(audio_data), sr, profile, partials, mel_frames)
+    single = extract_audio_features(audio_data, sr, profile)
+
+    assert merged['segments'] == 3
+    np.testing.assert_allclose(merged['mfcc_features'], single['mfcc_features'], rtol=1e-6, atol=1e-5)
+    for name in ('spectral_centroid', 'spectral_rolloff', 'zero_crossing_rate'):
+        assert merged[name] == pytest.approx(single[name], rel=1e-9)
+    assert merged['events'] == single['events']
+    assert [(round(event['start'], 1), round(event['end'], 1)) for event in merged['events']] == [
+        (1.0, 1.5), (3.5, 4.8), (9.0, 9.2)
+    ]
+    if profile == 'detailed':
+        np.testing.assert_allclose(merged['frames']['mfcc'], single['frames']['mfcc'], rtol=1e-5, atol=1e-4)
+
+
+def test_short_and_quick_clips_are_not_split():
+    import analysis
+
+    sr = 16000
+    n_samples = int(analysis.PARALLEL_MIN_SECONDS * sr) - 1
+    assert analysis.segment_plan(n_samples, sr, 'full', 4) == []
+    assert analysis.segment_plan(n_samples * 10, sr, 'quick', 4) == []
+    assert analysis.segment_plan(n_samples * 10, sr, 'full', 1) == []
+    assert len(analysis.segment_plan(n_samples * 10, sr, 'full', 4)) == 4
@@ -0,0 +1,86 @@
+import time
+
+import numpy as np
+import pytest
+
+from analysis import QUICK_MAX_SECONDS, QUICK_SAMPLE_RATE, extract_audio_features
+from fidelity import FidelityController
+
+
+def clip(seconds, sr, frequency=440.0):
+    t = np.arange(int(seconds * sr)) / sr
+    return (0.5 * np.sin(2 * np.pi * frequency * t)).astype(np.float32)
+
+
+def test_quick_profile_analyses_a_shorter_downsampled_clip():
+    audio = clip(QUICK_MAX_SECONDS + 5, 44100)
+    full = extract_audio_features(audio, 44100)
+    quick = extract_audio_features(audio, 44100, profile='quick')
+
+    assert full['profile'] == 'full' and quick['profile'] == 'quick'
+    assert quick['sample_rate'] == QUICK_SAMPLE_RATE
+    assert quick['duration'] == pytest.approx(QUICK_MAX_SECONDS)
+    assert quick['source_duration'] == pytest.approx(full['duration'])
+    # A steady tone below the new Nyquist keeps its spectral shape
+    assert quick['spectral_centroid'] == pytest.approx(full['spectral_centroid'], rel=0.1)
+    assert quick['zero_crossing_rate'] * QUICK_SAMPLE_RATE == pytest.approx(full['zero_crossing_rate'] * 44100, rel=0.05)
+
+
+def test_detailed_profile_adds_per_frame_values_consistent_with_means():
+    sr = 16000
+    noise = 0.01 * np.random.default_rng(0).standard_normal(2 * sr).astype(np.float32)
+    features = extract_audio_features(clip(2, sr) + noise, sr, profile='detailed')
+    frames = features['frames']
+    n_frames = 1 + 2 * sr // 512
+
+    assert frames['hop_seconds'] == pytest.approx(512 / sr)
+    assert np.asarray(frames['mfcc']).shape == (13, n_frames)
+    np.testing.assert_allclose(np.mean(frames['mfcc'], axis=1), features['mfcc_features'], rtol=1e-4, atol=1e-3)
+    for name in ('spectral_centroid', 'spectral_rolloff', 'zero_crossing_rate'):
+        assert len(frames[name]) == n_frames
+        assert np.mean(frames[name]) == pytest.approx(features[name], rel=1e-4)
+    assert 'frames' not in extract_audio_features(clip(2, sr), sr)
+
+
+def test_unknown_profile_is_rejected():
+    assert extract_audio_features(clip(1, 8000), 8000, profile='fastest') is None
+    with pytest.raises(ValueError):
+        FidelityController().choose('fastest')
+
+
+def test_controller_degrades_on_queue_depth_with_hysteresis():
+    controller = FidelityController(mode='auto', quick_depth=4, quick_p95_ms=0)
+    tracked = [controller.track('full') for _ in range(4)]
+    for context in tracked:
+        context.__enter__()
+    assert controller.choose() == 'quick'
+
+    # Still degraded just under the threshold; recovers below half of it
+    tracked.pop().__exit__(None, None, None)
+    assert controller.choose() == 'quick'
+    for _ in range(2):
+        tracked.pop().__exit__(None, None, None)
+    assert controller.in_flight == 1
+    assert controller.choose() == 'full'
+    assert controller.stats()['degradations'] == 1
+    # An explicit request is honoured whatever the load
+    assert controller.choose('detailed') == 'detailed'
+
+
+def test_controller_degrades_on_full_analysis_p95():
+    controller = FidelityController(mode='auto', quick_depth=0, quick_p95_ms=100, window_seconds=60)
+    now = time.monotonic()
+    controller._latencies.extend((now, latency) for latency in [50] * 90 + [400] * 10)
+    assert controller.p95_ms() > 100
+    assert controller.choose() == 'quick'
+
+    # Once the slow samples age out of the window, full analysis resumes
+    controller._latencies.clear()
+    assert controller.choose() == 'full'
+    assert controller.stats()['profiles'] == {'quick': 1, 'full': 1, 'detailed': 0}
+
+
+def test_fixed_mode_ignores_load():
+    controller = FidelityController(mode='detailed', quick_depth=1)
+    controller.in_flight = 10
+    assert controller.choose() == 'detailed'
@@ -0,0 +1,105 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import resource_tracker
+
+import numpy as np
+import pytest
+
+from analysis import extract_audio_features
+from analysis_pool import AnalysisPool
+from pcm_shm import SEGMENT_PREFIX, SHM_DIR, PCMSegment, attach, sweep_segments, write_segment
+
+
+def segments_owned_by(pid):
+    return [name for name in os.listdir(SHM_DIR) if name.startswith(f"{SEGMENT_PREFIX}-{pid}-")]
+
+
+def tone(seconds=2, sr=8000):
+    t = np.arange(int(sr * seconds)) / sr
+    return (0.5 * np.sin(2 * np.pi * 120 * t)).astype(np.float32), sr
+
+
+def crash_while_attached(descriptor):
+    with attach(descriptor):
+        os._exit(1)
+
+
+def write_and_die(owner_pid):
+    """Leave a segment behind the way a worker killed before its reply would"""
+    descriptor = write_segment(np.ones(1000, dtype=np.float32), owner_pid)
+    # Nothing but the sweep may clean it up, as when the resource tracker died too
+    resource_tracker.unregister(f"/{descriptor.name}", 'shared_memory')
+    os._exit(1)
+
+
+def allocate_and_die():
+    """Leave a segment owned by a process that no longer exists (a killed API process)"""
+    owned = PCMSegment.allocate((1000,))
+    resource_tracker.unregister(f"/{owned.descriptor.name}", 'shared_memory')
+    os._exit(1)
+
+
+def run_child(target, *args):
+    # Start the tracker first so that the child shares it rather than spawning its own
+    resource_tracker.ensure_running()
+    process = multiprocessing.get_context('spawn').Process(target=target, args=args)
+    process.start()
+    process.join(timeout=60)
+    assert process.exitcode == 1
+    return process.pid
+
+
+def test_segment_is_unlinked_after_worker_analysis():
+    audio_data, sr = tone()
+
+    async def scenario():
+        pool = AnalysisPool(workers=1)
+        pool.start()
+        try:
+            with PCMSegment.from_array(audio_data) as segment:
+                assert segments_owned_by(os.getpid()) == [segment.descriptor.name]
+                return await pool.extract_features(segment, sr)
+        finally:
+            pool.stop()
+
+    assert asyncio.run(scenario()) == extract_audio_features(audio_data, sr)
+    assert segments_owned_by(os.getpid()) == []
+
+
+def test_segment_is_unlinked_when_worker_crashes():
+    audio_data, _ = tone()
+
+    async def scenario():
+        pool = AnalysisPool(workers=1)
+        pool.start()
+        try:
+            with PCMSegment.from_array(audio_data) as segment:
+                with pytest.raises(BrokenProcessPool):
+                    await pool.run(crash_while_attached, segment.descriptor)
+        finally:
+            pool.stop()
+
+    asyncio.run(scenario())
+    assert segments_owned_by(os.getpid()) == []
+
+
+def test_sweep_removes_segment_of_crashed_creator_only():
+    with PCMSegment.allocate((10,)) as live:
+        creator = run_child(write_and_die, os.getpid())
+        assert len(segments_owned_by(os.getpid())) == 2
+
+        assert sweep_segments(creator_pid=creator) == 1
+        # Adopted segments are never swept
+        assert segments_owned_by(os.getpid()) == [live.descriptor.name]
+    assert segments_owned_by(os.getpid()) == []
+
+
+def test_startup_sweep_removes_segments_of_dead_owners():
+    owner = run_child(allocate_and_die)
+    assert len(segments_owned_by(owner)) == 1
+    with PCMSegment.allocate((10,)) as live:
+        assert sweep_segments() >= 1
+        assert segments_owned_by(owner) == []
+        assert segments_owned_by(os.getpid()) == [live.descriptor.name]
@@ -0,0 +1,142 @@
+import asyncio
+
+import pytest
+
+from result_writer import ResultWriter
+
+
+class RecordingCollection:
+    """Stands in for a motor collection, recording each write call"""
+
+    def __init__(self, fail_times=0):
+        self.batches = []
+        self.single_inserts = 0
+        self.fail_times = fail_times
+
+    async def insert_one(self, document):
+        self.single_inserts += 1
+
+    async def insert_many(self, documents, ordered=True):
+        assert ordered is False
+        await asyncio.sleep(0)
+        if self.fail_times:
+            self.fail_times -= 1
+            raise ConnectionError("primary stepped down")
+        self.batches.append([document['id'] for document in documents])
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_direct_mode_inserts_each_result():
+    async def scenario():
+        collection = RecordingCollection()
+        writer = ResultWriter(collection, mode='direct')
+        writer.start()
+        for i in range(3):
+            await writer.write({'id': i})
+        await writer.stop()
+        return collection
+
+    collection = run(scenario())
+    assert collection.single_inserts == 3
+    assert collection.batches == []
+
+
+def test_ack_mode_groups_concurrent_writes_into_batches():
+    async def scenario():
+        collection = RecordingCollection()
+        writer = ResultWriter(collection, mode='ack', batch_size=10, flush_interval_ms=1000)
+        writer.start()
+        # Each write returns only once its batch is stored
+        await asyncio.gather(*(writer.write({'id': i}) for i in range(25)))
+        written_before_stop = sum(len(batch) for batch in collection.batches)
+        await writer.stop()
+        return collection, writer, written_before_stop
+
+    collection, writer, written_before_stop = run(scenario())
+    assert written_before_stop == 25
+    assert [len(batch) for batch in collection.batches] == [10, 10, 5]
+    assert writer.stats()['documents_written'] == 25
+
+
+def test_deferred_mode_flushes_on_interval_and_shutdown():
+    async def scenario():
+        collection = RecordingCollection()
+        writer = ResultWriter(collection, mode='deferred', batch_size=100, flush_interval_ms=10)
+        writer.start()
+        await writer.write({'id': 'a'})
+        assert collection.batches == []  # responded before persisting
+        await asyncio.sleep(0.05)
+        flushed_by_timer = list(collection.batches)
+        await writer.write({'id': 'b'})
+        await writer.stop()
+        return collection, flushed_by_timer, writer
+
+    collection, flushed_by_timer, writer = run(scenario())
+    assert flushed_by_timer == [['a']]
+    assert collection.batches == [['a'], ['b']]
+    assert writer.stats()['buffer_depth'] == 0
+
+
+def test_deferred_mode_retries_failed_batches():
+    async def scenario():
+        collection = RecordingCollection(fail_times=1)
+        writer = ResultWriter(collection, mode='deferred', batch_size=2, flush_interval_ms=5)
+        writer.start()
+        await writer.write({'id': 1})
+        await writer.write({'id': 2})
+        await asyncio.sleep(0.05)
+        await writer.stop()
+        return collection, writer
+
+    collection, writer = run(scenario())
+    assert collection.batches == [[1, 2]]
+    stats = writer.stats()
+    assert stats['failed_flushes'] == 1
+    assert stats['documents_dropped'] == 0
+
+
+def test_ack_mode_reports_write_failure_to_the_request():
+    async def scenario():
+        writer = ResultWriter(RecordingCollection(fail_times=1), mode='ack', batch_size=1)
+        writer.start()
+        try:
+            with pytest.raises(ConnectionError):
+                await writer.write({'id': 1})
+        finally:
+            await writer.stop()
+
+    run(scenario())
+
+
+def test_rejects_unknown_mode():
+    with pytest.raises(ValueError):
+        ResultWriter(RecordingCollection(), mode='eventually')
+
+
+def test_stop_during_slow_flush_drains_and_returns():
+    class SlowCollection(RecordingCollection):
+        def __init__(self):
+            super().__init__()
+            self.flushing = asyncio.Event()
+
+        async def insert_many(self, documents, ordered=True):
+            self.flushing.set()
+            await asyncio.sleep(0.05)
+            self.batches.append([document['id'] for document in documents])
+
+    async def scenario():
+        collection = SlowCollection()
+        writer = ResultWriter(collection, mode='deferred', batch_size=2, flush_interval_ms=1)
+        writer.start()
+        await writer.write({'id': 0})
+        await writer.write({'id': 1})
+        await collection.flushing.wait()
+        # The flush in progress empties the buffer; stop() must still return
+        await asyncio.wait_for(writer.stop(), timeout=2)
+        return collection
+
+    collection = run(scenario())
+    assert collection.batches == [[0, 1]]
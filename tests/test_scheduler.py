@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+
+from scheduler import AnalysisScheduler, estimate_cost
+from uploads import MAX_AUDIO_SECONDS, AudioProbe
+
+
+def run_jobs(scheduler, jobs, stagger=0.0):
+    """Run (name, priority, cost, duration) jobs behind one that holds the only slot; returns start order"""
+    order = []
+
+    async def job(name, priority, cost, duration):
+        async with scheduler.slot(priority, cost, duration):
+            order.append(name)
+            await asyncio.sleep(0)
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def blocker():
+            async with scheduler.slot('interactive', 1, 1):
+                await release.wait()
+
+        holder = asyncio.create_task(blocker())
+        await asyncio.sleep(0)
+        tasks = []
+        for spec in jobs:
+            tasks.append(asyncio.create_task(job(*spec)))
+            await asyncio.sleep(stagger)
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(holder, *tasks)
+
+    asyncio.run(scenario())
+    return order
+
+
+def test_interactive_then_shortest_first():
+    scheduler = AnalysisScheduler(slots=1, policy='sjf', aging_rate=1_000_000, bulk_delay=30)
+    order = run_jobs(scheduler, [
+        ('long', 'interactive', 600 * 44100, 600),
+        ('bulk-short', 'bulk', 3 * 44100, 3),
+        ('short-a', 'interactive', 3 * 44100, 3),
+        ('short-b', 'interactive', 2 * 16000, 2),
+    ])
+    assert order == ['short-b', 'short-a', 'long', 'bulk-short']
+    stats = scheduler.stats()
+    assert stats['running'] == 0 and stats['queued'] == 0
+    assert set(stats['classes']) == {'interactive/short', 'interactive/long', 'bulk/short'}
+    assert stats['classes']['interactive/short']['completed'] == 3
+
+
+def test_waiting_jobs_age_past_newer_short_ones():
+    # A 10 ms head start in cost is used up after 10 ms of waiting
+    scheduler = AnalysisScheduler(slots=1, policy='sjf', aging_rate=1000, bulk_delay=0)
+    order = run_jobs(scheduler, [('old-long', 'interactive', 10, 60), ('new-short', 'interactive', 0, 1)], stagger=0.05)
+    assert order == ['old-long', 'new-short']
+
+
+def test_fifo_policy_keeps_arrival_order():
+    scheduler = AnalysisScheduler(slots=1, policy='fifo')
+    order = run_jobs(scheduler, [('long', 'bulk', 10 ** 9, 600), ('short', 'interactive', 1, 1)])
+    assert order == ['long', 'short']
+
+
+def test_cancelled_waiter_does_not_leak_a_slot():
+    scheduler = AnalysisScheduler(slots=1)
+
+    async def scenario():
+        async with scheduler.slot('interactive', 1):
+            waiter = asyncio.create_task(scheduler.slot('interactive', 1).__aenter__())
+            await asyncio.sleep(0)
+            waiter.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiter
+        async with scheduler.slot('bulk', 1):
+            return scheduler.running
+
+    assert asyncio.run(scenario()) == 1
+    assert scheduler.running == 0
+
+
+def test_cost_estimate_from_headers():
+    assert estimate_cost(AudioProbe('wav', 2.0, 8000)) == 16000
+    assert estimate_cost(AudioProbe('webm', None, 48000)) == MAX_AUDIO_SECONDS * 48000
+    assert estimate_cost(AudioProbe('mp3', 1.0, None)) == 44100
+
+
+def test_unknown_priority_class_is_rejected():
+    async def scenario():
+        async with AnalysisScheduler().slot('urgent', 1):
+            pass
+    with pytest.raises(ValueError):
+        asyncio.run(scenario())
@@ -0,0 +1,96 @@
+import gzip
+import json
+from datetime import datetime
+
+import pytest
+from starlette.requests import Request
+
+import serialization
+from server import HealthScore
+
+LARGE = json.dumps([{'component': 'Brakes', 'severity': 'medium'}] * 50).encode()
+
+
+class FakeBrotli:
+    """Stands in for the optional brotli package"""
+
+    @staticmethod
+    def compress(body, quality):
+        return b'br:' + body
+
+
+def request_accepting(accept_encoding):
+    headers = [(b'accept-encoding', accept_encoding.encode())] if accept_encoding is not None else []
+    return Request({'type': 'http', 'headers': headers})
+
+
+def test_dumps_matches_fastapi_json_for_stored_documents():
+    doc = {'id': 'v1', 'year': 2015, 'created_at': datetime(2024, 3, 5, 14, 37, 12, 250000),
+           'scores': HealthScore(overall_score=80, engine_health=90, brake_health=70, transmission_health=85,
+                                 exhaust_health=75, last_updated=datetime(2024, 3, 5))}
+    decoded = json.loads(serialization.dumps(doc))
+    assert decoded['created_at'] == '2024-03-05T14:37:12.250000'
+    assert decoded['scores']['last_updated'] == '2024-03-05T00:00:00'
+
+
+def test_compress_only_large_bodies_with_accepted_encoding(monkeypatch):
+    monkeypatch.setattr(serialization, 'RESPONSE_COMPRESS_MIN_BYTES', 100)
+    monkeypatch.setattr(serialization, 'brotli', None)
+    small, large = b'[]', json.dumps([{'component': 'Brakes'}] * 50).encode()
+
+    assert serialization.compress(small, {'gzip'}) == (small, None)
+    assert serialization.compress(large, set()) == (large, None)
+    body, encoding = serialization.compress(large, {'gzip', 'br'})
+    assert encoding == 'gzip' and gzip.decompress(body) == large
+
+
+@pytest.mark.parametrize('accept_encoding, expected', [
+    ('br, gzip', 'br'),
+    ('gzip;q=1.0, br;q=0.5', 'br'),
+    ('GZIP, deflate', 'gzip'),
+    ('br;q=0, gzip', 'gzip'),
+    ('identity', None),
+    ('', None),
+    (None, None),
+])
+def test_response_encoding_follows_accept_encoding(monkeypatch, accept_encoding, expected):
+    monkeypatch.setattr(serialization, 'RESPONSE_COMPRESS_MIN_BYTES', 100)
+    monkeypatch.setattr(serialization, 'brotli', FakeBrotli)
+    response = serialization.encoded_response(LARGE, request_accepting(accept_encoding))
+
+    assert response.headers['vary'] == 'Accept-Encoding'
+    assert response.headers.get('content-encoding') == expected
+    decoded = {'br': lambda body: body[len(b'br:'):], 'gzip': gzip.decompress, None: lambda body: body}[expected]
+    assert decoded(response.body) == LARGE
+
+
+def test_brotli_falls_back_to_gzip_when_not_installed(monkeypatch):
+    monkeypatch.setattr(serialization, 'RESPONSE_COMPRESS_MIN_BYTES', 100)
+    monkeypatch.setattr(serialization, 'brotli', None)
+    response = serialization.encoded_response(LARGE, request_accepting('br, gzip'))
+    assert response.headers['content-encoding'] == 'gzip'
+    assert serialization.encoded_response(LARGE, request_accepting('br')).headers.get('content-encoding') is None
+
+
+@pytest.mark.parametrize('min_bytes', [len(LARGE) + 1, 0])
+def test_small_bodies_and_disabled_compression_are_sent_as_is(monkeypatch, min_bytes):
+    monkeypatch.setattr(serialization, 'RESPONSE_COMPRESS_MIN_BYTES', min_bytes)
+    response = serialization.encoded_response(LARGE, request_accepting('gzip'))
+    assert 'content-encoding' not in response.headers
+    assert response.body == LARGE
+
+
+def test_stdlib_json_fallback_without_orjson(monkeypatch):
+    doc = {'id': 'v1', 'created_at': datetime(2024, 3, 5, 14, 37, 12, 250000), 'tags': ['a', 'ü'],
+           'scores': HealthScore(overall_score=80, engine_health=90, brake_health=70, transmission_health=85,
+                                 exhaust_health=75, last_updated=datetime(2024, 3, 5))}
+    with_orjson = serialization.dumps(doc)
+    monkeypatch.setattr(serialization, 'orjson', None)
+    without_orjson = serialization.dumps(doc)
+
+    assert isinstance(without_orjson, bytes)
+    assert json.loads(without_orjson) == json.loads(with_orjson)
+    response = serialization.json_response(doc)
+    assert json.loads(response.body) == json.loads(with_orjson)
+    with pytest.raises(TypeError):
+        serialization.dumps({'value': object()})
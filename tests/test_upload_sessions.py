@@ -0,0 +1,185 @@
+import asyncio
+import io
+import os
+import time
+
+import numpy as np
+import pytest
+import soundfile as sf
+from fastapi import HTTPException
+
+from analysis import extract_audio_features
+from analysis_pool import AnalysisPool
+from decoders import decode_soundfile
+from scheduler import AnalysisScheduler
+from upload_sessions import UploadSessions, add_range, covers, missing_ranges
+
+
+def wav_bytes(seconds, sr=8000, subtype='PCM_16'):
+    t = np.arange(int(sr * seconds)) / sr
+    tone = 0.5 * np.sin(2 * np.pi * 120 * t) * (t % 3 < 1) + 0.05 * np.random.default_rng(0).standard_normal(len(t))
+    buf = io.BytesIO()
+    sf.write(buf, tone, sr, format='WAV', subtype=subtype)
+    return buf.getvalue()
+
+
+async def chunks(data, size=4096):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def store(tmp_path):
+    return UploadSessions(AnalysisPool(workers=0), AnalysisScheduler(slots=1), directory=str(tmp_path))
+
+
+async def upload(sessions, session, data, ranges):
+    for start, end in ranges:
+        await sessions.write(session, start, end, chunks(data[start:end]))
+        sessions.advance(session)
+        await asyncio.sleep(0)
+
+
+def test_range_bookkeeping():
+    ranges = []
+    for start, end in [(10, 20), (30, 40), (20, 25), (0, 5), (24, 30)]:
+        ranges = add_range(ranges, start, end)
+    assert ranges == [[0, 5], [10, 40]]
+    assert missing_ranges(ranges, 50) == [[5, 10], [40, 50]]
+    assert covers(ranges, 12, 40) and not covers(ranges, 3, 12)
+
+
+@pytest.mark.parametrize('profile', ['full', 'detailed'])
+def test_streamed_segments_merge_to_single_pass_features(tmp_path, profile):
+    data = wav_bytes(30)
+    step = 20_000
+    ranges = [(start, min(start + step, len(data))) for start in range(0, len(data), step)]
+    ranges = ranges[::2] + ranges[1::2]  # every other chunk, then the gaps
+
+    async def scenario():
+        sessions = store(tmp_path)
+        session = sessions.create('clip.wav', len(data), profile=profile)
+        await upload(sessions, session, data, ranges)
+        await sessions.settle(session)
+        return sessions, session, await sessions.features(session)
+
+    sessions, session, features = asyncio.run(scenario())
+    assert session.streaming and len(session.segments) > 2
+    assert sessions.segments_while_uploading == len(session.segments)
+    assert sessions.segments_at_finalize == 0
+
+    audio_data, sr = decode_soundfile(io.BytesIO(data))
+    expected = extract_audio_features(audio_data, sr, profile)
+    frames = features.pop('frames', None)
+    expected_frames = expected.pop('frames', None)
+    assert features.pop('segments') == len(session.segments)
+    assert features == expected
+    assert frames == expected_frames
+
+
+def test_session_resumes_from_disk(tmp_path):
+    data = wav_bytes(20)
+    half = len(data) // 2
+
+    async def first_connection():
+        sessions = store(tmp_path)
+        session = sessions.create('clip.wav', len(data))
+        await upload(sessions, session, data, [(0, half)])
+        await sessions.settle(session)
+        return session.id, len(session.partials)
+
+    async def after_restart(upload_id):
+        sessions = store(tmp_path)
+        session = sessions.get(upload_id)
+        assert session.received == [[0, half]]
+        assert len(session.partials) == analysed
+        await upload(sessions, session, data, [(half, len(data))])
+        await sessions.settle(session)
+        return await sessions.features(session)
+
+    upload_id, analysed = asyncio.run(first_connection())
+    assert analysed > 0
+    features = asyncio.run(after_restart(upload_id))
+    audio_data, sr = decode_soundfile(io.BytesIO(data))
+    features.pop('segments')
+    assert features == extract_audio_features(audio_data, sr)
+
+
+def test_dropped_connection_keeps_received_bytes(tmp_path):
+    data = wav_bytes(5)
+
+    async def dropped():
+        yield data[:5000]
+        raise ConnectionError("client went away")
+
+    async def scenario():
+        sessions = store(tmp_path)
+        session = sessions.create('clip.wav', len(data))
+        with pytest.raises(ConnectionError):
+            await sessions.write(session, 0, len(data), dropped())
+        return session
+
+    session = asyncio.run(scenario())
+    assert session.received == [[0, 5000]]
+
+
+def test_rejects_non_audio_and_unsupported_layouts(tmp_path):
+    async def scenario():
+        sessions = store(tmp_path)
+        junk = sessions.create('clip.wav', 4096)
+        await sessions.write(junk, 0, 4096, chunks(b'\0' * 4096))
+        with pytest.raises(HTTPException):
+            sessions.advance(junk)
+
+        ulaw = wav_bytes(5, subtype='ULAW')
+        session = sessions.create('clip.wav', len(ulaw))
+        await upload(sessions, session, ulaw, [(0, len(ulaw))])
+        return session
+
+    session = asyncio.run(scenario())
+    assert session.format == 'wav' and session.streaming is False
+
+
+def test_idle_sessions_expire(tmp_path):
+    sessions = store(tmp_path)
+    session = sessions.create('clip.wav', 100)
+    sessions.ttl_seconds = 60
+    stale = time.time() - 120
+    session.updated_at = stale
+    for name in os.listdir(tmp_path):
+        os.utime(tmp_path / name, (stale, stale))
+
+    sessions.sweep()
+    assert os.listdir(tmp_path) == []
+    assert sessions.get(session.id) is None
+    assert sessions.get('../etc/passwd') is None
+
+
+def test_processes_sharing_a_session_keep_each_others_ranges(tmp_path):
+    data = wav_bytes(20)
+    half = len(data) // 2
+
+    async def scenario():
+        # Two API processes, each with its own copy of the session
+        first, second = store(tmp_path), store(tmp_path)
+        session = first.create('clip.wav', len(data))
+        other = second.get(session.id)
+
+        await upload(first, session, data, [(0, half)])
+        # The second copy predates that write; saving it must not drop the first half
+        await upload(second, other, data, [(half, len(data))])
+        assert other.received == [[0, len(data)]]
+        assert first.get(session.id).received == [[0, len(data)]]
+
+        await first.settle(session)
+        await second.settle(other)
+        features = await first.features(first.get(session.id))
+        second.complete(other)
+        return first, session, features
+
+    first, session, features = asyncio.run(scenario())
+    audio_data, sr = decode_soundfile(io.BytesIO(data))
+    features.pop('segments')
+    assert features == extract_audio_features(audio_data, sr)
+    # Completed by the other process
+    assert first.get(session.id) is None
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,273 @@
+import asyncio
+import io
+import os
+import struct
+import wave
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+import uploads
+
+
+def make_wav_bytes(seconds=1.0, sample_rate=22050):
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'w') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(b'\x00\x00' * int(seconds * sample_rate))
+    return buffer.getvalue()
+
+
+def test_sniff_format_recognises_containers():
+    assert uploads.sniff_format(make_wav_bytes()[:1024]) == 'wav'
+    assert uploads.sniff_format(b'fLaC' + b'\x00' * 40) == 'flac'
+    assert uploads.sniff_format(b'OggS' + b'\x00' * 40) == 'ogg'
+    assert uploads.sniff_format(b'\x00\x00\x00\x20ftypM4A ' + b'\x00' * 20) == 'm4a'
+    assert uploads.sniff_format(b'ID3\x04\x00' + b'\x00' * 20) == 'mp3'
+    # MPEG-1 Layer III, 128 kbps, 44.1 kHz frame header
+    assert uploads.sniff_format(b'\xff\xfb\x90\x64' + b'\x00' * 20) == 'mp3'
+
+
+def test_sniff_format_rejects_non_audio():
+    assert uploads.sniff_format(b'<html><body>not audio</body></html>') is None
+    assert uploads.sniff_format(b'\x7fELF' + b'\x00' * 60) is None
+
+
+def test_wav_duration_from_header_prefix():
+    probe = uploads.parse_header('wav', make_wav_bytes(seconds=2.5)[:1024])
+    assert probe.duration == pytest.approx(2.5)
+    assert probe.sample_rate == 22050
+    assert probe.channels == 1
+
+
+def test_flac_streaminfo_duration():
+    packed = (44100 << 44) | (1 << 41) | (15 << 36) | (44100 * 4)
+    head = b'fLaC' + bytes([0x80, 0, 0, 34]) + b'\x00' * 10 + packed.to_bytes(8, 'big') + b'\x00' * 16
+    probe = uploads.parse_header('flac', head)
+    assert probe.duration == pytest.approx(4.0)
+    assert probe.channels == 2
+
+
+def test_mp4_duration_from_moov_at_end(tmp_path):
+    mvhd_payload = b'\x00' * 4 + b'\x00' * 8 + struct.pack('>II', 1000, 12500) + b'\x00' * 80
+    mvhd = struct.pack('>I4s', 8 + len(mvhd_payload), b'mvhd') + mvhd_payload
+    moov = struct.pack('>I4s', 8 + len(mvhd), b'moov') + mvhd
+    ftyp = struct.pack('>I4s', 16, b'ftyp') + b'M4A \x00\x00\x00\x00'
+    mdat = struct.pack('>I4s', 8 + 4096, b'mdat') + b'\x00' * 4096
+    path = tmp_path / 'clip.m4a'
+    path.write_bytes(ftyp + mdat + moov)
+    assert uploads.probe_file(str(path), 'm4a').duration == pytest.approx(12.5)
+
+
+def ebml(element_id, payload=b'', size=None):
+    """One EBML element; `size` overrides the encoded length (0xFF = unknown size)"""
+    size = bytes([size]) if size is not None else bytes([0x80 | len(payload)])
+    return element_id.to_bytes((element_id.bit_length() + 7) // 8, 'big') + size + payload
+
+
+def make_webm_head(seconds=12.5, sample_rate=48000, channels=2):
+    info = ebml(0x2AD7B1, (1000000).to_bytes(3, 'big')) + ebml(0x4489, struct.pack('>d', seconds * 1000))
+    audio = ebml(0xB5, struct.pack('>f', sample_rate)) + ebml(0x9F, bytes([channels]))
+    tracks = ebml(0x1654AE6B, ebml(0xAE, ebml(0xE1, audio)))
+    header = ebml(0x1A45DFA3, ebml(0x4282, b'webm'))
+    # Live recorders leave the Segment size unknown
+    return header + ebml(0x18538067, size=0xFF) + ebml(0x1549A966, info) + tracks + ebml(0x1F43B675, size=0xFF)
+
+
+def ogg_page(packet=b'', granule=0):
+    return b'OggS\x00\x02' + struct.pack('<q', granule) + b'\x00' * 12 + bytes([1, len(packet)]) + packet
+
+
+def vorbis_id(sample_rate=44100, channels=2):
+    return b'\x01vorbis' + struct.pack('<I', 0) + bytes([channels]) + struct.pack('<I', sample_rate) + b'\x00' * 13
+
+
+def opus_head(pre_skip=312, channels=1):
+    return b'OpusHead\x01' + bytes([channels]) + struct.pack('<HI', pre_skip, 16000) + b'\x00' * 3
+
+
+def test_webm_header_reports_duration_and_track():
+    head = make_webm_head()
+    assert uploads.sniff_format(head) == 'webm'
+    assert uploads.parse_header('webm', head) == uploads.AudioProbe('webm', 12.5, 48000, 2)
+
+
+@pytest.mark.parametrize('cut, expected', [
+    (6, (None, None, None)),  # inside the EBML header
+    (30, (None, None, None)),  # inside Info, before Duration is complete
+    (46, (12.5, None, None)),  # right after the Tracks element id
+    (-8, (12.5, 48000, None)),  # inside the Channels element
+])
+def test_truncated_webm_header_reports_what_arrived(cut, expected):
+    assert uploads.parse_header('webm', make_webm_head()[:cut]) == uploads.AudioProbe('webm', *expected)
+
+
+def test_mislabelled_webm_header_is_not_probed():
+    for head in (b'\x1a\x45\xdf\xa3' + b'\x00' * 20, make_wav_bytes()[:1024], b''):
+        assert uploads.parse_header('webm', head) == uploads.AudioProbe('webm')
+
+
+def test_ogg_vorbis_and_opus_durations(tmp_path):
+    path = tmp_path / 'clip.ogg'
+    path.write_bytes(ogg_page(vorbis_id()) + b'\x00' * 100_000 + ogg_page(granule=44100 * 3))
+    assert uploads.probe_file(path, 'ogg') == uploads.AudioProbe('ogg', 3.0, 44100, 2)
+
+    # Opus granules count 48 kHz samples whatever the input rate, less the pre-skip
+    path.write_bytes(ogg_page(opus_head()) + ogg_page(granule=48000 * 2 + 312))
+    assert uploads.probe_file(path, 'ogg') == uploads.AudioProbe('ogg', 2.0, 16000, 1)
+
+
+def test_truncated_ogg_leaves_duration_unknown(tmp_path):
+    path = tmp_path / 'clip.ogg'
+    # Cut inside the identification packet
+    path.write_bytes(ogg_page(vorbis_id())[:35])
+    assert uploads.probe_file(path, 'ogg') == uploads.AudioProbe('ogg')
+    # Cut before the last page's granule position
+    path.write_bytes(ogg_page(vorbis_id()) + ogg_page(granule=44100)[:10])
+    assert uploads.probe_file(path, 'ogg') == uploads.AudioProbe('ogg', None, 44100, 2)
+
+
+def test_mislabelled_ogg_is_not_probed(tmp_path):
+    path = tmp_path / 'clip.ogg'
+    # An Ogg page carrying neither Vorbis nor Opus, e.g. a Theora video stream
+    path.write_bytes(ogg_page(b'\x80theora' + b'\x00' * 40) + ogg_page(granule=1000))
+    assert uploads.probe_file(path, 'ogg') == uploads.AudioProbe('ogg')
+    path.write_bytes(make_wav_bytes())
+    assert uploads.probe_file(path, 'ogg') == uploads.AudioProbe('ogg')
+
+
+def test_duration_cap(monkeypatch):
+    monkeypatch.setattr(uploads, 'MAX_AUDIO_SECONDS', 1.0)
+    with pytest.raises(uploads.HTTPException) as exc_info:
+        uploads.check_duration(uploads.AudioProbe('wav', 2.0))
+    assert exc_info.value.status_code == 413
+
+
+def make_app():
+    app = FastAPI()
+
+    @app.post("/api/upload")
+    async def upload(request: Request):
+        temp_path, probe, _, _ = await uploads.receive_form_upload(request)
+        os.remove(temp_path)
+        return {'format': probe.format, 'duration': probe.duration}
+
+    app.add_middleware(uploads.UploadSizeLimitMiddleware, paths=["/api/upload"], max_body_bytes=64 * 1024)
+    return app
+
+
+def test_form_upload_rejects_renamed_file():
+    client = TestClient(make_app())
+    response = client.post("/api/upload", files={'file': ('engine.wav', b'not really audio' * 10)})
+    assert response.status_code == 400
+    response = client.post("/api/upload", files={'file': ('engine.exe', make_wav_bytes(seconds=1.0))})
+    assert response.status_code == 400
+
+
+def test_form_upload_accepts_wav():
+    client = TestClient(make_app())
+    response = client.post("/api/upload", files={'file': ('engine.wav', make_wav_bytes(seconds=1.0))})
+    assert response.status_code == 200
+    assert response.json() == {'format': 'wav', 'duration': pytest.approx(1.0)}
+
+
+def test_middleware_rejects_oversized_body():
+    client = TestClient(make_app())
+    response = client.post("/api/upload", files={'file': ('engine.wav', make_wav_bytes(seconds=5.0))})
+    assert response.status_code == 413
+
+
+class StreamingRequest:
+    """Stands in for a Starlette request whose body arrives in chunks; counts what was read"""
+
+    def __init__(self, body, boundary=b'XyZ', chunk_size=4096):
+        self.headers = {'content-type': f"multipart/form-data; boundary={boundary.decode()}"}
+        self.body = body
+        self.chunk_size = chunk_size
+        self.bytes_read = 0
+
+    async def stream(self):
+        for start in range(0, len(self.body), self.chunk_size):
+            chunk = self.body[start:start + self.chunk_size]
+            self.bytes_read += len(chunk)
+            yield chunk
+
+
+def multipart_body(file_bytes, fields=None, boundary=b'XyZ', filename='engine.wav'):
+    parts = []
+    for name, value in (fields or {}).items():
+        parts.append(b'--' + boundary + b'\r\nContent-Disposition: form-data; name="' + name.encode()
+                     + b'"\r\n\r\n' + value.encode() + b'\r\n')
+    parts.append(b'--' + boundary + b'\r\nContent-Disposition: form-data; name="file"; filename="' + filename.encode() + b'"\r\n'
+                 b'Content-Type: audio/wav\r\n\r\n' + file_bytes + b'\r\n')
+    return b''.join(parts) + b'--' + boundary + b'--\r\n'
+
+
+def receive(request, on_file=None):
+    return asyncio.run(uploads.receive_form_upload(request, on_file))
+
+
+def test_form_upload_returns_file_and_fields():
+    request = StreamingRequest(multipart_body(make_wav_bytes(seconds=1.0), {'vehicle_id': 'v1', 'priority': 'bulk'}))
+    temp_path, probe, filename, fields = receive(request)
+    try:
+        assert probe.format == 'wav' and probe.duration == pytest.approx(1.0)
+        assert filename == 'engine.wav'
+        assert fields == {'vehicle_id': 'v1', 'priority': 'bulk'}
+        assert open(temp_path, 'rb').read() == make_wav_bytes(seconds=1.0)
+    finally:
+        os.remove(temp_path)
+
+
+def test_form_upload_rejects_non_audio_from_first_bytes():
+    request = StreamingRequest(multipart_body(b'<html>' + b'x' * 1_000_000))
+    with pytest.raises(uploads.HTTPException) as exc_info:
+        receive(request)
+    assert exc_info.value.status_code == 400
+    # Refused on the first chunks, not after the whole megabyte
+    assert request.bytes_read <= 2 * request.chunk_size
+
+
+def test_form_upload_rejects_overlong_audio_from_header(monkeypatch):
+    monkeypatch.setattr(uploads, 'MAX_AUDIO_SECONDS', 1.0)
+    request = StreamingRequest(multipart_body(make_wav_bytes(seconds=20.0)))
+    with pytest.raises(uploads.HTTPException) as exc_info:
+        receive(request)
+    assert exc_info.value.status_code == 413
+    assert request.bytes_read <= 2 * request.chunk_size
+
+
+def test_form_upload_stops_at_byte_cap(monkeypatch):
+    monkeypatch.setattr(uploads, 'MAX_UPLOAD_BYTES', 100_000)
+    request = StreamingRequest(multipart_body(make_wav_bytes(seconds=0.5) + b'\x00' * 400_000))
+    with pytest.raises(uploads.HTTPException) as exc_info:
+        receive(request)
+    assert exc_info.value.status_code == 413
+    assert request.bytes_read < 110_000
+
+
+def test_form_upload_rejects_extension_before_reading_the_file():
+    request = StreamingRequest(multipart_body(make_wav_bytes(seconds=5.0), filename='engine.exe'))
+    with pytest.raises(uploads.HTTPException) as exc_info:
+        receive(request)
+    assert exc_info.value.status_code == 400
+    assert request.bytes_read == request.chunk_size
+
+
+def test_on_file_sees_fields_sent_ahead_of_the_file():
+    seen = []
+
+    async def on_file(filename, fields):
+        seen.append((filename, fields))
+        if fields.get('vehicle_id') == 'unknown':
+            raise uploads.HTTPException(status_code=404, detail="Vehicle not found")
+
+    request = StreamingRequest(multipart_body(make_wav_bytes(seconds=5.0), {'vehicle_id': 'unknown'}))
+    with pytest.raises(uploads.HTTPException) as exc_info:
+        receive(request, on_file)
+    assert exc_info.value.status_code == 404
+    assert seen == [('engine.wav', {'vehicle_id': 'unknown'})]
+    assert request.bytes_read == request.chunk_size
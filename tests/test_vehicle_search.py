@@ -0,0 +1,81 @@
+from datetime import datetime
+from itertools import product
+
+import pytest
+
+from vehicle_search import (
+    SORT, VEHICLE_INDEXES, InvalidCursor, PageCache, build_query, decode_cursor, encode_cursor, search_keys,
+)
+
+
+def test_cursor_round_trips_created_at_and_id():
+    vehicle = {'id': 'b7c1', 'created_at': datetime(2024, 3, 5, 12, 0, 0, 123000)}
+    assert decode_cursor(encode_cursor(vehicle)) == (vehicle['created_at'], 'b7c1')
+    with pytest.raises(InvalidCursor):
+        decode_cursor('not-a-cursor')
+
+
+def test_query_resumes_strictly_after_cursor():
+    created_at = datetime(2024, 3, 5, 12)
+    cursor = encode_cursor({'id': 'v9', 'created_at': created_at})
+    assert build_query(cursor=cursor)['$or'] == [
+        {'created_at': {'$lt': created_at}},
+        {'created_at': created_at, 'id': {'$lt': 'v9'}},
+    ]
+
+
+def test_query_filters_use_lowercase_keys_and_escaped_prefixes():
+    query = build_query(make='Mercedes-Benz', model='C.', prefix=True, year_min=2015, mileage_max=80000)
+    assert query == {
+        'make_key': {'$regex': '^mercedes\\-benz'},
+        'model_key': {'$regex': '^c\\.'},
+        'year': {'$gte': 2015},
+        'mileage': {'$lte': 80000},
+    }
+    assert build_query(make='Ford')['make_key'] == 'ford'
+    assert search_keys({'make': 'Ford', 'model': 'F-150'}) == {'make_key': 'ford', 'model_key': 'f-150'}
+
+
+def sort_backed_indexes(query):
+    """Indexes that serve `query` in sort order with every filter checked on index keys"""
+    equality = {field for field, condition in query.items() if not isinstance(condition, dict)}
+    matches = []
+    for keys in VEHICLE_INDEXES:
+        fields = [field for field, _ in keys]
+        lead = fields.index(SORT[0][0])
+        if (set(fields[:lead]) <= equality and keys[lead:lead + len(SORT)] == SORT
+                and set(query) - {'$or'} <= set(fields)):
+            matches.append(keys)
+    return matches
+
+
+@pytest.mark.parametrize('make, model, years, mileage', list(product(
+    [None, 'Ford'], [None, 'F-150'], [(None, None), (2018, 2018), (2015, 2020)], [(None, None), (0, 80000)],
+)))
+def test_exact_filters_are_index_backed(make, model, years, mileage):
+    cursor = encode_cursor({'id': 'v9', 'created_at': datetime(2024, 3, 5)})
+    query = build_query(make, model, False, *years, *mileage, cursor=cursor)
+    assert sort_backed_indexes(query)
+
+
+def test_single_year_is_an_equality():
+    query = build_query(year_min=2018, year_max=2018)
+    assert query == {'year': 2018}
+    # so a single year seeks straight to its vehicles instead of filtering the whole listing
+    assert any(keys[0] == ('year', 1) for keys in sort_backed_indexes(query))
+
+
+def test_page_cache_expires_and_clears_on_invalidate(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('vehicle_search.time.monotonic', lambda: now[0])
+    cache = PageCache(max_entries=2, ttl=10)
+    key = cache.key(make='ford', limit=100, cursor=None)
+
+    cache.put(key, (b'[]', None))
+    assert cache.get(key) == (b'[]', None)
+    now[0] += 11
+    assert cache.get(key) is None
+
+    cache.put(key, (b'[]', None))
+    cache.invalidate()
+    assert cache.get(key) is None
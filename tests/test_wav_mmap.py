@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+import soundfile as sf
+
+from analysis import extract_audio_features, segment_plan
+from decoders import decode_soundfile
+from wav_mmap import read_layout, wav_file
+
+
+def write_clip(path, subtype, channels=1, sr=22050, seconds=2):
+    t = np.arange(int(sr * seconds)) / sr
+    tone = 0.5 * np.sin(2 * np.pi * 120 * t) + 0.05 * np.random.default_rng(0).standard_normal(len(t))
+    sf.write(path, np.tile(tone[:, None], (1, channels)) * np.linspace(1, 0.5, channels), sr, subtype=subtype)
+    return path
+
+
+@pytest.mark.parametrize('subtype', ['PCM_U8', 'PCM_16', 'PCM_24', 'PCM_32', 'FLOAT', 'DOUBLE'])
+@pytest.mark.parametrize('channels', [1, 2])
+def test_reader_matches_decoder(tmp_path, subtype, channels):
+    path = write_clip(tmp_path / 'clip.wav', subtype, channels)
+    expected, sr = decode_soundfile(str(path))
+
+    wav = read_layout(path)
+    assert (wav.frames, wav.channels, wav.sample_rate) == (len(expected), channels, sr)
+    with wav.open() as reader:
+        np.testing.assert_array_equal(reader[:], expected)
+        np.testing.assert_array_equal(reader[1000:1500], expected[1000:1500])
+
+
+def test_features_match_decoded_clip(tmp_path):
+    path = write_clip(tmp_path / 'clip.wav', 'PCM_16', channels=2, seconds=5)
+    audio_data, sr = decode_soundfile(str(path))
+    with read_layout(path).open() as reader:
+        assert extract_audio_features(reader, sr) == extract_audio_features(audio_data, sr)
+
+
+def test_segments_plan_over_reader(tmp_path):
+    path = write_clip(tmp_path / 'clip.wav', 'PCM_16', sr=8000, seconds=90)
+    wav = read_layout(path)
+    assert segment_plan(wav.frames, wav.sample_rate, 'full', 4)
+
+
+def test_small_or_unsupported_files_are_decoded(tmp_path):
+    pcm = write_clip(tmp_path / 'clip.wav', 'PCM_16')
+    assert wav_file(pcm, min_bytes=pcm.stat().st_size + 1) is None
+    assert wav_file(pcm, min_bytes=0) is None
+    assert wav_file(pcm, min_bytes=1) is not None
+
+    ulaw = write_clip(tmp_path / 'ulaw.wav', 'ULAW')
+    assert read_layout(ulaw) is None
+    flac = write_clip(tmp_path / 'clip.flac', 'PCM_16')
+    assert read_layout(flac) is None